@@ -48,6 +48,34 @@ learning_config = {
     # Optimizer
     'get_optimizer'    : GET_OPTIMIZER,
     'observe_units'    : True,
+    # Memory
+    'compact_dtypes'   : False,
+    'store_ancestors_pos' : True,
+    # Speed (compilation of sampling step : None, "trace" or "compile", see learn.make_sampling_step)
+    'compile_sampling_step' : None,
+    # Memory (re-running model on elite candidates only to compute gradients, see learn.learner)
+    'recompute_elite' : False,
+    # Number of micro-batches of batch_size programs sampled per epoch (effective batch size = n_micro_batches *
+    # batch_size with a peak memory of a batch_size batch, see learn.learner)
+    'n_micro_batches' : 1,
+    # Experimental speed (computing rewards of an epoch while sampling the next one in a thread, one-epoch lagged
+    # updates, see learn.learner)
+    'pipelined' : False,
+    # Speed (each rank of an initialized torch.distributed process group samples a shard of batch_size, see
+    # learn.learner)
+    'data_parallel' : False,
+    # Max nb. of best programs kept across epochs and replayed in elite candidates without being evaluated again (0 :
+    # no replay, see learn.learner)
+    'replay_size' : 0,
+    # Speed (initial max_time_step increased by max_time_step_growth up to max_time_step when a fraction
+    # max_time_step_trigger of elite candidates reach it, None : fixed max_time_step, see learn.learner)
+    'initial_max_time_step' : None,
+    'max_time_step_growth'  : 5,
+    'max_time_step_trigger' : 0.1,
+    # Speed (only evaluating the fraction of programs having the highest rewards predicted by a surrogate model plus a
+    # random exploration fraction of the others, None : all programs are evaluated, see learn.learner)
+    'surrogate_fraction'    : None,
+    'surrogate_exploration' : 0.1,
 }
 
 # ---------- FREE CONSTANT OPTIMIZATION CONFIG ----------
@@ -84,6 +112,8 @@ cell_config = {
     "hidden_size" : 128,
     "n_layers"    : 1,
     "is_lobotomized" : False,
+    # Size of parent, sibling and previous tokens embeddings (None: tokens are observed as one-hots)
+    "tokens_embedding_size" : None,
 }
 
 # ---------- RUN CONFIG ----------
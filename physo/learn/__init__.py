@@ -2,3 +2,7 @@ from . import rnn
 from . import loss
 from . import learn
 from . import monitoring
+from . import checkpoint
+from . import migration
+from . import replay
+from . import surrogate
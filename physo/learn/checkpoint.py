@@ -0,0 +1,130 @@
+import os
+import random
+import torch
+import numpy as np
+
+# Internal imports
+from physo.physym import program as Prog
+
+
+def program_to_state(prog):
+    """
+    Returns a picklable state of a program (programs can not be pickled as is as they hold the library and the
+    candidate wrapper). Free constants are copied so the state does not change if the batch the program comes from
+    is reset.
+    Parameters
+    ----------
+    prog : program.Program
+        Program to export.
+    Returns
+    -------
+    state : dict
+        State of program (names of tokens, free constants related values and physicality).
+    """
+    state = {
+        "tokens_names"      : [tok.name for tok in prog.tokens],
+        "is_physical"       : prog.is_physical,
+        "free_const_values" : None if prog.free_const_values is None else prog.free_const_values.detach().clone(),
+        "is_opti"           : None if prog.is_opti           is None else np.array(prog.is_opti),
+        "opti_steps"        : None if prog.opti_steps        is None else np.array(prog.opti_steps),
+    }
+    return state
+
+
+def program_from_state(state, library, candidate_wrapper = None):
+    """
+    Returns program from its state (see program_to_state).
+    Parameters
+    ----------
+    state : dict
+        State of program.
+    library : library.Library
+        Library of tokens the program was made of.
+    candidate_wrapper : callable or None, optional
+        Wrapper to apply to candidate program's output (see program.Program).
+    Returns
+    -------
+    prog : program.Program
+        Program.
+    """
+    idx    = [library.lib_name_to_idx[name] for name in state["tokens_names"]]
+    tokens = library.lib_tokens[idx]
+    prog = Prog.Program(tokens            = tokens,
+                        library           = library,
+                        is_physical       = state["is_physical"],
+                        free_const_values = state["free_const_values"],
+                        is_opti           = state["is_opti"],
+                        opti_steps        = state["opti_steps"],
+                        candidate_wrapper = candidate_wrapper,
+                        )
+    return prog
+
+
+def get_rng_state():
+    """
+    Returns states of random number generators in use (torch, torch CUDA devices if available, numpy and python).
+    Returns
+    -------
+    rng_state : dict
+    """
+    rng_state = {
+        "torch"      : torch.get_rng_state(),
+        "torch_cuda" : torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        "numpy"      : np.random.get_state(),
+        "python"     : random.getstate(),
+    }
+    return rng_state
+
+
+def set_rng_state(rng_state):
+    """
+    Sets states of random number generators in use (torch, torch CUDA devices if available, numpy and python).
+    Parameters
+    ----------
+    rng_state : dict
+        States (see get_rng_state).
+    """
+    torch.set_rng_state (rng_state["torch"])
+    # CUDA states (if saved with CUDA available and CUDA is available)
+    if rng_state.get("torch_cuda") is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all (rng_state["torch_cuda"])
+    np.random.set_state (rng_state["numpy"])
+    random.setstate     (rng_state["python"])
+    return None
+
+
+def save_checkpoint(checkpoint, path):
+    """
+    Atomically saves checkpoint : checkpoint is first written to a temporary file which then replaces the file at path
+    so a run interrupted while saving leaves the previous checkpoint intact.
+    Parameters
+    ----------
+    checkpoint : dict
+        Picklable checkpoint.
+    path : str
+        Path to save checkpoint to.
+    """
+    tmp_path = path + ".tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+    return None
+
+
+def load_checkpoint(path):
+    """
+    Loads checkpoint saved by save_checkpoint.
+    Parameters
+    ----------
+    path : str
+        Path to checkpoint.
+    Returns
+    -------
+    checkpoint : dict
+    """
+    # Checkpoints contain non-tensor objects (RNG states, programs states etc.)
+    try:
+        checkpoint = torch.load(path, weights_only=False)
+    except TypeError:
+        # torch < 1.13 (no weights_only argument)
+        checkpoint = torch.load(path)
+    return checkpoint
@@ -1,9 +1,657 @@
 import torch
+import torch.distributed as dist
 import numpy as np
 import time
+import concurrent.futures
 
 # Internal imports
 from . import loss
+from . import checkpoint
+from . import replay
+
+# Available compilation modes of sampling step (see make_sampling_step)
+SAMPLING_STEP_COMPILE_MODES = [None, "trace", "compile"]
+
+class SamplingStep(torch.nn.Module):
+    """
+    One sampling step of the learner : model call on observations, addition of log prior to model's output and
+    sampling of actions. Wrapping these in a module allows compiling them as a whole (see make_sampling_step).
+    """
+    def __init__(self, model):
+        """
+        Parameters
+        ----------
+        model : torch.nn.Module
+            Differentiable RNN cell.
+        """
+        super().__init__()
+        self.model = model
+
+    def forward(self,
+                observations,                                         # (batch_size, obs_size)
+                states,                                               # (n_layers, 2, batch_size, hidden_size)
+                logprior,                                             # (batch_size, n_choices)
+               ):
+        # Giving up-to-date observations
+        output, states = self.model(input_tensor = observations,      # (batch_size, n_choices), (n_layers, 2, batch_size, hidden_size)
+                                          states = states      )
+        # Prior
+        logit  = output + logprior                                    # (batch_size, n_choices)
+        # Sampling
+        action = torch.multinomial(torch.exp(logit),                  # (batch_size,)
+                                   num_samples=1)[:, 0]
+        return logit, action, states                                  # (batch_size, n_choices), (batch_size,), (n_layers, 2, batch_size, hidden_size)
+
+def make_sampling_step (model, compile_mode = None):
+    """
+    Makes sampling step function of model (see SamplingStep).
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Differentiable RNN cell.
+    compile_mode : str or None, optional
+        If None (default), the step runs in eager mode. If "trace", the step is compiled with TorchScript
+        (torch.jit.trace) on its first call (using the random number generator state of a forked generator so sampling
+        is not affected). If "compile", the step is compiled with torch.compile (requires a working compiler toolchain,
+        compilation happens on first call and can take a while).
+    Returns
+    -------
+    sampling_step : callable
+        Function taking observations (torch.tensor of shape (batch_size, obs_size) of float), states (torch.tensor of
+        shape (n_layers, 2, batch_size, hidden_size) of float) and logprior (torch.tensor of shape (batch_size,
+        n_choices) of float) as arguments and returning logit (torch.tensor of shape (batch_size, n_choices) of float),
+        action (torch.tensor of shape (batch_size,) of int) and new states.
+    """
+    assert compile_mode in SAMPLING_STEP_COMPILE_MODES, "Sampling step compile mode %s is not in %s" \
+                                                        % (compile_mode, SAMPLING_STEP_COMPILE_MODES)
+    step = SamplingStep(model)
+    if compile_mode is None:
+        sampling_step = step
+    elif compile_mode == "compile":
+        sampling_step = torch.compile(step, dynamic=False)
+    elif compile_mode == "trace":
+        traced_step = []
+        def sampling_step(observations, states, logprior):
+            # Tracing on first call as example inputs are needed (shapes only depend on batch so they do not change)
+            if len(traced_step) == 0:
+                with torch.random.fork_rng():
+                    traced_step.append(torch.jit.trace(step, (observations, states, logprior), check_trace=False))
+            return traced_step[0](observations, states, logprior)
+    return sampling_step
+
+def sample_batch (batch, model, sampling_step, keep_history = False):
+    """
+    Samples programs of an empty batch step by step using model until all programs are complete (or max_time_step is
+    reached).
+    Parameters
+    ----------
+    batch : physym.batch.Batch
+        Empty batch in which programs are sampled.
+    model : torch.nn.Module
+        Differentiable RNN cell.
+    sampling_step : callable
+        Sampling step of model (see make_sampling_step).
+    keep_history : bool, optional
+        If True, observations and log priors given at each step are also returned so logits can be recomputed
+        afterwards (see recompute_logits).
+    Returns
+    -------
+    logits, actions, observations_history, logprior_history : torch.tensor of shape (max_time_step, batch_size,
+    n_choices) of float, torch.tensor of shape (max_time_step, batch_size,) of int, list of n_steps torch.tensor of
+    shape (batch_size, obs_size) of float, list of n_steps torch.tensor of shape (batch_size, n_choices) of float
+        Logits and actions of each step (zeros beyond the last step performed) and observations and log priors
+        histories (empty lists if keep_history is False).
+    """
+    batch_size    = batch.batch_size
+    max_time_step = batch.max_time_step
+
+    # Initial RNN cell input
+    states = model.get_zeros_initial_state(batch_size)  # (n_layers, 2, batch_size, hidden_size)
+
+    # Candidates
+    logits        = []
+    actions       = []
+    observations_history = []
+    logprior_history     = []
+
+    for i in range (max_time_step):
+
+        # ------------ OBSERVATIONS ------------
+        # (embedding output)
+        # Observations are only computed for incomplete programs (zeros for complete programs whose next tokens
+        # are ignored anyway), directly in a preallocated torch buffer of the batch
+        observations = batch.get_obs_tensor(rows = batch.get_active_rows())   # (batch_size, obs_size)
+
+        # ------------ PRIOR ------------
+
+        # (embedding output)
+        # Log of prior computed in place in a preallocated buffer (0 probabilities -> -inf)
+        logprior = batch.prior.get_log_prior()                    # (batch_size, output_size)
+
+        # ------------ MODEL + SAMPLING ------------
+
+        # Giving up-to-date observations, adding prior to model's output and sampling action n°i
+        logit, action, states = sampling_step(observations = observations,   # (batch_size, output_size), (batch_size,), (n_layers, 2, batch_size, hidden_size)
+                                              states       = states,
+                                              logprior     = logprior)
+
+        # ------------ ACTION ------------
+
+        # Saving action n°i
+        logits       .append(logit)
+        actions      .append(action)
+        # Keeping what is needed to recompute logits of elite candidates
+        if keep_history:
+            observations_history .append(observations)         # buffer of step i is not overwritten until batch is re-used
+            logprior_history     .append(logprior.clone())     # logprior buffer is overwritten at each step
+
+        # Informing embedding of new action
+        # (embedding input)
+        batch.programs.append(action.detach().cpu().numpy())
+
+        # Stopping sampling once all programs are complete (next tokens would be ignored anyway)
+        if batch.programs.is_complete.all():
+            break
+
+    # Padding candidates history up to max_time_step along time dim so training tensors keep the same shape
+    # (steps beyond programs' lengths are masked in the loss).
+    n_steps = len(logits)
+    if n_steps < max_time_step:
+        logits  += [torch.zeros_like(logits [0])] * (max_time_step - n_steps)
+        actions += [torch.zeros_like(actions[0])] * (max_time_step - n_steps)
+
+    # Keeping prob distribution history for backpropagation
+    logits         = torch.stack(logits        , dim=0)         # (max_time_step, batch_size, n_choices, )
+    actions        = torch.stack(actions       , dim=0)         # (max_time_step, batch_size,)
+
+    return logits, actions, observations_history, logprior_history
+
+def sample (model, batch_reseter, n_samples, compute_rewards = False, compile_sampling_step = None):
+    """
+    Inference-only bulk sampling of programs from a (trained) model : programs are sampled without autograd graph
+    micro-batch by micro-batch (of the size of batches returned by batch_reseter, priors being the ones of these
+    batches) and streamed as they are sampled so n_samples is not limited by memory. The model is not trained.
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Differentiable RNN cell.
+    batch_reseter : callable
+        Function returning a new empty physym.batch.Batch (the same batch can be reset and returned each time as
+        micro-batches are yielded as copies).
+    n_samples : int
+        Total number of programs to sample (the last micro-batch is truncated if needed).
+    compute_rewards : bool, optional
+        If True, rewards of programs are computed as well (False by default).
+    compile_sampling_step : str or None, optional
+        Compilation mode of the sampling step (see make_sampling_step), by default None, eager mode.
+    Yields
+    ------
+    tokens_idx, lengths, rewards : numpy.array of shape (n, max_time_step,) of int, numpy.array of shape (n,) of int,
+    numpy.array of shape (n,) of float or None
+        Library indexes of tokens of programs of micro-batch (programs being completed by dummies, invalid token
+        indexes beyond their lengths), lengths of programs (including dummies) and rewards of programs (None if
+        compute_rewards is False), with n <= batch_size.
+    """
+    assert n_samples > 0, "n_samples must be > 0."
+    sampling_step = make_sampling_step(model = model, compile_mode = compile_sampling_step)
+    n_sampled = 0
+    while n_sampled < n_samples:
+        # Reset new batch (embedding reset)
+        batch = batch_reseter()
+        n = min(batch.batch_size, n_samples - n_sampled)
+        # Sampling
+        with torch.no_grad():
+            sample_batch(batch = batch, model = model, sampling_step = sampling_step)
+        # Rewards (programs of truncated micro-batch beyond n are not evaluated)
+        R = None
+        if compute_rewards:
+            mask = None if n == batch.batch_size else np.arange(batch.batch_size) < n  # (batch_size,)
+            R = batch.get_rewards(mask = mask)[:n]                                    # (n,)
+        # Copies as batch is re-used
+        tokens_idx = batch.programs.tokens.idx [:n].copy()                            # (n, max_time_step,)
+        lengths    = batch.programs.n_completed[:n].copy()                            # (n,)
+        n_sampled += n
+        yield tokens_idx, lengths, R
+
+def recompute_logits (model, observations, logpriors, rows):
+    """
+    Recomputes logits of some programs by re-running model with teacher forcing ie. using observations stored during
+    sampling (these only depend on previously sampled tokens).
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Differentiable RNN cell.
+    observations : list of torch.tensor of shape (batch_size, obs_size) of float
+        Observations given to model at each step during sampling.
+    logpriors : list of torch.tensor of shape (batch_size, n_choices) of float
+        Log of priors at each step during sampling.
+    rows : numpy.array of shape (n_rows,) of int
+        Programs for which logits should be recomputed.
+    Returns
+    -------
+    logits : torch.tensor of shape (n_steps, n_rows, n_choices) of float
+        Differentiable logits (same as model's output + log prior during sampling).
+    """
+    rows   = torch.from_numpy(rows)                                   # (n_rows,)
+    states = model.get_zeros_initial_state(len(rows))                 # (n_layers, 2, n_rows, hidden_size)
+    logits = []
+    for obs, logprior in zip(observations, logpriors):
+        output, states = model(input_tensor = obs[rows],              # (n_rows, n_choices), (n_layers, 2, n_rows, hidden_size)
+                                     states = states)
+        logits.append(output + logprior[rows])                        # (n_rows, n_choices)
+    logits = torch.stack(logits, dim=0)                               # (n_steps, n_rows, n_choices)
+    return logits
+
+def replay_programs (batch, tokens_names):
+    """
+    Sets programs of an empty batch to given programs (as VectPrograms.set_programs does) step by step so observations
+    and log priors given at each step are recorded and logits of these programs can be computed with teacher forcing
+    (see recompute_logits). Programs made of tokens that are not choosable in the library of batch, longer than
+    max_time_step or forbidden by the priors of batch are invalid. Programs beyond batch_size are ignored and rows
+    beyond the number of programs are filled with copies of the first valid program.
+    Parameters
+    ----------
+    batch : physym.batch.Batch
+        Empty batch in which programs are replayed.
+    tokens_names : list of list of str
+        Names of tokens making up each program.
+    Returns
+    -------
+    rows, actions, observations_history, logprior_history : numpy.array of shape (n_rows,) of int, torch.tensor of
+    shape (max_time_step, batch_size,) of int, list of n_steps torch.tensor of shape (batch_size, obs_size) of float,
+    list of n_steps torch.tensor of shape (batch_size, n_choices) of float
+        Rows of batch holding valid replayed programs (empty if there is none, batch being left empty), actions of
+        each step (zeros beyond programs' lengths) and observations and log priors histories.
+    """
+    batch_size    = batch.batch_size
+    max_time_step = batch.max_time_step
+    library       = batch.library
+
+    # Tokens beyond programs' lengths are ignored, using a terminal token so appending them never exceeds max_time_step
+    pad_idx = int(np.argmax(library.get_choosable_prop("arity") == 0))
+
+    # Tokens idx of programs made of choosable tokens only
+    tokens_idx = []
+    for names in tokens_names[:batch_size]:
+        idx = [library.lib_name_to_idx.get(name, library.n_choices) for name in names]
+        if len(idx) <= max_time_step and max(idx) < library.n_choices:
+            tokens_idx.append(idx + [pad_idx]*(max_time_step - len(idx)))                # (max_time_step,)
+    if len(tokens_idx) == 0:
+        return np.array([], dtype=int), None, [], []
+    n_rows     = len(tokens_idx)
+    tokens_idx = np.array(tokens_idx + [tokens_idx[0]]*(batch_size - n_rows))         # (batch_size, max_time_step)
+
+    # Replaying programs
+    observations_history = []
+    logprior_history     = []
+    for i in range (max_time_step):
+        observations_history .append(batch.get_obs_tensor(rows = batch.get_active_rows()))   # (batch_size, obs_size)
+        logprior_history     .append(batch.prior.get_log_prior().clone())                    # (batch_size, n_choices)
+        batch.programs.append(tokens_idx[:, i])
+        if batch.programs.is_complete.all():
+            break
+    n_steps = len(observations_history)
+
+    # Actions
+    actions = torch.zeros((max_time_step, batch_size), dtype=torch.long)                  # (max_time_step, batch_size,)
+    actions[:n_steps] = torch.from_numpy(tokens_idx[:, :n_steps].T)
+
+    # Valid programs : complete and allowed by priors at each step
+    logprior_actions = torch.gather(torch.stack(logprior_history, dim=0), 2, actions[:n_steps, :, None])[:, :, 0]  # (n_steps, batch_size,)
+    mask_length      = np.arange(n_steps)[:, None] < batch.programs.n_lengths[None, :]                              # (n_steps, batch_size,)
+    is_allowed       = (torch.isfinite(logprior_actions).numpy() | ~mask_length).all(axis=0)                        # (batch_size,)
+    is_valid         = is_allowed & batch.programs.is_complete                                                      # (batch_size,)
+    rows = np.arange(n_rows)[is_valid[:n_rows]]                                                                     # (n_rows,)
+    return rows, actions, observations_history, logprior_history
+
+def replay_train_candidates (model, batch, tokens_names, R_lim, rewards = None):
+    """
+    Replays programs in an empty batch (see replay_programs) and returns training data of those having a reward above
+    the elite threshold R_lim (with differentiable logits computed with teacher forcing).
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Differentiable RNN cell.
+    batch : physym.batch.Batch
+        Empty batch in which programs are replayed.
+    tokens_names : list of list of str
+        Names of tokens making up each program.
+    R_lim : float
+        Elite threshold.
+    rewards : numpy.array of shape (len(tokens_names),) of float or None, optional
+        Known rewards of programs, by default None, rewards are computed on batch.
+    Returns
+    -------
+    logits, actions, R, lengths, n_evaluated : torch.tensor of shape (max_time_step, n, n_choices,) of float,
+    torch.tensor of shape (max_time_step, n,) of int, torch.tensor of shape (n,) of float, numpy.array of shape (n,) of
+    int, int
+        Logits, actions, rewards and lengths of the n replayed programs above elite threshold and nb. of evaluated
+        programs (0 if rewards are given).
+    """
+    max_time_step = batch.max_time_step
+    with torch.no_grad():
+        rows, actions, observations, logpriors = replay_programs(batch = batch, tokens_names = tokens_names)
+    if len(rows) == 0:
+        return (torch.zeros((max_time_step, 0, batch.n_choices)), torch.zeros((max_time_step, 0), dtype=torch.long),
+                torch.zeros((0,)), np.zeros((0,), dtype=int), 0)
+    # Rewards of valid programs
+    if rewards is None:
+        R           = batch.get_rewards()[rows]                                   # (n_rows,)
+        n_evaluated = (R > 0.).sum()
+    else:
+        R           = np.asarray(rewards)[rows]                                   # (n_rows,)
+        n_evaluated = 0
+    elite = rows[R >= R_lim]                                                      # (n,)
+    R     = R   [R >= R_lim]                                                      # (n,)
+    # Logits of elite with teacher forcing
+    logits  = recompute_logits(model        = model,                              # (n_steps, n, n_choices,)
+                               observations = observations,
+                               logpriors    = logpriors,
+                               rows         = elite)
+    n_steps = logits.shape[0]
+    if n_steps < max_time_step:
+        logits = torch.cat((logits,                                               # (max_time_step, n, n_choices,)
+            torch.zeros((max_time_step - n_steps,) + logits.shape[1:], dtype=logits.dtype)), dim=0)
+    return logits, actions[:, elite], torch.tensor(R), batch.programs.n_lengths[elite], n_evaluated
+
+def extend_train_candidates (train, extra):
+    """
+    Concatenates extra training candidates to training candidates (the shorter ones being zero-padded along time dim if
+    they come from batches having different max_time_step).
+    Parameters
+    ----------
+    train, extra : tuple of (torch.tensor of shape (max_time_step, n, n_choices,) of float, torch.tensor of shape
+    (max_time_step, n,) of int, torch.tensor of shape (n,) of float, numpy.array of shape (n,) of int)
+        Logits, actions, rewards and lengths of candidates.
+    Returns
+    -------
+    logits, actions, R, lengths : tuple
+        Concatenated candidates (dtypes of train).
+    """
+    logits, actions, R, lengths = train
+    extra_logits, extra_actions, extra_R, extra_lengths = extra
+    # Padding along time dim
+    max_time_step = max(logits.shape[0], extra_logits.shape[0])
+    pad = lambda x: torch.cat((x, torch.zeros((max_time_step - x.shape[0],) + x.shape[1:], dtype=x.dtype)), dim=0)
+    logits, actions, extra_logits, extra_actions = pad(logits), pad(actions), pad(extra_logits), pad(extra_actions)
+    logits  = torch.cat((logits , extra_logits.to(logits.dtype)  ), dim=1)      # (max_time_step, n+n_extra, n_choices,)
+    actions = torch.cat((actions, extra_actions.to(actions.dtype)), dim=1)      # (max_time_step, n+n_extra,)
+    R       = torch.cat((R      , extra_R.to(R.dtype)            ), dim=0)      # (n+n_extra,)
+    lengths = np.concatenate((lengths, extra_lengths))                          # (n+n_extra,)
+    return logits, actions, R, lengths
+
+def merge_elite_pools (pool, candidates, n_keep):
+    """
+    Merges candidates into a pool of elite candidates, keeping the n_keep ones having the highest rewards.
+    Parameters
+    ----------
+    pool : dict of {str : numpy.array or torch.tensor} or None
+        Pool of elite candidates (all values having the candidates as first dim, see candidates), None if empty.
+    candidates : dict of {str : numpy.array or torch.tensor}
+        Candidates : "R" (numpy.array of shape (n,) of float), "lengths" (numpy.array of shape (n,) of int),
+        "actions" (torch.tensor of shape (n, max_time_step) of int), "observations" (torch.tensor of shape (n,
+        max_time_step, obs_size) of float) and "logpriors" (torch.tensor of shape (n, max_time_step, n_choices) of float).
+    n_keep : int
+        Max number of candidates in pool.
+    Returns
+    -------
+    pool : dict of {str : numpy.array or torch.tensor}
+        Merged pool (at most n_keep candidates sorted by decreasing rewards).
+    """
+    if pool is not None:
+        candidates = {key : (np.concatenate((pool[key], value)) if isinstance(value, np.ndarray) else
+                             torch.cat((pool[key], value), dim=0)) for key, value in candidates.items()}
+    best = np.argsort(-candidates["R"], kind="stable")[:n_keep]                   # (n_keep,)
+    pool = {key : value[best] for key, value in candidates.items()}
+    return pool
+
+def broadcast_model (model, src = 0):
+    """
+    Broadcasts (in place) parameters and buffers of model from rank src to all ranks of the default process group
+    (data-parallel mode).
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Model (shared by all ranks).
+    src : int, optional
+        Rank to broadcast from (0 by default).
+    """
+    for tensor in model.state_dict().values():
+        dist.broadcast(tensor, src = src)
+    return None
+
+def all_gather_rewards (R):
+    """
+    Gathers rewards of shards of all ranks of the default process group (data-parallel mode). All shards must have the
+    same size.
+    Parameters
+    ----------
+    R : numpy.array of shape (batch_size,) of float
+        Rewards of shard of this rank.
+    Returns
+    -------
+    R_all : numpy.array of shape (world_size * batch_size,) of float
+        Rewards of all shards ordered by rank.
+    """
+    R_local = torch.as_tensor(np.asarray(R, dtype=np.float64))                                    # (batch_size,)
+    R_all   = [torch.zeros_like(R_local) for _ in range(dist.get_world_size())]
+    dist.all_gather(R_all, R_local)
+    R_all   = torch.cat(R_all).numpy()                                                            # (world_size * batch_size,)
+    return R_all
+
+def all_reduce_gradients (model, loss_val):
+    """
+    Sums gradients of model and loss values over all ranks of the default process group (data-parallel mode) in a single
+    all-reduce call. Missing gradients (e.g. on a rank having no elite candidates) count as zeros.
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Model (shared by all ranks) having the gradients of this rank.
+    loss_val : torch.tensor of shape () of float
+        Loss value of this rank.
+    Returns
+    -------
+    loss_val : torch.tensor of shape () of float
+        Summed loss value (gradients being summed in place).
+    """
+    params = [p for p in model.parameters() if p.requires_grad]
+    for p in params:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+    flat = torch.cat([p.grad.reshape(-1) for p in params]
+                     + [loss_val.detach().reshape(1).to(params[0].grad.dtype)])                 # (n_params + 1,)
+    dist.all_reduce(flat, op = dist.ReduceOp.SUM)
+    # Unflattening
+    offset = 0
+    for p in params:
+        p.grad.copy_(flat[offset:offset + p.numel()].view_as(p.grad))
+        offset += p.numel()
+    loss_val = flat[-1]
+    return loss_val
+
+def broadcast_best_prog (batch, R_all):
+    """
+    Returns best program of all shards on all ranks of the default process group (data-parallel mode). Must be called
+    by all ranks.
+    Parameters
+    ----------
+    batch : physym.batch.Batch
+        Shard of this rank.
+    R_all : numpy.array of shape (world_size * batch_size,) of float
+        Rewards of all shards ordered by rank (see all_gather_rewards).
+    Returns
+    -------
+    best_prog : physym.program.Program
+        Best program.
+    """
+    src, prog_idx = divmod(int(R_all.argmax()), batch.batch_size)
+    # Programs are sent as picklable states
+    best_prog = batch.programs.get_prog(prog_idx) if dist.get_rank() == src else None
+    state     = [checkpoint.program_to_state(best_prog) if best_prog is not None else None]
+    dist.broadcast_object_list(state, src = src)
+    if best_prog is None:
+        best_prog = checkpoint.program_from_state(state[0], batch.library, batch.programs.candidate_wrapper)
+    return best_prog
+
+def log_micro_batches_epoch (batch, R, epoch, model, risk_factor, loss_val, run_logger, run_visualiser):
+    """
+    Logs last micro-batch of an epoch (see micro_batches_epoch) with the loss of the epoch.
+    Parameters
+    ----------
+    batch : physym.batch.Batch
+        Last micro-batch of epoch.
+    R : numpy.array of shape (batch_size,) of float
+        Rewards of programs of batch.
+    epoch : int
+        Epoch number.
+    model, risk_factor, run_logger, run_visualiser
+        See learner.
+    loss_val : torch.tensor
+        Loss value of epoch.
+    """
+    # Custom logging (micro-batch elite : its own best candidates)
+    if run_logger is not None:
+        n_keep_micro = int(risk_factor*batch.batch_size)
+        run_logger.log(epoch    = epoch,
+                       batch    = batch,
+                       model    = model,
+                       rewards  = R,
+                       keep     = R.argsort()[::-1][0:n_keep_micro].copy(),
+                       notkept  = R.argsort()[::-1][n_keep_micro: ].copy(),
+                       loss_val = loss_val)
+    # Custom visualisation
+    if run_visualiser is not None:
+        run_visualiser.visualise(run_logger = run_logger, batch = batch)
+    return None
+
+def micro_batches_epoch (model,
+                         optimizer,
+                         batch_reseter,
+                         sampling_step,
+                         n_micro_batches,
+                         risk_factor,
+                         gamma_decay,
+                         entropy_weight,
+                         epoch          = 0,
+                         run_logger     = None,
+                         run_visualiser = None,
+                         ):
+    """
+    Runs an epoch as several micro-batches so the effective batch size (n_micro_batches * batch_size) is decoupled from
+    peak memory (which only scales with the size of micro-batches). Each micro-batch is sampled without autograd graph
+    and only its candidates which can still be elite (its n_keep best ones) are kept in a pool of elite candidates
+    (with their observations and log priors). Once all micro-batches are sampled, elite selection is thus done over
+    their union and gradients are accumulated over chunks of elite candidates (of at most batch_size candidates) by
+    re-running model with teacher forcing on them (see recompute_logits) before updating model.
+    Parameters
+    ----------
+    model, optimizer, risk_factor, gamma_decay, entropy_weight, run_logger, run_visualiser
+        See learner.
+    batch_reseter : callable
+        Function returning a new empty physym.batch.Batch (of micro-batch size).
+    sampling_step : callable
+        Sampling step of model (see make_sampling_step).
+    n_micro_batches : int
+        Number of micro-batches in epoch.
+    epoch : int, optional
+        Epoch number to give to run_logger. As batches are re-used, only the last micro-batch of the epoch can be
+        logged once the loss is known, programs of the other micro-batches are only given to run_logger's Pareto front.
+    Returns
+    -------
+    max_R, best_prog, n_evaluated, n_candidates, loss_val : float, physym.program.Program, int, int, torch.tensor
+        Max reward and best program of epoch, nb. of evaluated programs, nb. of programs sampled and loss value (NaN
+        if there is no elite candidate, model being left as is).
+    """
+    max_R       = -np.inf
+    best_prog   = None
+    n_evaluated = 0
+    pool        = None
+
+    # -------------------------------------------------
+    # ----------------- MICRO-BATCHES -----------------
+    # -------------------------------------------------
+    for k in range (n_micro_batches):
+        # Reset new batch (embedding reset)
+        batch = batch_reseter()
+        batch_size    = batch.batch_size
+        max_time_step = batch.max_time_step
+        # Number of elite candidates to keep (over all micro-batches)
+        n_keep = int(risk_factor*batch_size*n_micro_batches)
+
+        # Sampling (no autograd graph : logits of elite candidates are recomputed afterwards)
+        with torch.no_grad():
+            logits, actions, observations_history, logprior_history = sample_batch(
+                                                                        batch         = batch,
+                                                                        model         = model,
+                                                                        sampling_step = sampling_step,
+                                                                        keep_history  = True)
+        n_steps = batch.programs.curr_step
+
+        # Rewards
+        R = batch.get_rewards()
+        n_evaluated += (R > 0.).sum()
+        if R.max() > max_R:
+            max_R     = R.max()
+            best_prog = batch.programs.get_prog(R.argmax())
+
+        # Candidates which can still be elite (padding observations and log priors up to max_time_step)
+        rows = torch.from_numpy(R.argsort()[::-1][0:n_keep].copy())                                  # (n_rows,)
+        observations = torch.stack([obs[rows]      for obs      in observations_history], dim=1)      # (n_rows, n_steps, obs_size)
+        logpriors    = torch.stack([logprior[rows] for logprior in logprior_history    ], dim=1)      # (n_rows, n_steps, n_choices)
+        padding      = (0, 0, 0, max_time_step - n_steps)
+        pool = merge_elite_pools(pool       = pool,
+                                 candidates = {"R"            : R[rows.numpy()],
+                                               "lengths"      : batch.programs.n_lengths[rows.numpy()],
+                                               "actions"      : actions[:, rows].transpose(0, 1),           # (n_rows, max_time_step)
+                                               "observations" : torch.nn.functional.pad(observations, padding), # (n_rows, max_time_step, obs_size)
+                                               "logpriors"    : torch.nn.functional.pad(logpriors,    padding), # (n_rows, max_time_step, n_choices)
+                                              },
+                                 n_keep     = n_keep)
+
+        # Programs of micro-batches that will not be logged (batch being re-used) are candidates of the Pareto front
+        if (run_logger is not None) and (k < n_micro_batches - 1):
+            run_logger.pareto_logger(batch = batch, rewards = R)
+
+    # -------------------------------------------------
+    # ---------------------- LOSS ---------------------
+    # -------------------------------------------------
+    # Gradients are accumulated over chunks of elite candidates, each chunk's loss being weighted by its share of
+    # elite candidates so the accumulated gradient is the one of the loss over all elite candidates.
+    optimizer.zero_grad()
+    n_pool   = len(pool["R"])
+    # No elite candidate (eg. risk_factor*batch_size*n_micro_batches < 1) : no update
+    if n_pool == 0:
+        loss_val = torch.tensor(np.nan)
+        log_micro_batches_epoch(batch, R, epoch, model, risk_factor, loss_val, run_logger, run_visualiser)
+        return max_R, best_prog, n_evaluated, batch_size*n_micro_batches, loss_val
+    R_train  = torch.tensor(pool["R"], requires_grad=False)                                          # (n_keep,)
+    baseline = R_train.min()
+    loss_val = 0.
+    for chunk in np.array_split(np.arange(n_pool), int(np.ceil(n_pool/batch_size))):
+        logits_train = recompute_logits(model        = model,                                        # (max_time_step, n_chunk, n_choices)
+                                        observations = pool["observations"].transpose(0, 1),
+                                        logpriors    = pool["logpriors"   ].transpose(0, 1),
+                                        rows         = chunk)
+        loss_chunk = loss.loss_func_from_actions (logits_train   = logits_train,
+                                                  actions_train  = pool["actions"][chunk].transpose(0, 1),
+                                                  R_train        = R_train[chunk],
+                                                  baseline       = baseline,
+                                                  lengths        = pool["lengths"][chunk],
+                                                  gamma_decay    = gamma_decay,
+                                                  entropy_weight = entropy_weight, ) * (len(chunk)/n_pool)
+        # No need to do backpropagation if model is lobotomized (ie. is just a random number generator).
+        if not model.is_lobotomized:
+            loss_chunk.backward()
+        loss_val += loss_chunk.detach()
+
+    # -------------------------------------------------
+    # ---------------- BACKPROPAGATION ----------------
+    # -------------------------------------------------
+    if not model.is_lobotomized:
+        optimizer.step()
+
+    log_micro_batches_epoch(batch, R, epoch, model, risk_factor, loss_val, run_logger, run_visualiser)
+    return max_R, best_prog, n_evaluated, batch_size*n_micro_batches, loss_val
 
 def learner ( model,
              optimizer,
@@ -18,6 +666,24 @@ def learner ( model,
              max_n_evaluations   = None,
              run_logger     = None,
              run_visualiser = None,
+             compile_sampling_step = None,
+             recompute_elite = False,
+             n_micro_batches = 1,
+             pipelined       = False,
+             pipelined_batch_reseter = None,
+             checkpoint_path  = None,
+             checkpoint_every = 10,
+             resume_path      = None,
+             data_parallel    = False,
+             migrator         = None,
+             migrants_batch_reseter = None,
+             replay_size          = 0,
+             replay_batch_reseter = None,
+             max_time_step_resizer = None,
+             max_time_step_limit   = None,
+             max_time_step_growth  = 5,
+             max_time_step_trigger = 0.1,
+             surrogate             = None,
             ):
     """
     Trains model to generate symbolic programs satisfying a reward by reinforcing on best candidates at each epoch.
@@ -30,7 +696,8 @@ def learner ( model,
     n_epochs : int
         Number of epochs.
     batch_reseter : callable
-        Function returning a new empty physym.batch.Batch.
+        Function returning a new empty physym.batch.Batch (eg. the same batch re-used across epochs via
+        physym.batch.Batch.reset).
     risk_factor : float
         Fraction between 0 and 1 of elite programs to reinforce on.
     gamma_decay : float
@@ -56,6 +723,86 @@ def learner ( model,
         notkept, loss_val).
     run_visualiser : object or None, optional
         Custom run visualiser to use having a run_visualiser.visualise method taking as args (run_logger, batch).
+    compile_sampling_step : str or None, optional
+        Compilation mode of the sampling step (model call, prior addition and sampling), see make_sampling_step. By
+        default (None), the step runs in eager mode.
+    recompute_elite : bool, optional
+        If True, programs are sampled without keeping the autograd graph of the whole batch and logits of elite
+        programs (the only ones used in the loss) are then recomputed by re-running the model with teacher forcing on
+        stored observations. This reduces peak memory and backward time by a factor ~ 1/risk_factor at the cost of a
+        forward pass on n_keep programs (False by default).
+    n_micro_batches : int, optional
+        Number of micro-batches (each one being a batch returned by batch_reseter) to sample per epoch. If > 1, elite
+        selection is done over the union of micro-batches and gradients are accumulated (see micro_batches_epoch) so
+        the effective batch size (n_micro_batches * batch_size) is decoupled from peak memory. run_logger then logs the
+        last micro-batch of each epoch, its Pareto front covering all micro-batches. By default, 1 (no
+        micro-batching).
+    pipelined : bool, optional
+        If True, rewards of an epoch are computed by a worker thread while the next epoch is sampled, the model being
+        updated with a bounded one-epoch lag (next epoch is sampled before the update from the current one and elite
+        logits are recomputed with the updated model, see recompute_elite). As the batch of an epoch is still in use
+        while the next one is sampled, epochs are sampled alternately in batches of batch_reseter and of
+        pipelined_batch_reseter. Can not be used with micro-batches (False by default). Experimental : rewards are
+        computed by a Python thread so only parts of their computation releasing the GIL (eg. torch operations of free
+        constants optimization) really overlap with sampling. The worker does not draw from the global np.random
+        stream so seeded runs remain reproducible.
+    pipelined_batch_reseter : callable or None, optional
+        Function returning a new empty physym.batch.Batch which must be a different object than the one returned by
+        batch_reseter (required in pipelined mode, None by default).
+    checkpoint_path : str or None, optional
+        If not None, the state of the run (model, optimizer, random number generators, nb. of evaluations, hall of
+        fame, early stopping countdown and run_logger's state) is atomically saved to this path at the beginning of
+        every checkpoint_every epochs (None by default, no checkpointing).
+    checkpoint_every : int, optional
+        Number of epochs between checkpoints (10 by default).
+    resume_path : str or None, optional
+        If not None, the run is resumed from checkpoint saved at this path (see checkpoint_path), continuing exactly
+        where the checkpointed run stopped. model, optimizer and run_logger must be built as in the checkpointed run.
+        Checkpointing and resuming can not be used in pipelined mode (None by default).
+    data_parallel : bool, optional
+        If True, learner is run by each rank of the default torch.distributed process group (which must be initialized,
+        e.g. with the gloo backend) : each rank samples and scores its own shard of the batch (batch_reseter returning
+        the shard of this rank, all shards having the same size), elite candidates are selected among programs of all
+        shards (risk_factor applying to the global batch) and gradients are summed over ranks before each update.
+        Model parameters are broadcast from rank 0 at start so all ranks share the same model, ranks should however use
+        different random seeds to sample different programs. Logged rewards, hall of fame and nb. of evaluations are
+        global (run_logger and run_visualiser only log the shard of their rank). Can not be used with micro-batches,
+        pipelined mode or checkpoints (False by default).
+    migrator : learn.migration.FileMigrator or None, optional
+        If not None, this run is an island of an island model : best programs are periodically exchanged with other
+        islands through migrator and programs received from other islands (migrants) whose rewards (computed on this
+        island) are above the elite threshold are added to elite candidates of this epoch (their logits being computed
+        with teacher forcing, see replay_programs). Can not be used with micro-batches, pipelined mode or data-parallel
+        mode (None by default).
+    migrants_batch_reseter : callable or None, optional
+        Function returning a new empty batch in which migrants are replayed (required if migrator is not None).
+    replay_size : int, optional
+        If > 0, the best programs found so far (elite candidates of all epochs) are kept in a priority queue of at most
+        replay_size programs without duplicates (see replay.ReplayQueue) and those above the elite threshold of the
+        current epoch (and not already among its elite candidates) are added to its elite candidates without being
+        evaluated again (their logits being computed with teacher forcing, see replay_programs). Can not be used with
+        micro-batches or data-parallel mode. By default 0 (no replay).
+    replay_batch_reseter : callable or None, optional
+        Function returning a new empty batch of replay_size programs in which programs of the queue are replayed
+        (required if replay_size > 0).
+    max_time_step_resizer : callable or None, optional
+        If not None, max_time_step is adaptive (iterative deepening of programs' lengths) : batches should initially
+        have a small max_time_step which is increased by max_time_step_growth (up to max_time_step_limit) whenever at
+        least a fraction max_time_step_trigger of elite candidates have lengths reaching it (ie. >= max_time_step - 1).
+        max_time_step_resizer is then called with the new max_time_step so that batch_reseter returns batches having
+        this max_time_step from then on (re-allocating them). Can not be used with micro-batches. By default None, the
+        max_time_step of batches is not changed.
+    max_time_step_limit : int or None, optional
+        Max value of max_time_step in adaptive mode (required if max_time_step_resizer is not None).
+    max_time_step_growth : int, optional
+        Increase of max_time_step in adaptive mode (5 by default).
+    max_time_step_trigger : float, optional
+        Fraction of elite candidates reaching max_time_step triggering its increase in adaptive mode (0.1 by default).
+    surrogate : learn.surrogate.RewardSurrogate or None, optional
+        If not None, only programs selected by this surrogate model of rewards (trained online on programs evaluated
+        in previous epochs) are really evaluated, other programs being given a zero reward (they are then not counted
+        as evaluations w.r.t. max_n_evaluations). Can not be used with micro-batches. By default None, all programs are
+        evaluated.
     Returns
     -------
     hall_of_fame_R, hall_of_fame : list of float, list of physym.program.Program
@@ -70,160 +817,397 @@ def learner ( model,
     hall_of_fame          = []
     # Nb. of expressions evaluated
     n_evaluated           = 0
+    # Loss of last update
+    loss_val              = None
 
-    for epoch in range (n_epochs):
+    # Sampling step (model call + prior + sampling)
+    sampling_step = make_sampling_step(model = model, compile_mode = compile_sampling_step)
 
-        if verbose>1: print("Epoch %i/%i"%(epoch, n_epochs))
+    # Pipelined mode : worker computing rewards, the batch being sampled and waiting for rewards
+    if pipelined:
+        assert n_micro_batches == 1, "Pipelined mode can not be used with micro-batches."
+        # Logits of the batch learned from can not be reused as model was updated since they were computed
+        recompute_elite = True
+        # The learner owns the alternation between the two batches, checking once that they are different (before
+        # any of them is in use) so a batch being evaluated is never reset
+        assert pipelined_batch_reseter is not None, "A pipelined_batch_reseter is required in pipelined mode."
+        assert batch_reseter() is not pipelined_batch_reseter(), \
+            "In pipelined mode, batch_reseter and pipelined_batch_reseter must return different batches."
+        rewards_worker  = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        pending         = None
 
-        # -------------------------------------------------
-        # --------------------- INIT  ---------------------
-        # -------------------------------------------------
+    # Data-parallel mode : all ranks start with the same model
+    if data_parallel:
+        assert dist.is_available() and dist.is_initialized(), "Data-parallel mode requires an initialized process group."
+        assert n_micro_batches == 1 and not pipelined, \
+            "Data-parallel mode can not be used with micro-batches or in pipelined mode."
+        assert checkpoint_path is None and resume_path is None, "Data-parallel mode can not be used with checkpoints."
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        broadcast_model(model, src = 0)
 
-        # Reset new batch (embedding reset)
-        batch = batch_reseter()
-        batch_size    = batch.batch_size
-        max_time_step = batch.max_time_step
+    # Island model
+    if migrator is not None:
+        assert migrants_batch_reseter is not None, "A migrants_batch_reseter is required to replay migrants."
+        assert n_micro_batches == 1 and not pipelined and not data_parallel, \
+            "Island model can not be used with micro-batches, pipelined mode or data-parallel mode."
 
-        # Initial RNN cell input
-        states = model.get_zeros_initial_state(batch_size)  # (n_layers, 2, batch_size, hidden_size)
+    # Replay of best programs across epochs
+    replay_queue = None
+    if replay_size > 0:
+        assert replay_batch_reseter is not None, "A replay_batch_reseter is required to replay programs."
+        assert n_micro_batches == 1 and not data_parallel, \
+            "Replay can not be used with micro-batches or data-parallel mode."
+        replay_queue = replay.ReplayQueue(capacity = replay_size)
 
-        # Optimizer reset
-        optimizer.zero_grad()
+    # Adaptive max_time_step
+    resized_max_time_step = None
+    if max_time_step_resizer is not None:
+        assert max_time_step_limit is not None, "max_time_step_limit is required in adaptive max_time_step mode."
+        assert n_micro_batches == 1, "Adaptive max_time_step can not be used with micro-batches."
 
-        # Candidates
-        logits        = []
-        actions       = []
+    # Surrogate pre-ranking of programs
+    if surrogate is not None:
+        assert n_micro_batches == 1, "Surrogate pre-ranking can not be used with micro-batches."
 
-        # Number of elite candidates to keep
-        n_keep = int(risk_factor*batch_size)
+    def evaluate (batch):
+        # Rewards of programs (only evaluating programs selected by surrogate)
+        if surrogate is None:
+            return batch.get_rewards()
+        mask = surrogate.select(batch)                                                 # (batch_size,)
+        R    = batch.get_rewards(mask = mask)                                          # (batch_size,)
+        surrogate.update(batch = batch, rewards = R, mask = mask)
+        return R
+
+    # Batches in which observations are computed : their filler noise banks (drawn when they were built, see
+    # physym.batch.Batch) are part of the state of the run
+    obs_batch_reseters = {"batch" : batch_reseter}
+    if migrator is not None:
+        obs_batch_reseters["migrants"] = migrants_batch_reseter
+    if replay_queue is not None:
+        obs_batch_reseters["replay"]   = replay_batch_reseter
+
+    # Resuming from checkpoint
+    start_epoch = 0
+    if resume_path is not None:
+        assert not pipelined, "Resuming from checkpoint can not be used in pipelined mode."
+        ckpt = checkpoint.load_checkpoint(resume_path)
+        # Adaptive max_time_step
+        resized_max_time_step = ckpt.get("max_time_step")
+        if (resized_max_time_step is not None) and (max_time_step_resizer is not None):
+            max_time_step_resizer(resized_max_time_step)
+        # Library and wrapper of programs
+        batch = batch_reseter()
+        assert (resized_max_time_step is None) or (batch.max_time_step == resized_max_time_step), \
+            "Checkpoint was saved with max_time_step = %i but batches have max_time_step = %i (a " \
+            "max_time_step_resizer is required to resume an adaptive max_time_step run)." \
+            % (resized_max_time_step, batch.max_time_step)
+        library, candidate_wrapper = batch.library, batch.programs.candidate_wrapper
+        # Model
+        model     .load_state_dict (ckpt["model"])
+        optimizer .load_state_dict (ckpt["optimizer"])
+        # Run state
+        start_epoch           = ckpt["epoch"]
+        n_evaluated           = ckpt["n_evaluated"]
+        loss_val              = ckpt["loss_val"]
+        stop_after_n_epochs   = ckpt["stop_after_n_epochs"]
+        overall_max_R_history = ckpt["overall_max_R_history"]
+        hall_of_fame          = [checkpoint.program_from_state(prog_state, library, candidate_wrapper)
+                                 for prog_state in ckpt["hall_of_fame"]]
+        if replay_queue is not None:
+            replay_queue.entries = ckpt["replay_queue"]
+        if surrogate is not None:
+            surrogate.set_state(ckpt["surrogate"])
+        if migrator is not None:
+            migrator.best = ckpt["migrator_best"]
+        if (run_logger is not None) and (ckpt["run_logger"] is not None):
+            run_logger.set_state(ckpt["run_logger"], library, candidate_wrapper)
+        # Observations filler noise (batches of this process were built drawing different noise)
+        for name, reseter in obs_batch_reseters.items():
+            reseter().obs_noise_bank = ckpt["obs_noise_banks"][name].clone()
+        # RNG (restored last as resetting batch may use it)
+        checkpoint.set_rng_state(ckpt["rng_state"])
+    assert not (pipelined and checkpoint_path is not None), "Checkpointing can not be used in pipelined mode."
+
+    # In pipelined mode, epoch (ie. the epoch being learned from) lags one iteration behind sampling_epoch, an extra
+    # iteration is done to learn from the last sampled epoch
+    for sampling_epoch in range (start_epoch, n_epochs + int(pipelined)):
+
+        epoch = sampling_epoch - int(pipelined)
 
         # -------------------------------------------------
-        # -------------------- RNN RUN  -------------------
+        # ------------------ CHECKPOINT -------------------
         # -------------------------------------------------
 
-        # RNN run
-        for i in range (max_time_step):
+        # Saving state of run before running this epoch
+        if (checkpoint_path is not None) and (epoch > start_epoch) and (epoch % checkpoint_every == 0):
+            ckpt = {
+                "epoch"                 : epoch,
+                "model"                 : model.state_dict(),
+                "optimizer"             : optimizer.state_dict(),
+                "rng_state"             : checkpoint.get_rng_state(),
+                "n_evaluated"           : n_evaluated,
+                "loss_val"              : None if loss_val is None else loss_val.detach(),
+                "stop_after_n_epochs"   : stop_after_n_epochs,
+                "overall_max_R_history" : overall_max_R_history,
+                "hall_of_fame"          : [checkpoint.program_to_state(prog) for prog in hall_of_fame],
+                "run_logger"            : None if run_logger is None else run_logger.get_state(),
+                "replay_queue"          : None if replay_queue is None else replay_queue.entries,
+                "max_time_step"         : resized_max_time_step,
+                "surrogate"             : None if surrogate is None else surrogate.get_state(),
+                "migrator_best"         : None if migrator is None else list(migrator.best),
+                "obs_noise_banks"       : {name : reseter().obs_noise_bank.clone()
+                                           for name, reseter in obs_batch_reseters.items()},
+            }
+            checkpoint.save_checkpoint(ckpt, checkpoint_path)
 
-            # ------------ OBSERVATIONS ------------
-            # (embedding output)
-            observations = torch.tensor(batch.get_obs().astype(np.float32), requires_grad=False,) # (batch_size, obs_size)
+        if verbose>1 and sampling_epoch < n_epochs: print("Epoch %i/%i"%(sampling_epoch, n_epochs))
 
-            # ------------ MODEL ------------
+        if n_micro_batches > 1:
+            # -------------------------------------------------
+            # ----------------- MICRO-BATCHES -----------------
+            # -------------------------------------------------
+            # Sampling, logging and update over several micro-batches
+            max_R, best_prog, n_evaluated_epoch, epoch_batch_size, loss_val = micro_batches_epoch(
+                                                                        model           = model,
+                                                                        optimizer       = optimizer,
+                                                                        batch_reseter   = batch_reseter,
+                                                                        sampling_step   = sampling_step,
+                                                                        n_micro_batches = n_micro_batches,
+                                                                        risk_factor     = risk_factor,
+                                                                        gamma_decay     = gamma_decay,
+                                                                        entropy_weight  = entropy_weight,
+                                                                        epoch           = epoch,
+                                                                        run_logger      = run_logger,
+                                                                        run_visualiser  = run_visualiser,)
+            get_best_prog = lambda : best_prog
+            # Update nb. of evaluated programs
+            n_evaluated += n_evaluated_epoch
+        else:
+            # -------------------------------------------------
+            # -------------------- RNN RUN  -------------------
+            # -------------------------------------------------
 
-            # Giving up-to-date observations
-            output, states = model(input_tensor = observations,    # (batch_size, output_size), (n_layers, 2, batch_size, hidden_size)
-                                            states = states      )
+            # (Skipped at the extra last iteration of pipelined mode which only learns from the last sampled epoch)
+            if sampling_epoch < n_epochs:
+                # Reset new batch (embedding reset)
+                # (in pipelined mode, alternating between batches so the one of previous epoch still in use is not reset)
+                batch = pipelined_batch_reseter() if (pipelined and sampling_epoch % 2 == 1) else batch_reseter()
 
-            # Getting raw prob distribution for action n°i
-            outlogit = output                                         # (batch_size, output_size)
+                # RNN run
+                # In recompute_elite mode, sampling does not need to be differentiable : logits of elite candidates are
+                # recomputed afterwards using stored observations.
+                with torch.set_grad_enabled(torch.is_grad_enabled() and not recompute_elite):
+                    logits, actions, observations_history, logprior_history = sample_batch(            # (max_time_step, batch_size, n_choices), (max_time_step, batch_size,)
+                                                                                batch         = batch,
+                                                                                model         = model,
+                                                                                sampling_step = sampling_step,
+                                                                                keep_history  = recompute_elite)
 
-            # ------------ PRIOR ------------
+            # -------------------------------------------------
+            # ------------------- PIPELINE --------------------
+            # -------------------------------------------------
 
-            # (embedding output)
-            prior_array = batch.prior().astype(np.float32)         # (batch_size, output_size)
+            # In pipelined mode, rewards of the batch sampled at this iteration are computed by a worker while next
+            # epoch is sampled and this iteration learns from the previously sampled batch.
+            if pipelined:
+                sampled = None
+                if sampling_epoch < n_epochs:
+                    sampled = (batch, actions, observations_history, logprior_history,
+                               rewards_worker.submit(evaluate, batch))
+                to_learn, pending = pending, sampled
+                # Nothing to learn from yet
+                if to_learn is None:
+                    continue
+                batch, actions, observations_history, logprior_history, rewards_future = to_learn
 
-            # 0 protection so there is always something to sample
-            epsilon = 0 #1e-14 #1e0*np.finfo(np.float32).eps
-            prior_array[prior_array==0] = epsilon
+            # -------------------------------------------------
+            # --------------------- INIT  ---------------------
+            # -------------------------------------------------
 
-            # To log
-            prior    = torch.tensor(prior_array, requires_grad=False) # (batch_size, output_size)
-            logprior = torch.log(prior)                               # (batch_size, output_size)
+            batch_size    = batch.batch_size
+            max_time_step = batch.max_time_step
+            n_steps       = batch.programs.curr_step
 
-            # ------------ SAMPLING ------------
+            # Optimizer reset
+            optimizer.zero_grad()
 
-            logit  = outlogit + logprior                              # (batch_size, output_size)
-            action = torch.multinomial(torch.exp(logit),              # (batch_size,)
-                                       num_samples=1)[:, 0]
+            # Number of elite candidates to keep
+            n_keep = int(risk_factor*batch_size)
 
-            # ------------ ACTION ------------
+            # -------------------------------------------------
+            # -------------------- REWARD ---------------------
+            # -------------------------------------------------
 
-            # Saving action n°i
-            logits       .append(logit)
-            actions      .append(action)
+            # (embedding output)
+            R = rewards_future.result() if pipelined else evaluate(batch)
 
-            # Informing embedding of new action
-            # (embedding input)
-            batch.programs.append(action.detach().cpu().numpy())
+            # -------------------------------------------------
+            # ---------------- BEST CANDIDATES ----------------
+            # -------------------------------------------------
 
-        # -------------------------------------------------
-        # ------------------ CANDIDATES  ------------------
-        # -------------------------------------------------
+            # index of elite candidates
+            # copy to avoid negative stride problem
+            # https://discuss.pytorch.org/t/torch-from-numpy-not-support-negative-strides/3663/7
+            keep    = R.argsort()[::-1][0:n_keep].copy()                              # (n_keep,)
+            notkept = R.argsort()[::-1][n_keep: ].copy()                              # (batch_size-n_keep,)
 
-        # Keeping prob distribution history for backpropagation
-        logits         = torch.stack(logits        , dim=0)         # (max_time_step, batch_size, n_choices, )
-        actions        = torch.stack(actions       , dim=0)         # (max_time_step, batch_size,)
+            # Data-parallel mode : elite candidates are the best of all shards, this rank training on its own ones
+            # (keep and notkept above being only used for logging purposes)
+            if data_parallel:
+                R_all         = all_gather_rewards(R)                                 # (world_size * batch_size,)
+                n_keep_global = int(risk_factor*world_size*batch_size)
+                elite_global  = np.argsort(-R_all, kind="stable")[:n_keep_global]     # (n_keep_global,)
+                log_keep, log_notkept = keep, notkept
+                keep    = elite_global[elite_global // batch_size == rank] % batch_size  # (<= n_keep,)
+                notkept = np.setdiff1d(np.arange(batch_size), keep)                   # (batch_size-len(keep),)
 
-        # Programs as numpy array for black box reward computation
-        actions_array  = actions.detach().cpu().numpy()             # (max_time_step, batch_size,)
+            # ----------------- Train batch : non-differentiable part -----------------
 
-        # -------------------------------------------------
-        # -------------------- REWARD ---------------------
-        # -------------------------------------------------
+            # Elite candidates actions idx
+            actions_train = actions[:, keep]                                          # (max_time_step, n_keep,)
 
-        # (embedding output)
-        R = batch.get_rewards()
+            # Elite candidates rewards
+            R_train = torch.tensor(R[keep], requires_grad=False)                      # (n_keep,)
+            if data_parallel:
+                R_lim = torch.tensor(R_all[elite_global[-1]], dtype=R_train.dtype)
+            else:
+                R_lim = R_train.min()
 
-        # -------------------------------------------------
-        # ---------------- BEST CANDIDATES ----------------
-        # -------------------------------------------------
+            # -------------- Train batch : differentiable part (TORCH) ---------------
+            # Elite candidates pred logprobs
+            if recompute_elite:
+                # Teacher forced re-run of model on elite candidates only
+                logits_train = recompute_logits(model        = model,                 # (n_steps, n_keep, n_choices,)
+                                                observations = observations_history,
+                                                logpriors    = logprior_history,
+                                                rows         = keep)
+                if n_steps < max_time_step:
+                    logits_train = torch.cat((logits_train,                           # (max_time_step, n_keep, n_choices,)
+                        torch.zeros((max_time_step - n_steps,) + logits_train.shape[1:], dtype=logits_train.dtype)), dim=0)
+            else:
+                logits_train = logits[:, keep]                                        # (max_time_step, n_keep, n_choices,)
 
-        # index of elite candidates
-        # copy to avoid negative stride problem
-        # https://discuss.pytorch.org/t/torch-from-numpy-not-support-negative-strides/3663/7
-        keep    = R.argsort()[::-1][0:n_keep].copy()                              # (n_keep,)
-        notkept = R.argsort()[::-1][n_keep: ].copy()                              # (batch_size-n_keep,)
+            # -------------------------------------------------
+            # ---------------------- LOSS ---------------------
+            # -------------------------------------------------
 
-        # ----------------- Train batch : black box part (NUMPY) -----------------
+            # Lengths of programs
+            lengths = batch.programs.n_lengths[keep]                                  # (n_keep,)
 
-        # Elite candidates
-        actions_array_train     = actions_array [:, keep]                         # (max_time_step, n_keep,)
-        # Elite candidates as one-hot target probs
-        ideal_probs_array_train = np.eye(batch.n_choices)[actions_array_train]    # (max_time_step, n_keep, n_choices,)
+            # Island model : migrants above the elite threshold join elite candidates
+            n_evaluated_migrants = 0
+            if migrator is not None:
+                migrants = migrator.migrate(epoch = epoch, batch = batch, rewards = R)
+                if len(migrants) > 0:
+                    replayed = replay_train_candidates(model        = model,
+                                                       batch        = migrants_batch_reseter(),
+                                                       tokens_names = migrants,
+                                                       R_lim        = R_lim.item())
+                    n_evaluated_migrants = replayed[-1]
+                    logits_train, actions_train, R_train, lengths = extend_train_candidates(
+                        (logits_train, actions_train, R_train, lengths), replayed[:-1])
 
-        # Elite candidates rewards
-        R_train = torch.tensor(R[keep], requires_grad=False)                      # (n_keep,)
-        R_lim   = R_train.min()
+            # Replay : best programs of previous epochs above the elite threshold join elite candidates
+            if replay_queue is not None:
+                elite_names = set([tuple(tok.name for tok in batch.programs.get_prog_tokens(i)) for i in keep])
+                replay_names, replay_R = replay_queue.get_programs(R_lim = R_lim.item(), exclude = elite_names)
+                if len(replay_names) > 0:
+                    replayed = replay_train_candidates(model        = model,
+                                                       batch        = replay_batch_reseter(),
+                                                       tokens_names = replay_names,
+                                                       R_lim        = R_lim.item(),
+                                                       rewards      = replay_R)
+                    logits_train, actions_train, R_train, lengths = extend_train_candidates(
+                        (logits_train, actions_train, R_train, lengths), replayed[:-1])
+                # Elite candidates of this epoch are kept for next epochs
+                replay_queue.push(batch = batch, rewards = R, rows = keep)
 
-        # Elite candidates as one-hot in torch
-        # (non-differentiable tensors)
-        ideal_probs_train = torch.tensor(                                         # (max_time_step, n_keep, n_choices,)
-                                ideal_probs_array_train.astype(np.float32),
-                                requires_grad=False,)
+            # Adaptive max_time_step : increasing it for next batches if elite candidates push against it
+            if (max_time_step_resizer is not None) and (max_time_step < max_time_step_limit):
+                n_elite    = len(keep)
+                n_at_limit = int((batch.programs.n_lengths[keep] >= max_time_step - 1).sum())
+                # (in data-parallel mode, deciding on the global elite so all ranks resize at the same epochs)
+                if data_parallel:
+                    counts = torch.tensor([n_elite, n_at_limit], dtype=torch.float64)
+                    dist.all_reduce(counts)
+                    n_elite, n_at_limit = counts.tolist()
+                new_max_time_step = min(max_time_step + max_time_step_growth, max_time_step_limit)
+                # (in pipelined mode, the next batch learned from was sampled before a resizing)
+                if n_elite > 0 and n_at_limit/n_elite >= max_time_step_trigger \
+                        and new_max_time_step > (resized_max_time_step or 0):
+                    resized_max_time_step = new_max_time_step
+                    max_time_step_resizer(resized_max_time_step)
 
-        # -------------- Train batch : differentiable part (TORCH) ---------------
-        # Elite candidates pred logprobs
-        logits_train            = logits[:, keep]                                 # (max_time_step, n_keep, n_choices,)
+            # Reward baseline
+            #baseline = RISK_FACTOR - 1
+            baseline = R_lim
 
-        # -------------------------------------------------
-        # ---------------------- LOSS ---------------------
-        # -------------------------------------------------
+            # Loss
+            if len(keep) > 0:
+                loss_val = loss.loss_func_from_actions (logits_train   = logits_train,
+                                                       actions_train  = actions_train,
+                                                       R_train        = R_train,
+                                                       baseline       = baseline,
+                                                       lengths        = lengths,
+                                                       gamma_decay    = gamma_decay,
+                                                       entropy_weight = entropy_weight, )
+            else:
+                # No elite candidates in the shard of this rank (data-parallel mode)
+                loss_val = torch.zeros(())
 
-        # Lengths of programs
-        lengths = batch.programs.n_lengths[keep]                                  # (n_keep,)
+            # Data-parallel mode : weighting local loss so that the sum over ranks is the loss over all elite candidates
+            if data_parallel:
+                loss_val = loss_val * (len(keep)/n_keep_global)
 
-        # Reward baseline
-        #baseline = RISK_FACTOR - 1
-        baseline = R_lim
+            # -------------------------------------------------
+            # ---------------- BACKPROPAGATION ----------------
+            # -------------------------------------------------
+            # No need to do backpropagation if model is lobotomized (ie. is just a random number generator).
+            if model.is_lobotomized:
+                pass
+            else:
+                if loss_val.requires_grad:
+                    loss_val  .backward()
+                # Data-parallel mode : summing gradients (and losses) of all ranks
+                if data_parallel:
+                    loss_val = all_reduce_gradients(model = model, loss_val = loss_val)
+                optimizer .step()
 
-        # Loss
-        loss_val = loss.loss_func (logits_train      = logits_train,
-                                  ideal_probs_train = ideal_probs_train,
-                                  R_train           = R_train,
-                                  baseline          = baseline,
-                                  lengths           = lengths,
-                                  gamma_decay       = gamma_decay,
-                                  entropy_weight    = entropy_weight, )
+            # Epoch summary
+            if data_parallel:
+                max_R            = R_all.max()
+                get_best_prog    = lambda : broadcast_best_prog(batch = batch, R_all = R_all)
+                epoch_batch_size = world_size*batch_size
+                # Update nb. of evaluated programs
+                n_evaluated += (R_all > 0.).sum()
+            else:
+                max_R            = R.max()
+                get_best_prog    = lambda : batch.programs.get_prog(R.argmax())
+                epoch_batch_size = batch_size
+                # Update nb. of evaluated programs (including migrants evaluated on this island)
+                n_evaluated += (R > 0.).sum() + n_evaluated_migrants
 
-        # -------------------------------------------------
-        # ---------------- BACKPROPAGATION ----------------
-        # -------------------------------------------------
-        # No need to do backpropagation if model is lobotomized (ie. is just a random number generator).
-        if model.is_lobotomized:
-            pass
-        else:
-            loss_val  .backward()
-            optimizer .step()
+            # -------------------------------------------------
+            # --------------- CUSTOM LOGGING ------------------
+            # -------------------------------------------------
+
+            # Custom logging
+            if run_logger is not None:
+                run_logger.log(epoch    = epoch,
+                               batch    = batch,
+                               model    = model,
+                               rewards  = R,
+                               keep     = log_keep    if data_parallel else keep,
+                               notkept  = log_notkept if data_parallel else notkept,
+                               loss_val = loss_val)
+
+            # -------------------------------------------------
+            # ----------------- VISUALISATION -----------------
+            # -------------------------------------------------
+
+            # Custom visualisation
+            if run_visualiser is not None:
+                run_visualiser.visualise(run_logger = run_logger, batch = batch)
 
         # -------------------------------------------------
         # ----------------- LOGGING VALUES ----------------
@@ -231,33 +1215,15 @@ def learner ( model,
 
         # Basic logging (necessary for early stopper)
         if epoch == 0:
-            overall_max_R_history       = [R.max()]
-            hall_of_fame                = [batch.programs.get_prog(R.argmax())]
+            overall_max_R_history       = [max_R]
+            hall_of_fame                = [get_best_prog()]
         if epoch> 0:
-            if R.max() > np.max(overall_max_R_history):
-                overall_max_R_history.append(R.max())
-                hall_of_fame.append(batch.programs.get_prog(R.argmax()))
+            if max_R > np.max(overall_max_R_history):
+                overall_max_R_history.append(max_R)
+                hall_of_fame.append(get_best_prog())
             else:
                 overall_max_R_history.append(overall_max_R_history[-1])
 
-        # Custom logging
-        if run_logger is not None:
-            run_logger.log(epoch    = epoch,
-                           batch    = batch,
-                           model    = model,
-                           rewards  = R,
-                           keep     = keep,
-                           notkept  = notkept,
-                           loss_val = loss_val)
-
-        # -------------------------------------------------
-        # ----------------- VISUALISATION -----------------
-        # -------------------------------------------------
-
-        # Custom visualisation
-        if run_visualiser is not None:
-            run_visualiser.visualise(run_logger = run_logger, batch = batch)
-
         # -------------------------------------------------
         # ----------------- EARLY STOPPER -----------------
         # -------------------------------------------------
@@ -280,11 +1246,9 @@ def learner ( model,
         # ------------ MAX EVALUATIONS STOPPER ------------
         # -------------------------------------------------
 
-        # Update nb. of evaluated programs
-        n_evaluated += (R > 0.).sum()
-
-        # If max_n_evaluations mode is used and we are one batch away from reaching the limit, stop.
-        if (max_n_evaluations is not None) and (n_evaluated + batch_size > max_n_evaluations):
+        # If max_n_evaluations mode is used and we are one batch away from reaching the limit, stop (in pipelined mode,
+        # the next batch is already being evaluated so we need to be two batches away).
+        if (max_n_evaluations is not None) and (n_evaluated + (1 + int(pipelined))*epoch_batch_size > max_n_evaluations):
             try:
                 run_visualiser.save_visualisation()
                 run_visualiser.save_data()
@@ -294,6 +1258,10 @@ def learner ( model,
                 print("Unable to save last plots and data before stopping due to max evaluation limit.")
             break
 
+    # Waiting for pending rewards computation (if stopped early)
+    if pipelined:
+        rewards_worker.shutdown(wait=True)
+
     t111 = time.perf_counter()
     if verbose:
         print("  -> Time = %f s"%(t111-t000))
@@ -1,3 +1,4 @@
+import functools
 import torch
 import numpy as np
 
@@ -81,3 +82,92 @@ def loss_func(logits_train, ideal_probs_train, R_train, baseline, lengths, gamma
     loss = loss_gp + loss_entropy
 
     return loss
+
+
+@functools.lru_cache(maxsize=None)
+def get_gamma_decay_vector(gamma_decay, max_time_step):
+    """
+    Returns power law weights along program length (cached as they only depend on gamma_decay and max_time_step).
+    Parameters
+    ----------
+    gamma_decay : float
+        Weight of power law to use along program length.
+    max_time_step : int
+        Max number of tokens programs can contain.
+    Returns
+    -------
+    decay : torch.tensor of shape (max_time_step,) of float
+        gamma_decay**t for t in [0, max_time_step).
+    """
+    decay = gamma_decay ** torch.arange(max_time_step, dtype=torch.float64)  # (max_time_step,)
+    return decay
+
+
+def loss_func_from_actions(logits_train, actions_train, R_train, baseline, lengths, gamma_decay, entropy_weight, ):
+    """
+    Loss function for reinforcing symbolic programs (same as loss_func) using idx of actions to reinforce rather than
+    one-hot ideal probabilities and building masks in torch from lengths (no dense one-hot targets nor numpy masks).
+    Parameters
+    ----------
+    logits_train       : torch.tensor of shape (max_time_step, n_train, n_choices,)
+        Probabilities generated by the rnn (for each step along program length, for each program in training sub-batch,
+        for each choosable token).
+    actions_train      : torch.tensor of shape (max_time_step, n_train,) of int
+        Idx of actions to reinforce (for each step along program length, for each program in training sub-batch).
+    R_train            : torch.tensor of shape (n_train,)
+        Rewards of programs (for each program in training sub-batch).
+    baseline           : float
+        Baseline to subtract to rewards.
+    lengths            : array_like of shape (n_train,) of int
+        Effective length of programs not counting placeholders fillers (for each program in training sub-batch).
+    gamma_decay        : float
+        Weight of power law to use along program length: gamma_decay**t where t is the step in the sequence.
+        (gamma_decay < 1 gives more important to first tokens and gamma_decay > 1 gives more weight to last tokens).
+    entropy_weight     : float
+        Weight to give to entropy part of the loss.
+    Returns
+    -------
+    loss : float
+        Loss value.
+    """
+
+    # Getting shape
+    (max_time_step, n_train, n_choices,) = logits_train.shape
+
+    # ----- Length mask -----
+    # Lengths mask (avoids learning out of range of symbolic functions)
+    lengths     = torch.as_tensor(lengths, device=logits_train.device)                                # (n_train,)
+    mask_length = torch.arange(max_time_step, device=logits_train.device)[:, None] < lengths[None, :]  # (max_time_step, n_train,)
+
+    # ----- Entropy mask -----
+    # Entropy mask (weighting differently along sequence dim)
+    entropy_gamma_decay = get_gamma_decay_vector(gamma_decay, max_time_step).to(logits_train.device)  # (max_time_step,)
+    entropy_decay_mask  = entropy_gamma_decay[:, None] * mask_length                                   # (max_time_step, n_train,)
+
+    # ----- Loss : Gradient Policy -----
+
+    # Normalizing over action dim probs and logprobs
+    logprobs = torch.nn.functional.log_softmax(logits_train, dim=2)  # (max_time_step, n_train, n_choices,)
+    probs    = torch.exp(logprobs)                                   # (max_time_step, n_train, n_choices,)
+
+    # Logprob of actions
+    neglogp_per_step = -torch.gather(logprobs, 2, actions_train.long()[:, :, None])[:, :, 0]  # (max_time_step, n_train,)
+    # Sum over sequence dim
+    neglogp = torch.sum(torch.where(mask_length, neglogp_per_step, 0.), dim=0)                 # (n_train,)
+
+    # Mean over training samples of batch
+    loss_gp = torch.mean((R_train - baseline) * neglogp)
+
+    # ----- Loss : Entropy -----
+
+    # Sum over action dim
+    entropy_per_step = safe_cross_entropy(probs, logprobs, dim=2)      # (max_time_step, n_train,)
+    # Sum over sequence dim
+    entropy = torch.sum(entropy_per_step * entropy_decay_mask, dim=0)  # (n_train,)
+
+    loss_entropy = -entropy_weight * torch.mean(entropy)
+
+    # ----- Loss -----
+    loss = loss_gp + loss_entropy
+
+    return loss
@@ -0,0 +1,149 @@
+import os
+import glob
+import json
+import numpy as np
+
+
+def save_migrants(migrants, path):
+    """
+    Atomically saves migrants as JSON : migrants are first written to a temporary file which then replaces the file at
+    path so other islands never read a partially written file. JSON is used rather than pickle as files of a shared
+    directory may be written by any process having access to it.
+    Parameters
+    ----------
+    migrants : list of (float, list of str)
+        Rewards and tokens names of programs.
+    path : str
+        Path to save migrants to.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump([[float(R), [str(name) for name in names]] for R, names in migrants], f)
+    os.replace(tmp_path, path)
+    return None
+
+
+def load_migrants(path):
+    """
+    Loads migrants saved by save_migrants.
+    Parameters
+    ----------
+    path : str
+        Path to migrants.
+    Returns
+    -------
+    migrants : list of (float, list of str)
+        Rewards and tokens names of programs.
+    """
+    with open(path, "r") as f:
+        migrants = [(float(R), [str(name) for name in names]) for R, names in json.load(f)]
+    return migrants
+
+
+class FileMigrator:
+    """
+    Island model migration through a shared directory : each island (ie. independent run) periodically publishes its
+    best programs in its own file of the directory and collects the ones published by the other islands. Files are
+    written atomically as JSON (see save_migrants) so islands never read partially written files, the directory can be
+    on a shared filesystem (islands running on different nodes).
+    """
+    def __init__(self, directory, island_id, n_migrants = 10, period = 10, n_immigrants = None):
+        """
+        Parameters
+        ----------
+        directory : str
+            Directory shared by all islands (created if it does not exist).
+        island_id : int or str
+            Unique id of this island.
+        n_migrants : int, optional
+            Number of best programs published by this island (10 by default).
+        period : int, optional
+            Number of epochs between migrations (10 by default).
+        n_immigrants : int or None, optional
+            Max number of programs collected from other islands at each migration (best ones being kept), by default
+            None, n_migrants.
+        """
+        self.directory  = directory
+        self.island_id  = island_id
+        self.n_migrants = n_migrants
+        self.period     = period
+        self.n_immigrants = n_migrants if n_immigrants is None else n_immigrants
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, "island_%s.migrants"%(self.island_id))
+        # Best programs of this island : list of (reward, tokens names) sorted by decreasing rewards
+        self.best = []
+
+    def update (self, batch, rewards):
+        """
+        Updates best programs of this island with programs of batch.
+        Parameters
+        ----------
+        batch : physym.batch.Batch
+            Batch of programs.
+        rewards : numpy.array of shape (batch_size,) of float
+            Rewards of programs.
+        """
+        known = set([tuple(names) for _, names in self.best])
+        for i in np.argsort(-rewards, kind="stable")[:self.n_migrants]:
+            if not rewards[i] > 0.:
+                break
+            # Only complete programs (not completed with dummies) can be replayed in other islands
+            if not batch.programs.is_complete[i]:
+                continue
+            names = tuple(tok.name for tok in batch.programs.get_prog_tokens(i))
+            if names not in known:
+                known.add(names)
+                self.best.append((float(rewards[i]), list(names)))
+        self.best = sorted(self.best, key = lambda x: -x[0])[:self.n_migrants]
+        return None
+
+    def emigrate (self):
+        """
+        Publishes best programs of this island.
+        """
+        save_migrants(self.best, self.path)
+        return None
+
+    def immigrate (self):
+        """
+        Collects programs published by the other islands.
+        Returns
+        -------
+        migrants : list of list of str
+            Tokens names of the (at most n_immigrants) best programs published by other islands (sorted by decreasing
+            rewards in their islands), programs also being among the best programs of this island are excluded.
+        """
+        known    = set([tuple(names) for _, names in self.best])
+        migrants = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "island_*.migrants"))):
+            if path == self.path:
+                continue
+            for R, names in load_migrants(path):
+                if tuple(names) not in known:
+                    known.add(tuple(names))
+                    migrants.append((R, names))
+        migrants = [names for _, names in sorted(migrants, key = lambda x: -x[0])][:self.n_immigrants]
+        return migrants
+
+    def migrate (self, epoch, batch, rewards):
+        """
+        Updates best programs of this island with batch and every period epochs, publishes them and collects programs
+        published by the other islands.
+        Parameters
+        ----------
+        epoch : int
+            Current epoch.
+        batch : physym.batch.Batch
+            Batch of programs sampled at this epoch.
+        rewards : numpy.array of shape (batch_size,) of float
+            Rewards of programs.
+        Returns
+        -------
+        migrants : list of list of str
+            Tokens names of programs published by other islands (empty if this is not a migration epoch).
+        """
+        self.update(batch = batch, rewards = rewards)
+        if (epoch + 1) % self.period != 0:
+            return []
+        self.emigrate()
+        return self.immigrate()
@@ -14,6 +14,7 @@ from IPython.display import display, clear_output
 
 # Internal imports
 from physo.physym import reward as reward_funcs
+from physo.learn import checkpoint
 
 # Fig params
 try:
@@ -71,6 +72,16 @@ class RunLogger:
         self.lengths_of_physical          = []
         self.lengths_of_unphysical        = []
 
+        # Number of sampling steps performed (sampling stops once all programs are complete) and number of steps
+        # saved w.r.t. max_time_step
+        self.n_sampling_steps_history     = []
+        self.saved_steps_history          = []
+
+        # Pareto front (over complexities up to 10*max_time_step, extended with batches' max_time_step)
+        self.pareto_complexities          = np.arange(0)
+        self.pareto_rewards               = np.full(shape=(0,), fill_value = np.NaN)
+        self.pareto_programs              = np.full(shape=(0,), fill_value = None, dtype=object)
+
     def log(self, epoch, batch, model, rewards, keep, notkept, loss_val):
 
         # Epoch specific
@@ -127,6 +138,9 @@ class RunLogger:
         self.lengths_of_physical     .append( self.batch.programs.n_lengths[ self.batch.programs.is_physical] )
         self.lengths_of_unphysical   .append( self.batch.programs.n_lengths[~self.batch.programs.is_physical] )
 
+        self.n_sampling_steps_history .append( batch.programs.curr_step                       )
+        self.saved_steps_history      .append( batch.max_time_step - batch.programs.curr_step )
+
         self.pareto_logger()
 
         # Saving log
@@ -171,16 +185,18 @@ class RunLogger:
 
         return None
 
-    def pareto_logger(self,):
-        curr_complexities = self.batch.programs.n_complexity
-        curr_rewards      = self.R
-        curr_batch        = self.batch
+    def pareto_logger(self, batch = None, rewards = None):
+        # Batch of current log by default (other batches can be given eg. micro-batches of an epoch not being logged)
+        curr_batch        = self.batch if batch   is None else batch
+        curr_rewards      = self.R     if rewards is None else rewards
+        curr_complexities = curr_batch.programs.n_complexity
 
-        # Init
-        if self.epoch == 0:
+        # Init or extension if batches' max_time_step was increased (adaptive max_time_step)
+        n_extra = 10*curr_batch.max_time_step - len(self.pareto_complexities)
+        if n_extra > 0:
             self.pareto_complexities  = np.arange(0,10*curr_batch.max_time_step)
-            self.pareto_rewards       = np.full(shape=(self.pareto_complexities.shape), fill_value = np.NaN)
-            self.pareto_programs      = np.full(shape=(self.pareto_complexities.shape), fill_value = None, dtype=object)
+            self.pareto_rewards       = np.concatenate((self.pareto_rewards,  np.full(n_extra, fill_value = np.NaN)))
+            self.pareto_programs      = np.concatenate((self.pareto_programs, np.full(n_extra, fill_value = None, dtype=object)))
 
         # Update with current epoch info
         for i,c in enumerate(self.pareto_complexities):
@@ -225,6 +241,52 @@ class RunLogger:
     def best_prog(self):
         return self.hall_of_fame[-1]
 
+    # Epoch specific attributes that are refreshed at each log and are not part of the logger's state
+    EPOCH_SPECIFIC_ATTRIBUTES = ["R", "batch", "keep", "notkept", "best_prog_epoch", "programs_epoch"]
+
+    def get_state(self):
+        """
+        Returns picklable state of logger (for checkpointing purposes, see learn.checkpoint).
+        Returns
+        -------
+        state : dict
+        """
+        state = {key : value for key, value in self.__dict__.items() if key not in self.EPOCH_SPECIFIC_ATTRIBUTES}
+        # Programs
+        state["hall_of_fame"] = [checkpoint.program_to_state(prog) for prog in self.hall_of_fame]
+        if hasattr(self, "pareto_programs"):
+            pareto_programs = np.full(shape=self.pareto_programs.shape, fill_value = None, dtype=object)
+            for i, prog in enumerate(self.pareto_programs):
+                if prog is not None:
+                    pareto_programs[i] = checkpoint.program_to_state(prog)
+            state["pareto_programs"] = pareto_programs
+        return state
+
+    def set_state(self, state, library, candidate_wrapper = None):
+        """
+        Restores state of logger (see get_state).
+        Parameters
+        ----------
+        state : dict
+            State of logger.
+        library : library.Library
+            Library of tokens programs were made of.
+        candidate_wrapper : callable or None, optional
+            Wrapper to apply to candidate programs' output (see program.Program).
+        """
+        # Not overriding save location
+        state = {key : value for key, value in state.items() if key not in ["save_path", "do_save"]}
+        self.__dict__.update(state)
+        # Programs
+        self.hall_of_fame = [checkpoint.program_from_state(prog_state, library, candidate_wrapper)
+                             for prog_state in state["hall_of_fame"]]
+        if "pareto_programs" in state:
+            self.pareto_programs = np.full(shape=state["pareto_programs"].shape, fill_value = None, dtype=object)
+            for i, prog_state in enumerate(state["pareto_programs"]):
+                if prog_state is not None:
+                    self.pareto_programs[i] = checkpoint.program_from_state(prog_state, library, candidate_wrapper)
+        return None
+
 
 class RunVisualiser:
     """
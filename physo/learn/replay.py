@@ -0,0 +1,70 @@
+import heapq
+import numpy as np
+
+
+class ReplayQueue:
+    """
+    Bounded priority queue of the best programs found so far (across epochs), without duplicates. Programs are stored
+    as tokens names along with their rewards so they can be replayed and reinforced in later epochs without being
+    evaluated again (see learn.learner). Free constants values are not stored as reinforcing programs only requires their
+    tokens and rewards.
+    """
+    def __init__(self, capacity):
+        """
+        Parameters
+        ----------
+        capacity : int
+            Max number of programs in queue (programs having the lowest rewards are dropped first).
+        """
+        self.capacity = capacity
+        # tuple of tokens names -> reward
+        self.entries  = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push (self, batch, rewards, rows):
+        """
+        Pushes programs of batch into queue (only complete programs having a non-zero reward are considered, a
+        program already in queue is updated if its new reward is higher).
+        Parameters
+        ----------
+        batch : physym.batch.Batch
+            Batch of programs.
+        rewards : numpy.array of shape (batch_size,) of float
+            Rewards of programs.
+        rows : numpy.array of shape (n,) of int
+            Programs to push.
+        """
+        for i in rows:
+            if not (rewards[i] > 0. and batch.programs.is_complete[i]):
+                continue
+            names = tuple(tok.name for tok in batch.programs.get_prog_tokens(i))
+            if names not in self.entries or self.entries[names] < rewards[i]:
+                self.entries[names] = float(rewards[i])
+        # Dropping worst programs
+        if len(self.entries) > self.capacity:
+            best = heapq.nlargest(self.capacity, self.entries.items(), key = lambda entry: entry[1])
+            self.entries = dict(best)
+        return None
+
+    def get_programs (self, R_lim = -np.inf, exclude = None):
+        """
+        Returns programs in queue (sorted by decreasing rewards).
+        Parameters
+        ----------
+        R_lim : float, optional
+            Only programs having a reward >= R_lim are returned.
+        exclude : set of tuple of str or None, optional
+            Tokens names of programs not to return.
+        Returns
+        -------
+        tokens_names, rewards : list of list of str, numpy.array of shape (n,) of float
+            Tokens names and rewards of programs.
+        """
+        exclude = set() if exclude is None else exclude
+        entries = sorted([(R, names) for names, R in self.entries.items()
+                          if R >= R_lim and names not in exclude], key = lambda entry: -entry[0])
+        tokens_names = [list(names) for _, names in entries]
+        rewards      = np.array([R for R, _ in entries], dtype=float)
+        return tokens_names, rewards
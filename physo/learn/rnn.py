@@ -8,6 +8,8 @@ class Cell(torch.nn.Module):
         ----------
         input_size  : int
             Size of observation vector.
+        tokens_embedding_size : int or None
+            Size of embeddings of parent, sibling and previous tokens (None if tokens are observed as one-hots).
         n_layers    : int
             Number of stacked RNNs.
         hidden_size : int
@@ -15,6 +17,8 @@ class Cell(torch.nn.Module):
         output_size : int
             Number of features ie number of choices possible in the library of tokens.
 
+        tokens_embeddings : torch.nn.ModuleList of torch.nn.Embedding or None
+            Embedding tables of parent, sibling and previous tokens (None if tokens are observed as one-hots).
         input_dense       : torch.nn
             Input dense layer.
         stacked_cells     : torch.nn.ModuleList of torch.nn
@@ -72,6 +76,9 @@ class Cell(torch.nn.Module):
         print("outputs shape = ", outputs.shape)
 
     """
+    # Number of tokens (parent, sibling, previous) observed as idx when using tokens embeddings
+    N_EMBEDDED_TOKENS = 3
+
     def __init__(self,
                  input_size,
                  output_size,
@@ -81,13 +88,28 @@ class Cell(torch.nn.Module):
                  stacked_cells = None,
                  output_dense  = None,
                  is_lobotomized = False,
+                 tokens_embedding_size = None,
                  ):
         super().__init__()
+        # --------- Tokens embeddings ---------
+        self.tokens_embedding_size = tokens_embedding_size
+        self.tokens_embeddings     = None
+        dense_input_size           = input_size
+        # If tokens_embedding_size is given, the first N_EMBEDDED_TOKENS features of observations are idx of parent,
+        # sibling and previous tokens in [0, output_size] (see physym.batch.Batch.get_relatives_idx) which are embedded
+        # with lookup tables so the cost of a step does not grow with the number of choices.
+        if self.tokens_embedding_size is not None:
+            # One table per relative, output_size (no token) being the padding idx embedded as zeros
+            self.tokens_embeddings = torch.nn.ModuleList([torch.nn.Embedding(num_embeddings = output_size + 1,
+                                                                             embedding_dim  = self.tokens_embedding_size,
+                                                                             padding_idx    = output_size)
+                                for _ in range(self.N_EMBEDDED_TOKENS)])
+            dense_input_size = input_size - self.N_EMBEDDED_TOKENS + self.N_EMBEDDED_TOKENS*self.tokens_embedding_size
         # --------- Input dense layer ---------
         self.input_size  = input_size
         self.hidden_size = hidden_size
         if input_dense is None:
-            input_dense = torch.nn.Linear(self.input_size, self.hidden_size)
+            input_dense = torch.nn.Linear(dense_input_size, self.hidden_size)
         self.input_dense = input_dense
         # --------- Stacked RNN cells ---------
         self.n_layers      = n_layers
@@ -117,6 +139,11 @@ class Cell(torch.nn.Module):
                 input_tensor,                                         # (batch_size, input_size)
                 states,                                               # (n_layers, 2, batch_size, hidden_size)
                ):
+        # --------- Tokens embeddings ---------
+        if self.tokens_embeddings is not None:
+            tokens_idx   = input_tensor[:, :self.N_EMBEDDED_TOKENS].long()                       # (batch_size, N_EMBEDDED_TOKENS)
+            embedded     = [embedding(tokens_idx[:, i]) for i, embedding in enumerate(self.tokens_embeddings)]
+            input_tensor = torch.cat(embedded + [input_tensor[:, self.N_EMBEDDED_TOKENS:]], dim=1) # (batch_size, dense_input_size)
         # --------- Input dense layer ---------
         hx = self.input_dense(input_tensor)                           # (batch_size, hidden_size)
         # layer norm + activation
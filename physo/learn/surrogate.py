@@ -0,0 +1,170 @@
+import numpy as np
+
+
+class RewardSurrogate:
+    """
+    Lightweight surrogate model of rewards trained online so that only promising programs are really evaluated.
+    Programs are described by token features (occurrences of each choosable token, length and physicality) and rewards
+    are predicted by a ridge regression fitted on programs evaluated in previous epochs. The top fraction of programs
+    (w.r.t. predicted rewards) plus an exploration slice of randomly chosen other programs are selected for evaluation.
+    """
+    def __init__(self, fraction = 0.5, exploration = 0.1, buffer_size = 10000, min_samples = 100, l2_reg = 1e-3,
+                 seed = None):
+        """
+        Parameters
+        ----------
+        fraction : float, optional
+            Fraction of programs having the highest predicted rewards selected for evaluation (0.5 by default).
+        exploration : float, optional
+            Fraction of programs randomly selected for evaluation among the other programs (0.1 by default).
+        buffer_size : int, optional
+            Max number of (features, reward) pairs of evaluated programs kept to fit the surrogate (most recent ones
+            being kept), 10000 by default.
+        min_samples : int, optional
+            Nb. of evaluated programs required before selecting programs, all programs being evaluated until then (100
+            by default).
+        l2_reg : float, optional
+            L2 regularization of the ridge regression (1e-3 by default).
+        seed : int or None, optional
+            Seed of the random generator of the surrogate (used to pick the exploration slice). The surrogate has its
+            own generator as it may be used by the rewards worker thread of a pipelined learner concurrently with the
+            global np.random stream used for sampling. By default None, the seed is drawn from np.random at
+            construction so runs seeded with np.random.seed remain reproducible.
+        """
+        assert 0. < fraction <= 1.,    "fraction must be in ]0, 1]."
+        assert 0. <= exploration <= 1., "exploration must be in [0, 1]."
+        self.fraction    = fraction
+        self.exploration = exploration
+        self.buffer_size = buffer_size
+        self.min_samples = min_samples
+        self.l2_reg      = l2_reg
+        self.rng         = np.random.default_rng(np.random.randint(2**31) if seed is None else seed)
+        # Evaluated programs
+        self.features = None                                                          # (n_samples, n_features,)
+        self.rewards  = None                                                          # (n_samples,)
+        # Ridge regression weights
+        self.weights  = None                                                          # (n_features,)
+
+    @staticmethod
+    def get_features (batch):
+        """
+        Computes features of programs of batch.
+        Parameters
+        ----------
+        batch : physym.batch.Batch
+            Batch of programs.
+        Returns
+        -------
+        features : numpy.array of shape (batch_size, n_choices + 3,) of float
+            Occurrences of each choosable token (normalized by max_time_step), length (normalized by max_time_step),
+            physicality and bias.
+        """
+        programs      = batch.programs
+        batch_size    = batch.batch_size
+        max_time_step = batch.max_time_step
+        n_choices     = batch.n_choices
+        # Occurrences of tokens (only considering tokens within programs' lengths)
+        mask_length = np.arange(max_time_step)[None, :] < programs.n_lengths[:, None]         # (batch_size, max_time_step,)
+        rows        = np.broadcast_to(np.arange(batch_size)[:, None], mask_length.shape)      # (batch_size, max_time_step,)
+        counts      = np.zeros((batch_size, batch.library.n_library))                          # (batch_size, n_library,)
+        np.add.at(counts, (rows[mask_length], programs.tokens.idx[mask_length]), 1.)
+        features = np.concatenate((counts[:, :n_choices]/max_time_step,                       # (batch_size, n_choices + 3,)
+                                   programs.n_lengths[:, None]/max_time_step,
+                                   programs.is_physical[:, None].astype(float),
+                                   np.ones((batch_size, 1))), axis=1)
+        return features
+
+    def predict (self, features):
+        """
+        Predicts rewards.
+        Parameters
+        ----------
+        features : numpy.array of shape (n, n_features,) of float
+            Features of programs (see get_features).
+        Returns
+        -------
+        rewards : numpy.array of shape (n,) of float
+            Predicted rewards.
+        """
+        return features @ self.weights
+
+    def select (self, batch):
+        """
+        Selects programs of batch to evaluate.
+        Parameters
+        ----------
+        batch : physym.batch.Batch
+            Batch of programs.
+        Returns
+        -------
+        mask : numpy.array of shape (batch_size,) of bool
+            Programs to evaluate (all programs until the surrogate is fitted).
+        """
+        batch_size = batch.batch_size
+        mask = np.full(batch_size, True)
+        if self.weights is None:
+            return mask
+        predicted = self.predict(self.get_features(batch))                            # (batch_size,)
+        order     = np.argsort(-predicted, kind="stable")                             # (batch_size,)
+        n_top     = int(self.fraction*batch_size)
+        n_explore = min(int(self.exploration*batch_size), batch_size - n_top)
+        mask[:] = False
+        mask[order[:n_top]] = True
+        mask[self.rng.choice(order[n_top:], size = n_explore, replace = False)] = True
+        return mask
+
+    def update (self, batch, rewards, mask):
+        """
+        Adds evaluated programs of batch to the training data of the surrogate and re-fits it.
+        Parameters
+        ----------
+        batch : physym.batch.Batch
+            Batch of programs.
+        rewards : numpy.array of shape (batch_size,) of float
+            Rewards of programs.
+        mask : numpy.array of shape (batch_size,) of bool
+            Evaluated programs.
+        """
+        features = self.get_features(batch)[mask]                                     # (n_evaluated, n_features,)
+        rewards  = np.asarray(rewards)[mask]                                          # (n_evaluated,)
+        if self.features is not None and self.features.shape[1] == features.shape[1]:
+            features = np.concatenate((self.features, features), axis=0)
+            rewards  = np.concatenate((self.rewards , rewards ), axis=0)
+        self.features = features[-self.buffer_size:]
+        self.rewards  = rewards [-self.buffer_size:]
+        # Ridge regression
+        if len(self.rewards) >= self.min_samples:
+            n_features   = self.features.shape[1]
+            self.weights = np.linalg.solve(self.features.T @ self.features + self.l2_reg*np.eye(n_features),
+                                           self.features.T @ self.rewards)
+        return None
+
+    def get_state (self):
+        """
+        Returns picklable state of surrogate (for checkpointing purposes, see learn.checkpoint), ie. its training data,
+        weights and random generator state, hyperparameters not being part of it.
+        Returns
+        -------
+        state : dict
+        """
+        state = {
+            "features" : None if self.features is None else self.features.copy(),
+            "rewards"  : None if self.rewards  is None else self.rewards .copy(),
+            "weights"  : None if self.weights  is None else self.weights .copy(),
+            "rng"      : self.rng.bit_generator.state,
+        }
+        return state
+
+    def set_state (self, state):
+        """
+        Restores state of surrogate (see get_state).
+        Parameters
+        ----------
+        state : dict
+            State of surrogate.
+        """
+        self.features = state["features"]
+        self.rewards  = state["rewards"]
+        self.weights  = state["weights"]
+        self.rng.bit_generator.state = state["rng"]
+        return None
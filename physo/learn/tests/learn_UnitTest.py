@@ -0,0 +1,883 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+import numpy as np
+import torch
+import torch.distributed as dist
+
+# Internal imports
+from physo.physym import batch as Batch
+from physo.physym import reward
+from physo.physym.functions import data_conversion
+from physo.learn import rnn
+from physo.learn import learn
+from physo.learn import loss
+from physo.learn import monitoring
+from physo.learn import checkpoint
+from physo.learn import migration
+from physo.learn import replay
+from physo.learn import surrogate
+
+def data_parallel_worker(rank, world_size, tmp_dir):
+    """
+    Runs learner in data-parallel mode on rank (see LearnTest.test_data_parallel_learner).
+    """
+    dist.init_process_group(backend     = "gloo",
+                            init_method = "file://" + os.path.join(tmp_dir, "init"),
+                            rank        = rank,
+                            world_size  = world_size)
+    # Different seeds so ranks sample different programs (and have different initial models)
+    torch.manual_seed(rank)
+    np.random.seed(rank)
+
+    # --- DATA ---
+    x_array = np.linspace(0.04, 4, 100)
+    X = torch.stack((data_conversion(x_array),), axis=0)
+    y_target = data_conversion(x_array/1.028 + 0.995)
+
+    # --- BATCH ---
+    args_make_tokens = {
+                    # operations
+                    "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                    "use_protected_ops"    : True,
+                    # input variables
+                    "input_var_ids"        : {"x" : 0         },
+                    "input_var_units"      : {"x" : [1, 0, 0] },
+                    "input_var_complexity" : {"x" : 0.        },
+                        }
+    def shard_maker(max_time_step):
+        return Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                               "superparent_units" : [1, 0, 0],
+                                               "superparent_name"  : "y",},
+                           priors_config    = [("UniformArityPrior", None),
+                                               ("HardLengthPrior", {"min_length": 1, "max_length": max_time_step, }),],
+                           batch_size       = 25,
+                           max_time_step    = max_time_step,
+                           rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                           X        = X,
+                           y_target = y_target,)
+    # Adaptive max_time_step (ranks must resize their shards at the same epochs)
+    shards = [shard_maker(max_time_step = 4)]
+    def max_time_step_resizer(new_max_time_step):
+        shards.append(shard_maker(max_time_step = new_max_time_step))
+    def batch_reseter():
+        shards[-1].reset()
+        return shards[-1]
+    shard = shards[0]
+
+    # --- LEARNER ---
+    cell = rnn.Cell(input_size = shard.obs_size, output_size = shard.n_choices, hidden_size = 16)
+    hall_of_fame_R, hall_of_fame = learn.learner(model          = cell,
+                                                 optimizer      = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                 n_epochs       = 3,
+                                                 batch_reseter  = batch_reseter,
+                                                 risk_factor    = 0.5,
+                                                 gamma_decay    = 0.7,
+                                                 entropy_weight = 0.005,
+                                                 verbose        = False,
+                                                 data_parallel  = True,
+                                                 max_time_step_resizer = max_time_step_resizer,
+                                                 max_time_step_limit   = 10,
+                                                 max_time_step_growth  = 3,)
+    torch.save({"params"         : [p.detach() for p in cell.parameters()],
+                "max_time_steps" : [s.max_time_step for s in shards],
+                "hall_of_fame_R" : hall_of_fame_R,
+                "hall_of_fame"   : [prog.get_infix_str() for prog in hall_of_fame]},
+               os.path.join(tmp_dir, "rank_%i.pt"%(rank)))
+    dist.destroy_process_group()
+    return None
+
+class LearnTest(unittest.TestCase):
+
+    def test_sampling_step(self):
+
+        # ------- TEST CASE -------
+        n_choices   = 30
+        input_size  = 3*n_choices + 1 + 4*8
+        hidden_size = 128
+        n_steps     = 35
+
+        # --- TRACED STEP GIVES SAME ACTIONS AND GRADIENTS AS EAGER STEP ---
+        batch_size   = 100
+        observations = torch.rand(batch_size, input_size)
+        logprior     = torch.log(torch.rand(batch_size, n_choices) > 0.3)        # (batch_size, n_choices)
+        logprior[:, 0] = 0.                                                      # at least one legal choice
+        torch.manual_seed(0)
+        cell = rnn.Cell(input_size = input_size, output_size = n_choices, hidden_size = hidden_size)
+        results = {}
+        for compile_mode in [None, "trace"]:
+            cell.zero_grad()
+            sampling_step = learn.make_sampling_step(model = cell, compile_mode = compile_mode)
+            states = cell.get_zeros_initial_state(batch_size)
+            torch.manual_seed(42)
+            logits, actions = [], []
+            for _ in range(n_steps):
+                logit, action, states = sampling_step(observations = observations, states = states, logprior = logprior)
+                logits .append(logit)
+                actions.append(action)
+            logits  = torch.stack(logits)                                        # (n_steps, batch_size, n_choices)
+            actions = torch.stack(actions)                                       # (n_steps, batch_size)
+            # Sampled actions are legal
+            self.assertTrue(torch.isfinite(torch.gather(logits, 2, actions[:, :, None])).all())
+            logits.masked_fill(torch.isinf(logits), 0.).sum().backward()
+            grads = [p.grad.clone() for p in cell.parameters()]
+            results[compile_mode] = (actions, grads)
+        self.assertTrue(torch.equal(results[None][0], results["trace"][0]))
+        for grad, grad_traced in zip(results[None][1], results["trace"][1]):
+            self.assertTrue(torch.allclose(grad, grad_traced, atol=1e-5))
+
+        # --- CPU TIMINGS ---
+        for batch_size in [int(1e3), int(1e4)]:
+            observations = torch.rand(batch_size, input_size)
+            logprior     = torch.zeros(batch_size, n_choices)
+            for compile_mode in [None, "trace"]:
+                sampling_step = learn.make_sampling_step(model = cell, compile_mode = compile_mode)
+                states = cell.get_zeros_initial_state(batch_size)
+                sampling_step(observations = observations, states = states, logprior = logprior) # warm-up (tracing)
+                t0 = time.perf_counter()
+                for _ in range(n_steps):
+                    logit, action, states = sampling_step(observations = observations, states = states, logprior = logprior)
+                t1 = time.perf_counter()
+                print("\nSampling step (compile_mode = %s, batch_size = %i) time = %.3f ms"
+                      % (compile_mode, batch_size, (t1-t0)*1e3/n_steps))
+        return None
+
+    def test_recompute_logits(self):
+
+        # ------- TEST CASE -------
+        n_choices   = 12
+        input_size  = 3*n_choices + 1 + 4*8
+        hidden_size = 32
+        n_steps     = 10
+        batch_size  = 200
+        torch.manual_seed(0)
+        cell = rnn.Cell(input_size = input_size, output_size = n_choices, hidden_size = hidden_size)
+        observations = [torch.rand(batch_size, input_size) for _ in range(n_steps)]
+        logpriors    = [torch.log(torch.rand(batch_size, n_choices)) for _ in range(n_steps)]
+        rows         = np.array([3, 17, 42, 199, 0])
+
+        # --- Differentiable sampling pass on whole batch ---
+        states = cell.get_zeros_initial_state(batch_size)
+        logits = []
+        for obs, logprior in zip(observations, logpriors):
+            output, states = cell(input_tensor = obs, states = states)
+            logits.append(output + logprior)
+        logits = torch.stack(logits, dim=0)                                      # (n_steps, batch_size, n_choices)
+        logits[:, rows].sum().backward()
+        grads = [p.grad.clone() for p in cell.parameters()]
+
+        # --- Teacher forced re-run on rows only ---
+        cell.zero_grad()
+        with torch.no_grad():
+            self.assertFalse(learn.recompute_logits(cell, observations, logpriors, rows).requires_grad)
+        logits_rows = learn.recompute_logits(model = cell, observations = observations, logpriors = logpriors, rows = rows)
+        self.assertEqual(tuple(logits_rows.shape), (n_steps, len(rows), n_choices))
+        self.assertTrue(torch.allclose(logits_rows, logits[:, rows].detach(), atol=1e-5))
+        logits_rows.sum().backward()
+        for grad, grad_rows in zip(grads, [p.grad for p in cell.parameters()]):
+            self.assertTrue(torch.allclose(grad, grad_rows, atol=1e-4))
+        return None
+
+    def test_loss_from_actions(self):
+
+        # ------- TEST CASE -------
+        max_time_step = 20
+        n_train       = 50
+        n_choices     = 12
+        torch.manual_seed(0)
+        logits_train = torch.randn(max_time_step, n_train, n_choices, requires_grad=True)
+        # Illegal choices
+        logprior = torch.log((torch.rand(max_time_step, n_train, n_choices) > 0.3).float())
+        logprior[:, :, 0] = 0.
+        actions_train = torch.multinomial(torch.exp(logits_train + logprior).reshape(-1, n_choices).detach(),
+                                          num_samples=1).reshape(max_time_step, n_train)
+        R_train = torch.rand(n_train, dtype=torch.float64)
+        lengths = np.random.randint(1, max_time_step+1, size=n_train)
+        args = {"R_train"        : R_train,
+                "baseline"       : R_train.min(),
+                "lengths"        : lengths,
+                "gamma_decay"    : 0.7,
+                "entropy_weight" : 0.005,}
+
+        # --- One-hot loss ---
+        ideal_probs_train = torch.nn.functional.one_hot(actions_train, n_choices).float()
+        loss_one_hot = loss.loss_func(logits_train = logits_train + logprior, ideal_probs_train = ideal_probs_train, **args)
+        grad_one_hot, = torch.autograd.grad(loss_one_hot, logits_train)
+
+        # --- Loss from actions idx ---
+        t0 = time.perf_counter()
+        loss_actions = loss.loss_func_from_actions(logits_train = logits_train + logprior, actions_train = actions_train, **args)
+        t1 = time.perf_counter()
+        print("\nloss_func_from_actions time = %.3f ms"%((t1-t0)*1e3))
+        grad_actions, = torch.autograd.grad(loss_actions, logits_train)
+
+        # --- Test ---
+        self.assertTrue(torch.isfinite(loss_actions))
+        self.assertTrue(torch.allclose(loss_one_hot.double(), loss_actions.double(), rtol=1e-5))
+        self.assertTrue(torch.allclose(grad_one_hot, grad_actions, atol=1e-6))
+        # Decay vectors are cached
+        self.assertIs(loss.get_gamma_decay_vector(0.7, max_time_step), loss.get_gamma_decay_vector(0.7, max_time_step))
+        return None
+
+    def test_merge_elite_pools(self):
+
+        # ------- TEST CASE -------
+        max_time_step, obs_size, n_choices = 5, 7, 4
+        def make_candidates(R):
+            n = len(R)
+            return {"R"            : np.array(R),
+                    "lengths"      : np.arange(n),
+                    "actions"      : torch.arange(n)[:, None].repeat(1, max_time_step),
+                    "observations" : torch.rand(n, max_time_step, obs_size),
+                    "logpriors"    : torch.rand(n, max_time_step, n_choices),}
+        candidates_0 = make_candidates([0.1, 0.9, 0.5])
+        candidates_1 = make_candidates([0.7, 0.2, 0.95, 0.3])
+        pool = learn.merge_elite_pools(pool = None, candidates = candidates_0, n_keep = 4)
+        np.testing.assert_array_equal(pool["R"], [0.9, 0.5, 0.1])
+        pool = learn.merge_elite_pools(pool = pool, candidates = candidates_1, n_keep = 4)
+        # Best candidates over both micro-batches, sorted by decreasing reward
+        np.testing.assert_array_equal(pool["R"], [0.95, 0.9, 0.7, 0.5])
+        np.testing.assert_array_equal(pool["lengths"], [2, 1, 0, 2])
+        self.assertTrue(torch.equal(pool["observations"][0], candidates_1["observations"][2]))
+        self.assertTrue(torch.equal(pool["observations"][1], candidates_0["observations"][1]))
+        self.assertTrue(torch.equal(pool["logpriors"]   [3], candidates_0["logpriors"]   [2]))
+        self.assertTrue(torch.equal(pool["actions"][:, 0], torch.tensor([2, 1, 0, 2])))
+        return None
+
+    def test_micro_batches_learner(self):
+
+        # ------- TEST CASE -------
+        # --- DATA ---
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995)
+
+        # --- BATCH ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        micro_batch = Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                                      "superparent_units" : [1, 0, 0],
+                                                      "superparent_name"  : "y",},
+                                  priors_config    = [("UniformArityPrior", None),
+                                                      ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                                  batch_size       = 50,
+                                  max_time_step    = 10,
+                                  rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                                  X        = X,
+                                  y_target = y_target,)
+        def batch_reseter():
+            micro_batch.reset()
+            return micro_batch
+
+        # --- LEARNER ---
+        torch.manual_seed(0)
+        cell = rnn.Cell(input_size = micro_batch.obs_size, output_size = micro_batch.n_choices, hidden_size = 16)
+        params_before = [p.detach().clone() for p in cell.parameters()]
+        run_logger = monitoring.RunLogger()
+        # risk_factor * n_micro_batches > 1 : gradients are accumulated over several chunks of elite candidates
+        hall_of_fame_R, hall_of_fame = learn.learner(model           = cell,
+                                                     optimizer       = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                     n_epochs        = 2,
+                                                     batch_reseter   = batch_reseter,
+                                                     risk_factor     = 0.5,
+                                                     gamma_decay     = 0.7,
+                                                     entropy_weight  = 0.005,
+                                                     verbose         = False,
+                                                     n_micro_batches = 3,
+                                                     run_logger      = run_logger,)
+        # --- TEST ---
+        self.assertEqual(len(hall_of_fame_R), 2)
+        self.assertEqual(len(hall_of_fame), len(np.unique(hall_of_fame_R)))
+        self.assertTrue(np.isfinite(hall_of_fame_R).all())
+        # Model was updated
+        self.assertTrue(any([not torch.equal(p0, p) for p0, p in zip(params_before, cell.parameters())]))
+        # run_logger logs each epoch once, against the same epoch index as the hall of fame
+        self.assertEqual(run_logger.epochs_history, [0, 1])
+        self.assertTrue(np.isfinite(run_logger.loss_history).all())
+        self.assertTrue(len(run_logger.get_pareto_front()[0]) > 0)
+
+        # No elite candidate (risk_factor*batch_size*n_micro_batches < 1) : no update, no error
+        params_before = [p.detach().clone() for p in cell.parameters()]
+        run_logger = monitoring.RunLogger()
+        hall_of_fame_R, hall_of_fame = learn.learner(model           = cell,
+                                                     optimizer       = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                     n_epochs        = 2,
+                                                     batch_reseter   = batch_reseter,
+                                                     risk_factor     = 0.001,
+                                                     gamma_decay     = 0.7,
+                                                     entropy_weight  = 0.005,
+                                                     verbose         = False,
+                                                     n_micro_batches = 3,
+                                                     run_logger      = run_logger,)
+        self.assertEqual(len(hall_of_fame_R), 2)
+        self.assertEqual(run_logger.epochs_history, [0, 1])
+        self.assertTrue(all([torch.equal(p0, p) for p0, p in zip(params_before, cell.parameters())]))
+        return None
+
+    def test_pipelined_learner(self):
+
+        # ------- TEST CASE -------
+        # --- DATA ---
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995)
+
+        # --- BATCHES ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        def batch_maker():
+            return Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                                   "superparent_units" : [1, 0, 0],
+                                                   "superparent_name"  : "y",},
+                               priors_config    = [("UniformArityPrior", None),
+                                                   ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                               batch_size       = 50,
+                               max_time_step    = 10,
+                               rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                               X        = X,
+                               y_target = y_target,)
+        # Alternating between two batches as rewards of one are computed while the other is sampled
+        batches  = [batch_maker(), batch_maker()]
+        reseted  = []
+        def batch_reseter():
+            reseted.append(0)
+            batches[0].reset()
+            return batches[0]
+        def pipelined_batch_reseter():
+            reseted.append(1)
+            batches[1].reset()
+            return batches[1]
+
+        # --- LEARNER ---
+        torch.manual_seed(0)
+        cell = rnn.Cell(input_size = batches[0].obs_size, output_size = batches[0].n_choices, hidden_size = 16)
+        params_before = [p.detach().clone() for p in cell.parameters()]
+        n_epochs = 3
+        hall_of_fame_R, hall_of_fame = learn.learner(model           = cell,
+                                                     optimizer       = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                     n_epochs        = n_epochs,
+                                                     batch_reseter   = batch_reseter,
+                                                     risk_factor     = 0.5,
+                                                     gamma_decay     = 0.7,
+                                                     entropy_weight  = 0.005,
+                                                     verbose         = False,
+                                                     pipelined       = True,
+                                                     pipelined_batch_reseter = pipelined_batch_reseter,)
+        # --- TEST ---
+        # One sampling and one learning step per epoch (after checking once that batches are different)
+        self.assertEqual(reseted, [0, 1] + [epoch % 2 for epoch in range(n_epochs)])
+        self.assertEqual(len(hall_of_fame_R), n_epochs)
+        self.assertTrue(np.isfinite(hall_of_fame_R).all())
+        # Model was updated
+        self.assertTrue(any([not torch.equal(p0, p) for p0, p in zip(params_before, cell.parameters())]))
+
+        # --- TEST : SAME BATCH RETURNED TWICE ---
+        # (detected before any batch is in use)
+        with self.assertRaises(AssertionError):
+            learn.learner(model           = cell,
+                          optimizer       = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                          n_epochs        = 2,
+                          batch_reseter   = batch_reseter,
+                          risk_factor     = 0.5,
+                          gamma_decay     = 0.7,
+                          entropy_weight  = 0.005,
+                          verbose         = False,
+                          pipelined       = True,
+                          pipelined_batch_reseter = batch_reseter,)
+        return None
+
+    def test_checkpoint_resume(self):
+
+        # ------- TEST CASE -------
+        # --- DATA ---
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995)
+
+        # --- BATCH ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+
+        def run(seed, **kwargs):
+            # Fresh objects for each run (as in a new process after a preemption)
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+            batch = Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                                    "superparent_units" : [1, 0, 0],
+                                                    "superparent_name"  : "y",},
+                                priors_config    = [("UniformArityPrior", None),
+                                                    ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                                batch_size       = 50,
+                                max_time_step    = 10,
+                                rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                                X        = X,
+                                y_target = y_target,)
+            def batch_reseter():
+                batch.reset()
+                return batch
+            cell       = rnn.Cell(input_size = batch.obs_size, output_size = batch.n_choices, hidden_size = 16)
+            run_logger = monitoring.RunLogger()
+            hall_of_fame_R, hall_of_fame = learn.learner(model          = cell,
+                                                         optimizer      = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                         n_epochs       = 5,
+                                                         batch_reseter  = batch_reseter,
+                                                         risk_factor    = 0.5,
+                                                         gamma_decay    = 0.7,
+                                                         entropy_weight = 0.005,
+                                                         verbose        = False,
+                                                         run_logger     = run_logger,
+                                                         **kwargs)
+            return cell, run_logger, hall_of_fame_R, hall_of_fame
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "run.ckpt")
+            # Uninterrupted run saving a checkpoint at beginning of epoch 3
+            cell, run_logger, hall_of_fame_R, hall_of_fame = run(seed = 0,
+                                                                 checkpoint_path  = checkpoint_path,
+                                                                 checkpoint_every = 3)
+            self.assertTrue(os.path.exists(checkpoint_path))
+            self.assertFalse(os.path.exists(checkpoint_path + ".tmp"))
+            # Run resumed from epoch 3 (different seed and initial model)
+            cell_res, run_logger_res, hall_of_fame_R_res, hall_of_fame_res = run(seed = 1, resume_path = checkpoint_path)
+
+        # --- TEST ---
+        # Same model
+        for p, p_res in zip(cell.parameters(), cell_res.parameters()):
+            self.assertTrue(torch.equal(p, p_res))
+        # Same hall of fame
+        self.assertTrue(np.array_equal(hall_of_fame_R, hall_of_fame_R_res))
+        self.assertEqual([prog.get_infix_str() for prog in hall_of_fame    ],
+                         [prog.get_infix_str() for prog in hall_of_fame_res])
+        # Same logs
+        self.assertEqual(run_logger_res.epochs_history, list(range(5)))
+        self.assertTrue(np.array_equal(run_logger.max_R_history, run_logger_res.max_R_history))
+        self.assertTrue(np.array_equal(run_logger.loss_history , run_logger_res.loss_history ))
+        self.assertEqual(run_logger.overall_best_prog_str_history, run_logger_res.overall_best_prog_str_history)
+        self.assertTrue(np.array_equal(run_logger.pareto_rewards, run_logger_res.pareto_rewards, equal_nan=True))
+        self.assertEqual(run_logger.best_prog.get_infix_str(), run_logger_res.best_prog.get_infix_str())
+
+        # --- TEST : RESUMING ADAPTIVE MAX_TIME_STEP RUN WITHOUT RESIZER ---
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "run.ckpt")
+            run(seed = 0, checkpoint_path = checkpoint_path, checkpoint_every = 3)
+            ckpt = checkpoint.load_checkpoint(checkpoint_path)
+            # Same max_time_step as batches : no resizer needed
+            ckpt["max_time_step"] = 10
+            checkpoint.save_checkpoint(ckpt, checkpoint_path)
+            run(seed = 1, resume_path = checkpoint_path)
+            # Batches can not be resized
+            ckpt["max_time_step"] = 12
+            checkpoint.save_checkpoint(ckpt, checkpoint_path)
+            with self.assertRaises(AssertionError):
+                run(seed = 1, resume_path = checkpoint_path)
+
+        # --- TEST : RNG STATES ---
+        rng_state = checkpoint.get_rng_state()
+        draws = (torch.rand(3), np.random.rand(3), torch.rand(3, device="cuda") if torch.cuda.is_available() else None)
+        checkpoint.set_rng_state(rng_state)
+        draws_res = (torch.rand(3), np.random.rand(3), torch.rand(3, device="cuda") if torch.cuda.is_available() else None)
+        self.assertTrue(torch.equal(draws[0], draws_res[0]))
+        self.assertTrue(np.array_equal(draws[1], draws_res[1]))
+        if torch.cuda.is_available():
+            self.assertTrue(torch.equal(draws[2], draws_res[2]))
+        return None
+
+    def test_data_parallel_learner(self):
+        world_size = 2
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            torch.multiprocessing.spawn(data_parallel_worker, args = (world_size, tmp_dir), nprocs = world_size)
+            results = [torch.load(os.path.join(tmp_dir, "rank_%i.pt"%(rank)), weights_only=False)
+                       for rank in range(world_size)]
+        # --- TEST ---
+        # All ranks share the same model
+        for rank in range(1, world_size):
+            for p0, p in zip(results[0]["params"], results[rank]["params"]):
+                self.assertTrue(torch.equal(p0, p))
+        # Global hall of fame
+        for rank in range(1, world_size):
+            self.assertTrue(np.array_equal(results[0]["hall_of_fame_R"], results[rank]["hall_of_fame_R"]))
+            self.assertEqual(results[0]["hall_of_fame"], results[rank]["hall_of_fame"])
+        self.assertTrue(np.isfinite(results[0]["hall_of_fame_R"]).all())
+        # Same adaptive max_time_step decisions
+        self.assertTrue(len(results[0]["max_time_steps"]) > 1)
+        for rank in range(1, world_size):
+            self.assertEqual(results[0]["max_time_steps"], results[rank]["max_time_steps"])
+        return None
+
+    def test_island_migration(self):
+
+        # ------- TEST CASE -------
+        # --- DATA ---
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995)
+
+        # --- BATCHES ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        def batch_maker(batch_size):
+            return Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                                   "superparent_units" : [1, 0, 0],
+                                                   "superparent_name"  : "y",},
+                               priors_config    = [("UniformArityPrior", None),
+                                                   ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                               batch_size       = batch_size,
+                               max_time_step    = 10,
+                               rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                               X        = X,
+                               y_target = y_target,)
+        batch          = batch_maker(batch_size = 50)
+        migrants_batch = batch_maker(batch_size = 5)
+        def batch_reseter():
+            batch.reset()
+            return batch
+        def migrants_batch_reseter():
+            migrants_batch.reset()
+            return migrants_batch
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # --- MIGRATORS ---
+            migrator_0 = migration.FileMigrator(directory = tmp_dir, island_id = 0, n_migrants = 3, period = 2)
+            migrator_1 = migration.FileMigrator(directory = tmp_dir, island_id = 1, n_migrants = 3, period = 2,
+                                                n_immigrants = 5)
+            torch.manual_seed(0)
+            cell = rnn.Cell(input_size = batch.obs_size, output_size = batch.n_choices, hidden_size = 16)
+            with torch.no_grad():
+                learn.sample_batch(batch = batch, model = cell, sampling_step = learn.make_sampling_step(cell))
+            R = batch.get_rewards()
+            # Not a migration epoch
+            self.assertEqual(migrator_0.migrate(epoch = 0, batch = batch, rewards = R), [])
+            # Best complete programs of island 0 are received by island 1
+            self.assertEqual(migrator_0.migrate(epoch = 1, batch = batch, rewards = R), [])
+            migrants = migrator_1.immigrate()
+            self.assertEqual(migrants, [names for _, names in migrator_0.best])
+            # Plain JSON files
+            with open(migrator_0.path, "r") as f:
+                self.assertEqual(json.load(f), [[R, names] for R, names in migrator_0.best])
+            self.assertEqual(migration.load_migrants(migrator_0.path), migrator_0.best)
+            self.assertTrue(0 < len(migrants) <= 3)
+            best_R = R[batch.programs.is_complete].max()
+            self.assertEqual(migrator_0.best[0][0], best_R)
+
+            # --- REPLAY ---
+            # Unknown token and too long programs are invalid
+            rows, actions, observations, logpriors = learn.replay_programs(batch        = migrants_batch_reseter(),
+                                                                            tokens_names = [["foo"], ["x"]*11] + migrants)
+            self.assertTrue(np.array_equal(rows, np.arange(len(migrants))))
+            for i, names in enumerate(migrants):
+                self.assertEqual([tok.name for tok in migrants_batch.programs.get_prog_tokens(i)], names)
+                self.assertTrue(torch.equal(actions[:len(names), i],
+                                            torch.tensor([batch.library.lib_name_to_idx[name] for name in names])))
+            self.assertEqual(migrants_batch.get_rewards()[0], best_R)
+            # Logits can be computed with teacher forcing
+            logits = learn.recompute_logits(model = cell, observations = observations, logpriors = logpriors, rows = rows)
+            self.assertEqual(logits.shape, (len(observations), len(rows), batch.n_choices))
+            self.assertTrue(torch.isfinite(torch.gather(logits, 2, actions[:len(observations), rows, None])[:, :, 0][
+                torch.arange(len(observations))[:, None] < torch.tensor(migrants_batch.programs.n_lengths[rows])]).all())
+
+            # --- LEARNER ---
+            hall_of_fame_R, hall_of_fame = learn.learner(model          = cell,
+                                                         optimizer      = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                         n_epochs       = 2,
+                                                         batch_reseter  = batch_reseter,
+                                                         risk_factor    = 0.5,
+                                                         gamma_decay    = 0.7,
+                                                         entropy_weight = 0.005,
+                                                         verbose        = False,
+                                                         migrator       = migrator_1,
+                                                         migrants_batch_reseter = migrants_batch_reseter,
+                                                         checkpoint_path  = os.path.join(tmp_dir, "run.ckpt"),
+                                                         checkpoint_every = 1,)
+            self.assertTrue(np.isfinite(hall_of_fame_R).all())
+            # Island 1 published its best programs
+            self.assertTrue(os.path.exists(migrator_1.path))
+            # Best programs of island are restored when resuming (checkpoint saved at beginning of epoch 1)
+            migrator_1_res = migration.FileMigrator(directory = tmp_dir, island_id = 1, n_migrants = 3, period = 2,
+                                                    n_immigrants = 5)
+            learn.learner(model          = cell,
+                          optimizer      = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                          n_epochs       = 1,
+                          batch_reseter  = batch_reseter,
+                          risk_factor    = 0.5,
+                          gamma_decay    = 0.7,
+                          entropy_weight = 0.005,
+                          verbose        = False,
+                          migrator       = migrator_1_res,
+                          migrants_batch_reseter = migrants_batch_reseter,
+                          resume_path    = os.path.join(tmp_dir, "run.ckpt"),)
+            self.assertTrue(len(migrator_1_res.best) > 0)
+            self.assertEqual(migrator_1_res.best,
+                             checkpoint.load_checkpoint(os.path.join(tmp_dir, "run.ckpt"))["migrator_best"])
+        return None
+
+    def test_replay(self):
+
+        # ------- TEST CASE -------
+        # --- DATA ---
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995)
+
+        # --- BATCHES ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        def batch_maker(batch_size):
+            return Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                                   "superparent_units" : [1, 0, 0],
+                                                   "superparent_name"  : "y",},
+                               priors_config    = [("UniformArityPrior", None),
+                                                   ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                               batch_size       = batch_size,
+                               max_time_step    = 10,
+                               rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                               X        = X,
+                               y_target = y_target,)
+        replay_size  = 10
+        batch        = batch_maker(batch_size = 50)
+        replay_batch = batch_maker(batch_size = replay_size)
+        def batch_reseter():
+            batch.reset()
+            return batch
+        def replay_batch_reseter():
+            replay_batch.reset()
+            return replay_batch
+
+        # --- QUEUE ---
+        torch.manual_seed(0)
+        cell = rnn.Cell(input_size = batch.obs_size, output_size = batch.n_choices, hidden_size = 16)
+        queue = replay.ReplayQueue(capacity = replay_size)
+        with torch.no_grad():
+            learn.sample_batch(batch = batch, model = cell, sampling_step = learn.make_sampling_step(cell))
+        R = batch.get_rewards()
+        queue.push(batch = batch, rewards = R, rows = np.arange(batch.batch_size))
+        queue.push(batch = batch, rewards = R, rows = np.arange(batch.batch_size))
+        tokens_names, rewards = queue.get_programs()
+        # Bounded and without duplicates
+        names = [tuple(tok.name for tok in batch.programs.get_prog_tokens(i)) for i in range(batch.batch_size)
+                 if batch.programs.is_complete[i] and R[i] > 0.]
+        self.assertEqual(len(queue), min(replay_size, len(set(names))))
+        self.assertEqual(len(set([tuple(n) for n in tokens_names])), len(tokens_names))
+        # Best programs sorted by decreasing rewards
+        self.assertEqual(rewards[0], R[[i for i in range(batch.batch_size) if batch.programs.is_complete[i]]].max())
+        self.assertTrue((np.diff(rewards) <= 0.).all())
+        # Threshold and exclusion
+        tokens_names_lim, rewards_lim = queue.get_programs(R_lim = rewards[2], exclude = {tuple(tokens_names[0])})
+        self.assertEqual(tokens_names_lim, tokens_names[1:3])
+        # Replayed programs keep their rewards without being evaluated again
+        logits, actions, R_replay, lengths, n_evaluated = learn.replay_train_candidates(model        = cell,
+                                                                                         batch        = replay_batch_reseter(),
+                                                                                         tokens_names = tokens_names,
+                                                                                         R_lim        = rewards[2],
+                                                                                         rewards      = rewards)
+        self.assertEqual(n_evaluated, 0)
+        self.assertTrue(np.array_equal(R_replay.numpy(), rewards[:3]))
+        self.assertEqual(logits.shape, (batch.max_time_step, 3, batch.n_choices))
+        self.assertEqual(actions.shape, (batch.max_time_step, 3))
+        self.assertTrue(np.array_equal(lengths, [len(n) for n in tokens_names[:3]]))
+
+        # --- LEARNER ---
+        hall_of_fame_R, hall_of_fame = learn.learner(model          = cell,
+                                                     optimizer      = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                     n_epochs       = 3,
+                                                     batch_reseter  = batch_reseter,
+                                                     risk_factor    = 0.5,
+                                                     gamma_decay    = 0.7,
+                                                     entropy_weight = 0.005,
+                                                     verbose        = False,
+                                                     replay_size    = replay_size,
+                                                     replay_batch_reseter = replay_batch_reseter,)
+        self.assertTrue(np.isfinite(hall_of_fame_R).all())
+        return None
+
+    # Test surrogate pre-ranking of programs
+    def test_surrogate(self):
+
+        # ------- TEST CASE -------
+        # --- DATA ---
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995)
+
+        # --- BATCH ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        batch_size = 100
+        batch = Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                                "superparent_units" : [1, 0, 0],
+                                                "superparent_name"  : "y",},
+                            priors_config    = [("UniformArityPrior", None),
+                                                ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                            batch_size       = batch_size,
+                            max_time_step    = 10,
+                            rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                            X        = X,
+                            y_target = y_target,)
+        def batch_reseter():
+            batch.reset()
+            return batch
+
+        torch.manual_seed(0)
+        np.random.seed(0)
+        cell = rnn.Cell(input_size = batch.obs_size, output_size = batch.n_choices, hidden_size = 16)
+        with torch.no_grad():
+            learn.sample_batch(batch = batch, model = cell, sampling_step = learn.make_sampling_step(cell))
+
+        # --- MASKED REWARDS ---
+        R = batch.get_rewards()
+        mask = np.arange(batch_size) % 2 == 0
+        R_masked = batch.get_rewards(mask = mask)
+        self.assertTrue((R_masked[~mask] == 0.).all())
+        self.assertTrue(np.array_equal(R_masked[mask], R[mask]))
+
+        # --- SURROGATE ---
+        model = surrogate.RewardSurrogate(fraction = 0.3, exploration = 0.1, min_samples = batch_size)
+        features = model.get_features(batch)
+        self.assertEqual(features.shape, (batch_size, batch.n_choices + 3))
+        self.assertTrue(np.allclose(features[:, :batch.n_choices].sum(axis=1)*batch.max_time_step,
+                                    batch.programs.n_lengths))
+        # All programs are evaluated until surrogate is fitted
+        self.assertTrue(model.select(batch).all())
+        model.update(batch = batch, rewards = R_masked, mask = mask)
+        self.assertIsNone(model.weights)
+        model.update(batch = batch, rewards = R, mask = np.full(batch_size, True))
+        self.assertEqual(len(model.rewards), batch_size + mask.sum())
+        # Top fraction + exploration slice (drawn from the generator of surrogate, not from the global np.random
+        # stream)
+        np_state = np.random.get_state()[1].copy()
+        selected = model.select(batch)
+        self.assertTrue(np.array_equal(np.random.get_state()[1], np_state))
+        self.assertEqual(selected.sum(), 40)
+        predicted = model.predict(features)
+        top = np.argsort(-predicted, kind="stable")[:30]
+        self.assertTrue(selected[top].all())
+        # State (training data and weights only, hyperparameters being kept)
+        restored = surrogate.RewardSurrogate(fraction = 0.5, min_samples = 10)
+        restored.set_state(model.get_state())
+        self.assertTrue(np.array_equal(restored.predict(features), predicted))
+        self.assertEqual((restored.fraction, restored.min_samples), (0.5, 10))
+
+        # --- LEARNER ---
+        hall_of_fame_R, hall_of_fame = learn.learner(model          = cell,
+                                                     optimizer      = torch.optim.Adam(cell.parameters(), lr=1e-3),
+                                                     n_epochs       = 3,
+                                                     batch_reseter  = batch_reseter,
+                                                     risk_factor    = 0.5,
+                                                     gamma_decay    = 0.7,
+                                                     entropy_weight = 0.005,
+                                                     verbose        = False,
+                                                     surrogate      = surrogate.RewardSurrogate(min_samples = batch_size),)
+        self.assertTrue(np.isfinite(hall_of_fame_R).all())
+        return None
+
+    # Test inference-only bulk sampling
+    def test_sample(self):
+
+        # ------- TEST CASE -------
+        # --- DATA ---
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995)
+
+        # --- BATCH ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        batch = Batch.Batch(library_args     = {"args_make_tokens"  : args_make_tokens,
+                                                "superparent_units" : [1, 0, 0],
+                                                "superparent_name"  : "y",},
+                            priors_config    = [("UniformArityPrior", None),
+                                                ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                            batch_size       = 50,
+                            max_time_step    = 10,
+                            rewards_computer = reward.make_RewardsComputer (reward_function = reward.SquashedNRMSE),
+                            X        = X,
+                            y_target = y_target,)
+        def batch_reseter():
+            batch.reset()
+            return batch
+
+        torch.manual_seed(0)
+        cell = rnn.Cell(input_size = batch.obs_size, output_size = batch.n_choices, hidden_size = 16)
+        params = [p.detach().clone() for p in cell.parameters()]
+
+        # --- SAMPLING ---
+        n_samples = 130
+        micro_batches = list(learn.sample(model           = cell,
+                                          batch_reseter   = batch_reseter,
+                                          n_samples       = n_samples,
+                                          compute_rewards = True))
+        # Micro-batches (last one being truncated)
+        self.assertEqual([len(lengths) for _, lengths, _ in micro_batches], [50, 50, 30])
+        for tokens_idx, lengths, R in micro_batches:
+            self.assertEqual(tokens_idx.shape, (len(lengths), batch.max_time_step))
+            self.assertEqual(R.shape, lengths.shape)
+            self.assertTrue((lengths >= 1).all() and (lengths <= batch.max_time_step).all())
+            # Programs are made of library tokens up to their lengths, invalid tokens beyond
+            in_prog = np.arange(batch.max_time_step)[None, :] < lengths[:, None]
+            self.assertTrue((tokens_idx[in_prog] < batch.library.n_library).all())
+            self.assertTrue((tokens_idx[~in_prog] == batch.library.invalid_idx).all())
+            self.assertTrue(((R >= 0.) & (R <= 1.)).all())
+        # Micro-batches are copies (batch being re-used)
+        self.assertFalse(np.array_equal(micro_batches[0][0], micro_batches[1][0][:30]))
+        # Model is not trained and no graph is kept
+        for p, p0 in zip(cell.parameters(), params):
+            self.assertTrue(torch.equal(p, p0))
+            self.assertIsNone(p.grad)
+        # Without rewards
+        tokens_idx, lengths, R = next(learn.sample(model = cell, batch_reseter = batch_reseter, n_samples = 10))
+        self.assertEqual(len(lengths), 10)
+        self.assertIsNone(R)
+        return None
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
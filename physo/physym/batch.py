@@ -41,6 +41,9 @@ class Batch:
                 free_const_opti_args = None,
                 candidate_wrapper    = None,
                 observe_units        = True,
+                compact_dtypes       = False,
+                store_ancestors_pos  = True,
+                obs_tokens_as_idx    = False,
                 ):
         """
         Parameters
@@ -72,6 +75,17 @@ class Batch:
         observe_units : bool, optional
             Should units be included in "in situ" observation vector (True) or should this information be zeroed out
             (False).
+        compact_dtypes : bool, optional
+            If True, programs use compact dtypes (see token.VectTokens) to reduce memory usage, allowing the use of
+            larger batches (False by default).
+        store_ancestors_pos : bool, optional
+            If True (default), programs store dense ancestors records of shape (batch_size, max_time_step,
+            max_time_step). If False, ancestors are recovered from parent chains when needed (see
+            program.VectPrograms.get_ancestors), allowing long programs without a quadratic memory footprint.
+        obs_tokens_as_idx : bool, optional
+            If True, parent, sibling and previous tokens are observed as their idx in the library (n_choices where there
+            is no such token) instead of one-hots, for use with a cell embedding tokens (see learn.rnn.Cell's
+            tokens_embedding_size). The observation size then no longer grows with n_choices (False by default).
         """
 
         # Batch
@@ -84,7 +98,9 @@ class Batch:
         self.programs = program.VectPrograms(batch_size        = self.batch_size,
                                              max_time_step     = self.max_time_step,
                                              library           = self.library,
-                                             candidate_wrapper = candidate_wrapper)
+                                             candidate_wrapper = candidate_wrapper,
+                                             compact_dtypes    = compact_dtypes,
+                                             store_ancestors_pos = store_ancestors_pos)
         # Prior
         self.prior   = prior.make_PriorCollection(programs      = self.programs,
                                                   library       = self.library,
@@ -105,11 +121,64 @@ class Batch:
         self.free_const_opti_args = free_const_opti_args
 
         # Observations
-        self.observe_units = observe_units
+        self.observe_units     = observe_units
+        self.obs_tokens_as_idx = obs_tokens_as_idx
+        # Preallocated torch observation buffers (allocated on first use, see get_obs_tensor)
+        self.obs_buffers    = None
+        # Bank of pre-drawn INTERFACE_UNITS_UNAVAILABLE_FILLER noise of shape (2*batch_size, 4*UNITS_VECTOR_SIZE) from
+        # which a random window is taken at each step (see get_obs_tensor). Drawn here rather than on first use so the
+        # np.random stream is not consumed at a point depending on when observations are first computed (eg. after
+        # random states were restored when resuming a run).
+        self.obs_noise_bank = torch.from_numpy(INTERFACE_UNITS_UNAVAILABLE_FILLER(
+                            shape=(2*self.batch_size, 4*token.UNITS_VECTOR_SIZE)).astype(np.float32))
+
+    def reset (self):
+        """
+        Resets batch in place so it can be re-used for a new epoch: programs are emptied and priors depending on them
+        are reset while the library, static tables of priors and the dataset (which was already checked) are kept.
+        This avoids re-building a whole new batch at each epoch.
+        """
+        # Programs
+        self.programs.reset()
+        # Sending new free const table to same device as dataset
+        self.programs.free_consts.values = self.programs.free_consts.values.to(self.dataset.detected_device)
+        # Prior
+        self.prior.reset()
+        return None
 
     # ---------------------------- INTERFACE FOR SYMBOLIC REGRESSION ----------------------------
 
-    def get_sibling_one_hot (self, step = None):
+    def get_active_rows (self):
+        """
+        Get rows (ie. programs) of batch which are not complete yet. Per step work (observations, priors) only needs to
+        be done for these rows.
+        Returns
+        -------
+        rows : numpy.array of shape (n_active,) of int
+            Rows of incomplete programs.
+        """
+        rows = np.flatnonzero(~self.programs.is_complete)                           # (n_active,)
+        return rows
+
+    def get_rows_coords_of_step (self, step, rows = None):
+        """
+        Helper method returning coordinates of tokens at step for rows.
+        Parameters
+        ----------
+        step : int
+            Step of tokens.
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch, by default all rows.
+        Returns
+        -------
+        coords : numpy.array of shape (2, n_rows) of int
+        """
+        coords = self.programs.coords_of_step(step)                                 # (2, batch_size)
+        if rows is not None:
+            coords = coords[:, rows]                                                # (2, n_rows)
+        return coords
+
+    def get_sibling_one_hot (self, step = None, rows = None):
         """
         Get siblings one hot of tokens at step. 0 one hot vectors for dummies.
         Parameters
@@ -117,26 +186,29 @@ class Batch:
         step : int
             Step of token from which sibling one hot should be returned.
             By default, step = current step
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which one hot should be returned, by default all rows (n_rows = batch_size).
         Returns
         -------
-        one_hot : numpy.array of shape (batch_size, n_choices) of int
+        one_hot : numpy.array of shape (n_rows, n_choices) of int
             One hot.
         """
         if step is None:
             step = self.programs.curr_step
+        coords = self.get_rows_coords_of_step(step = step, rows = rows)             # (2, n_rows)
         # Idx of siblings
-        siblings_idx      = self.programs.get_sibling_idx_of_step(step = step)      # (batch_size,)
+        siblings_idx      = self.programs.get_sibling_idx(coords)                   # (n_rows,)
         # Do tokens have siblings : mask
-        has_siblings_mask = np.logical_and(                                         # (batch_size,)
-            self.programs.tokens.has_siblings_mask[:, step],
+        has_siblings_mask = np.logical_and(                                         # (n_rows,)
+            self.programs.tokens.has_siblings_mask[tuple(coords)],
             siblings_idx < self.programs.library.n_choices) # gets rid of dummies tokens which are valid siblings
         # Initialize one hot result
-        one_hot = np.zeros((self.batch_size, self.library.n_choices))               # (batch_size, n_choices)
+        one_hot = np.zeros((coords.shape[1], self.library.n_choices))               # (n_rows, n_choices)
         # Affecting only valid siblings and leaving zero vectors where no siblings
         one_hot[has_siblings_mask, :] = np.eye(self.library.n_choices)[siblings_idx[has_siblings_mask]]
         return one_hot
 
-    def get_parent_one_hot (self, step = None):
+    def get_parent_one_hot (self, step = None, rows = None):
         """
         Get parents one hot of tokens at step.
         Parameters
@@ -144,48 +216,91 @@ class Batch:
         step : int
             Step of token from which parent one hot should be returned.
             By default, step = current step
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which one hot should be returned, by default all rows (n_rows = batch_size).
         Returns
         -------
-        one_hot : numpy.array of shape (batch_size, n_choices) of int
+        one_hot : numpy.array of shape (n_rows, n_choices) of int
             One hot.
         """
         if step is None:
             step = self.programs.curr_step
+        coords = self.get_rows_coords_of_step(step = step, rows = rows)             # (2, n_rows)
         # Idx of parents
-        parents_idx      = self.programs.get_parent_idx_of_step(step = step)         # (batch_size,)
+        parents_idx      = self.programs.get_parent_idx(coords)                      # (n_rows,)
         # Do tokens have parents : mask
-        has_parents_mask = self.programs.tokens.has_parent_mask[:, step]             # (batch_size,)
+        has_parents_mask = self.programs.tokens.has_parent_mask[tuple(coords)]       # (n_rows,)
         # Initialize one hot result
-        one_hot = np.zeros((self.batch_size, self.library.n_choices))                 # (batch_size, n_choices)
+        one_hot = np.zeros((coords.shape[1], self.library.n_choices))                 # (n_rows, n_choices)
         # Affecting only valid parents and leaving zero vectors where no parents
         one_hot[has_parents_mask, :] = np.eye(self.library.n_choices)[parents_idx[has_parents_mask]]
         return one_hot
 
-    def get_previous_tokens_one_hot(self):
+    def get_previous_tokens_one_hot(self, rows = None):
         """
         Get previous step tokens as one hot.
+        Parameters
+        ----------
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which one hot should be returned, by default all rows (n_rows = batch_size).
         Returns
         -------
-        one_hot : numpy.array of shape (batch_size, n_choices) of int
+        one_hot : numpy.array of shape (n_rows, n_choices) of int
             One hot.
         """
+        n_rows = self.batch_size if rows is None else len(rows)
         # Return 0 if 0th step
         if self.programs.curr_step == 0:
-            one_hot = np.zeros((self.batch_size, self.library.n_choices))
+            one_hot = np.zeros((n_rows, self.library.n_choices))
         else:
             # Idx of tokens at previous step
             tokens_idx = self.programs.tokens.idx[:, self.programs.curr_step - 1]  # (batch_size,)
+            if rows is not None:
+                tokens_idx = tokens_idx[rows]                                      # (n_rows,)
             # Are these tokens outside of library (void tokens)
-            valid_mask = self.programs.tokens.idx[:,
-                         self.programs.curr_step - 1] < self.library.n_choices     # (batch_size,)
+            valid_mask = tokens_idx < self.library.n_choices                       # (n_rows,)
             # Initialize one hot result
-            one_hot = np.zeros((self.batch_size, self.library.n_choices))          # (batch_size, n_choices)
+            one_hot = np.zeros((n_rows, self.library.n_choices))                   # (n_rows, n_choices)
             # Affecting only valid tokens and leaving zero vectors where previous vector has no meaning
             one_hot[valid_mask, :] = np.eye(self.library.n_choices)[tokens_idx[valid_mask]]
 
         return one_hot
 
-    def get_sibling_units_obs (self, step = None):
+    def get_relatives_idx (self, rows = None):
+        """
+        Get idx of parent, sibling and previous tokens of tokens at current step. Idx is n_choices where there is no
+        such token (no parent, no sibling, dummy sibling or 0-th step) so it can be used as padding idx of embeddings.
+        Parameters
+        ----------
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which idx should be returned, by default all rows (n_rows = batch_size).
+        Returns
+        -------
+        relatives_idx : numpy.array of shape (n_rows, 3) of int
+            Idx of parent (0-th column), sibling (1-th column) and previous token (2-th column).
+        """
+        step      = self.programs.curr_step
+        n_choices = self.library.n_choices
+        coords    = self.get_rows_coords_of_step(step = step, rows = rows)          # (2, n_rows)
+        n_rows    = coords.shape[1]
+        relatives_idx = np.full((n_rows, 3), n_choices, dtype=np.int64)              # (n_rows, 3)
+        # Parent
+        has_parent  = self.programs.tokens.has_parent_mask[tuple(coords)]             # (n_rows,)
+        parents_idx = self.programs.get_parent_idx(coords)                            # (n_rows,)
+        relatives_idx[has_parent, 0] = parents_idx[has_parent]
+        # Sibling (dummies are valid siblings but are not observed)
+        siblings_idx = self.programs.get_sibling_idx(coords)                          # (n_rows,)
+        has_sibling  = np.logical_and(self.programs.tokens.has_siblings_mask[tuple(coords)],
+                                      siblings_idx < n_choices)                       # (n_rows,)
+        relatives_idx[has_sibling, 1] = siblings_idx[has_sibling]
+        # Previous token
+        if step > 0:
+            previous_idx = self.programs.tokens.idx[coords[0], step - 1]              # (n_rows,)
+            is_valid     = previous_idx < n_choices                                   # (n_rows,)
+            relatives_idx[is_valid, 2] = previous_idx[is_valid]
+        return relatives_idx
+
+    def get_sibling_units_obs (self, step = None, rows = None):
         """
         Get (required) units of sibling of tokens at step. Filling using INTERFACE_UNITS_UNAVAILABLE_FILLER where units
         are not available. Adding a vector in addition to the units indicating if units are available or not (equal to
@@ -196,46 +311,49 @@ class Batch:
         step : int
             Step of token which's sibling's (required) units be returned.
             By default, step = current step.
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which units should be returned, by default all rows (n_rows = batch_size).
         Returns
         -------
-        units_obs : numpy.array of shape (batch_size, token.UNITS_VECTOR_SIZE + 1) of float
+        units_obs : numpy.array of shape (n_rows, token.UNITS_VECTOR_SIZE + 1) of float
             Units and info availability mask.
         """
         if step is None:
             step = self.programs.curr_step
 
         # Coords
-        coords = self.programs.coords_of_step(step)                                                     # (2, batch_size)
+        coords = self.get_rows_coords_of_step(step = step, rows = rows)                                 # (2, n_rows)
+        n_rows = coords.shape[1]
 
         # Initialize result with filler (unavailable units everywhere)
-        units_obs = np.zeros((self.batch_size, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)              # (batch_size, UNITS_VECTOR_SIZE + 1)
+        units_obs = np.zeros((n_rows, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)                       # (n_rows, UNITS_VECTOR_SIZE + 1)
         # filling units
-        units_obs[:, :-1] = INTERFACE_UNITS_UNAVAILABLE_FILLER(                                         # (batch_size, UNITS_VECTOR_SIZE)
-            shape=(self.batch_size, token.UNITS_VECTOR_SIZE))
+        units_obs[:, :-1] = INTERFACE_UNITS_UNAVAILABLE_FILLER(                                         # (n_rows, UNITS_VECTOR_SIZE)
+            shape=(n_rows, token.UNITS_VECTOR_SIZE))
         # availability mask
-        units_obs[:, -1] = INTERFACE_UNITS_UNAVAILABLE                                                  # (batch_size,)
+        units_obs[:, -1] = INTERFACE_UNITS_UNAVAILABLE                                                  # (n_rows,)
 
         # Sibling
-        has_sibling    = self.programs.tokens.has_siblings_mask[tuple(coords)]                          # (batch_size,)
-        n_has_sibling = has_sibling.sum()
+        has_sibling    = self.programs.tokens.has_siblings_mask[tuple(coords)]                          # (n_rows,)
         coords_sibling = self.programs.get_siblings(coords)[:, has_sibling]                             # (2, n_has_sibling)
 
         # Units
         # mask : are units of available siblings available ?
         is_available  = self.programs.tokens.is_constraining_phy_units[tuple(coords_sibling)]           # (n_has_sibling,)
-        n_is_available = is_available.sum()
         # Coordinates of available siblings having available units
         coords_sibling_and_units_available = coords_sibling[:, is_available]                            # (2, n_is_available)
         # Units of available siblings having available units
         phy_units = self.programs.tokens.phy_units[tuple(coords_sibling_and_units_available)]           # (n_is_available, UNITS_VECTOR_SIZE)
+        # Position in result of available siblings having available units
+        res_pos = np.flatnonzero(has_sibling)[is_available]                                             # (n_is_available,)
 
         # Putting units of available siblings having available units in units_obs
-        units_obs[coords_sibling_and_units_available[0], :-1] = phy_units                               # (n_is_available, UNITS_VECTOR_SIZE)
-        units_obs[coords_sibling_and_units_available[0],  -1] = INTERFACE_UNITS_AVAILABLE               # (n_is_available,)
+        units_obs[res_pos, :-1] = phy_units                                                             # (n_is_available, UNITS_VECTOR_SIZE)
+        units_obs[res_pos,  -1] = INTERFACE_UNITS_AVAILABLE                                             # (n_is_available,)
 
         return units_obs
 
-    def get_parent_units_obs (self, step = None):
+    def get_parent_units_obs (self, step = None, rows = None):
         """
         Get (required) units of parent of tokens at step. Filling using INTERFACE_UNITS_UNAVAILABLE_FILLER where units
         are not available. Adding a vector in addition to the units indicating if units are available or not (equal to
@@ -246,52 +364,55 @@ class Batch:
         step : int
             Step of token which's parent's (required) units be returned.
             By default, step = current step.
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which units should be returned, by default all rows (n_rows = batch_size).
         Returns
         -------
-        units_obs : numpy.array of shape (batch_size, token.UNITS_VECTOR_SIZE + 1) of float
+        units_obs : numpy.array of shape (n_rows, token.UNITS_VECTOR_SIZE + 1) of float
             Units and info availability mask.
         """
         if step is None:
             step = self.programs.curr_step
 
         # Coords
-        coords = self.programs.coords_of_step(step)                                                     # (2, batch_size)
+        coords = self.get_rows_coords_of_step(step = step, rows = rows)                                 # (2, n_rows)
+        n_rows = coords.shape[1]
 
         # Initialize result with filler (unavailable units everywhere)
-        units_obs = np.zeros((self.batch_size, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)              # (batch_size, UNITS_VECTOR_SIZE + 1)
+        units_obs = np.zeros((n_rows, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)                       # (n_rows, UNITS_VECTOR_SIZE + 1)
         # filling units
-        units_obs[:, :-1] = INTERFACE_UNITS_UNAVAILABLE_FILLER(                                         # (batch_size, UNITS_VECTOR_SIZE)
-            shape=(self.batch_size, token.UNITS_VECTOR_SIZE))
+        units_obs[:, :-1] = INTERFACE_UNITS_UNAVAILABLE_FILLER(                                         # (n_rows, UNITS_VECTOR_SIZE)
+            shape=(n_rows, token.UNITS_VECTOR_SIZE))
         # availability mask
-        units_obs[:, -1] = INTERFACE_UNITS_UNAVAILABLE                                                  # (batch_size,)
+        units_obs[:, -1] = INTERFACE_UNITS_UNAVAILABLE                                                  # (n_rows,)
 
         # If 0-th step, units are those of superparent
         if step == 0:
-            units_obs[:, :-1] = self.library.superparent.phy_units                                      # (batch_size, UNITS_VECTOR_SIZE)
-            units_obs[:,  -1] = INTERFACE_UNITS_AVAILABLE                                               # (batch_size,)
+            units_obs[:, :-1] = self.library.superparent.phy_units                                      # (n_rows, UNITS_VECTOR_SIZE)
+            units_obs[:,  -1] = INTERFACE_UNITS_AVAILABLE                                               # (n_rows,)
 
         # If 0-th step, this part does nothing as n_is_available = 0 in this case
         # parent
-        has_parent    = self.programs.tokens.has_parent_mask[tuple(coords)]                             # (batch_size,)
-        n_has_parent  = has_parent.sum()
+        has_parent    = self.programs.tokens.has_parent_mask[tuple(coords)]                             # (n_rows,)
         coords_parent = self.programs.get_parent(coords)[:, has_parent]                                 # (2, n_has_parent)
 
         # Units
         # mask : are units of available parents available ?
         is_available  = self.programs.tokens.is_constraining_phy_units[tuple(coords_parent)]           # (n_has_parent,)
-        n_is_available = is_available.sum()
         # Coordinates of available parent having available units
         coords_parent_and_units_available = coords_parent[:, is_available]                             # (2, n_is_available)
         # Units of available parents having available units
         phy_units = self.programs.tokens.phy_units[tuple(coords_parent_and_units_available)]           # (n_is_available, UNITS_VECTOR_SIZE)
+        # Position in result of available parents having available units
+        res_pos = np.flatnonzero(has_parent)[is_available]                                             # (n_is_available,)
 
         # Putting units of available parents having available units in units_obs
-        units_obs[coords_parent_and_units_available[0], :-1] = phy_units                               # (n_is_available, UNITS_VECTOR_SIZE)
-        units_obs[coords_parent_and_units_available[0],  -1] = INTERFACE_UNITS_AVAILABLE               # (n_is_available,)
+        units_obs[res_pos, :-1] = phy_units                                                            # (n_is_available, UNITS_VECTOR_SIZE)
+        units_obs[res_pos,  -1] = INTERFACE_UNITS_AVAILABLE                                            # (n_is_available,)
 
         return units_obs
 
-    def get_previous_tokens_units_obs (self, step = None):
+    def get_previous_tokens_units_obs (self, step = None, rows = None):
         """
         Get (required) units of tokens before step. Filling using INTERFACE_UNITS_UNAVAILABLE_FILLER where units are not
         available. Adding a vector in addition to the units indicating if units are available or not (equal to
@@ -302,29 +423,32 @@ class Batch:
         step : int
             Step of token which's previous tokens' (required) units be returned.
             By default, step = current step.
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which units should be returned, by default all rows (n_rows = batch_size).
         Returns
         -------
-        units_obs : numpy.array of shape (batch_size, token.UNITS_VECTOR_SIZE + 1) of float
+        units_obs : numpy.array of shape (n_rows, token.UNITS_VECTOR_SIZE + 1) of float
             Units and info availability mask.
         """
         if step is None:
             step = self.programs.curr_step
+        n_rows = self.batch_size if rows is None else len(rows)
 
         # Initialize result with filler (unavailable units everywhere)
-        units_obs = np.zeros((self.batch_size, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)              # (batch_size, UNITS_VECTOR_SIZE + 1)
+        units_obs = np.zeros((n_rows, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)                       # (n_rows, UNITS_VECTOR_SIZE + 1)
         # filling units
-        units_obs[:, :-1] = INTERFACE_UNITS_UNAVAILABLE_FILLER(                                         # (batch_size, UNITS_VECTOR_SIZE)
-            shape=(self.batch_size, token.UNITS_VECTOR_SIZE))
+        units_obs[:, :-1] = INTERFACE_UNITS_UNAVAILABLE_FILLER(                                         # (n_rows, UNITS_VECTOR_SIZE)
+            shape=(n_rows, token.UNITS_VECTOR_SIZE))
         # availability mask
-        units_obs[:, -1] = INTERFACE_UNITS_UNAVAILABLE                                                  # (batch_size,)
+        units_obs[:, -1] = INTERFACE_UNITS_UNAVAILABLE                                                  # (n_rows,)
 
         # If step == 0, leave empty unavailable units filling
         if step > 0:
-            units_obs = self.get_tokens_units_obs(step = step - 1)                                      # (batch_size, UNITS_VECTOR_SIZE + 1)
+            units_obs = self.get_tokens_units_obs(step = step - 1, rows = rows)                         # (n_rows, UNITS_VECTOR_SIZE + 1)
 
         return units_obs
 
-    def get_tokens_units_obs (self, step = None):
+    def get_tokens_units_obs (self, step = None, rows = None):
         """
         Get (required) units of tokens at step. Filling using INTERFACE_UNITS_UNAVAILABLE_FILLER where units are not
         available. Adding a vector in addition to the units indicating if units are available or not (equal to
@@ -335,24 +459,27 @@ class Batch:
         step : int
             Step of token which's (required) units be returned.
             By default, step = current step.
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which units should be returned, by default all rows (n_rows = batch_size).
         Returns
         -------
-        units_obs : numpy.array of shape (batch_size, token.UNITS_VECTOR_SIZE + 1) of float
+        units_obs : numpy.array of shape (n_rows, token.UNITS_VECTOR_SIZE + 1) of float
             Units and info availability mask.
         """
         if step is None:
             step = self.programs.curr_step
 
         # Coords
-        coords = self.programs.coords_of_step(step)                                                     # (2, batch_size)
+        coords = self.get_rows_coords_of_step(step = step, rows = rows)                                 # (2, n_rows)
+        n_rows = coords.shape[1]
 
         # Initialize result
-        units_obs = np.zeros((self.batch_size, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)              # (batch_size, UNITS_VECTOR_SIZE + 1)
+        units_obs = np.zeros((n_rows, token.UNITS_VECTOR_SIZE + 1 ), dtype=float)                       # (n_rows, UNITS_VECTOR_SIZE + 1)
 
         # mask : is units information available
-        is_available  = self.programs.tokens.is_constraining_phy_units[tuple(coords)]                   # (batch_size,)
+        is_available  = self.programs.tokens.is_constraining_phy_units[tuple(coords)]                   # (n_rows,)
         n_available   = is_available.sum()
-        n_unavailable = self.batch_size - n_available
+        n_unavailable = n_rows - n_available
         # Coords of tokens which's units are available
         coords_available = coords[:, is_available]                                                      # (2, n_available)
 
@@ -362,36 +489,46 @@ class Batch:
         units_obs[~is_available, :-1] = INTERFACE_UNITS_UNAVAILABLE_FILLER(                             # (n_unavailable, UNITS_VECTOR_SIZE)
             shape=(n_unavailable, token.UNITS_VECTOR_SIZE))
         # Result : availability mask
-        units_obs[is_available , -1] = INTERFACE_UNITS_AVAILABLE                                        # (batch_size,)
-        units_obs[~is_available, -1] = INTERFACE_UNITS_UNAVAILABLE                                      # (batch_size,)
+        units_obs[is_available , -1] = INTERFACE_UNITS_AVAILABLE                                        # (n_rows,)
+        units_obs[~is_available, -1] = INTERFACE_UNITS_UNAVAILABLE                                      # (n_rows,)
 
         return units_obs
 
-    def get_obs(self):
+    def get_obs(self, rows = None):
         """
         Computes observation of current step for symbolic regression task.
+        Parameters
+        ----------
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which observations should be computed (eg. rows of incomplete programs given by
+            get_active_rows), observations of other rows are zeros. By default, all rows.
         Returns
         -------
-        obs : numpy.array of shape (batch_size, 3*n_choices+1,) of float
+        obs : numpy.array of shape (batch_size, obs_size,) of float
         """
-        # Relatives one-hots
-        parent_one_hot   = self.get_parent_one_hot()                         # (batch_size, n_choices,)
-        sibling_one_hot  = self.get_sibling_one_hot()                        # (batch_size, n_choices,)
-        previous_one_hot = self.get_previous_tokens_one_hot()                # (batch_size, n_choices,)
+        # Relatives one-hots (or idx)
+        if self.obs_tokens_as_idx:
+            relatives_obs = self.get_relatives_idx(rows = rows)              # (n_rows, 3,)
+        else:
+            relatives_obs = np.concatenate((                                 # (n_rows, 3*n_choices,)
+                self.get_parent_one_hot          (rows = rows),              # (n_rows, n_choices,)
+                self.get_sibling_one_hot         (rows = rows),              # (n_rows, n_choices,)
+                self.get_previous_tokens_one_hot (rows = rows),              # (n_rows, n_choices,)
+                ), axis = 1)
         # Number of dangling dummies
         n_dangling       = self.programs.n_dangling                          # (batch_size,)
+        if rows is not None:
+            n_dangling = n_dangling[rows]                                    # (n_rows,)
         # Units obs
         do_obs = int(self.observe_units)
-        units_obs_current  = do_obs * self.get_tokens_units_obs()            # (batch_size, UNITS_VECTOR_SIZE + 1)
-        units_obs_sibling  = do_obs * self.get_sibling_units_obs()           # (batch_size, UNITS_VECTOR_SIZE + 1)
-        units_obs_parent   = do_obs * self.get_parent_units_obs()            # (batch_size, UNITS_VECTOR_SIZE + 1)
-        units_obs_previous = do_obs * self.get_previous_tokens_units_obs()   # (batch_size, UNITS_VECTOR_SIZE + 1)
-
-        obs = np.concatenate((                                               # (batch_size, obs_size,)
-            # Relatives one-hots
-            parent_one_hot,
-            sibling_one_hot,
-            previous_one_hot,
+        units_obs_current  = do_obs * self.get_tokens_units_obs         (rows = rows)   # (n_rows, UNITS_VECTOR_SIZE + 1)
+        units_obs_sibling  = do_obs * self.get_sibling_units_obs        (rows = rows)   # (n_rows, UNITS_VECTOR_SIZE + 1)
+        units_obs_parent   = do_obs * self.get_parent_units_obs         (rows = rows)   # (n_rows, UNITS_VECTOR_SIZE + 1)
+        units_obs_previous = do_obs * self.get_previous_tokens_units_obs(rows = rows)   # (n_rows, UNITS_VECTOR_SIZE + 1)
+
+        obs = np.concatenate((                                               # (n_rows, obs_size,)
+            # Relatives one-hots (or idx)
+            relatives_obs,
             # Dangling
             n_dangling[:, np.newaxis],
             # Units obs
@@ -401,6 +538,125 @@ class Batch:
             units_obs_previous,
             ), axis = 1).astype(np.float32)
 
+        # Scattering observations of rows in batch
+        if rows is not None:
+            obs_rows = obs
+            obs = np.zeros((self.batch_size, obs_rows.shape[1]), dtype=np.float32)   # (batch_size, obs_size,)
+            obs[rows] = obs_rows
+
+        return obs
+
+    def allocate_obs_buffers (self):
+        """
+        Allocates torch buffers used by get_obs_tensor: one (batch_size, obs_size) buffer per step (observations of a
+        step are saved by autograd as input of the RNN until backpropagation so buffers of different steps can not be
+        shared).
+        """
+        self.obs_buffers = [torch.zeros((self.batch_size, self.obs_size), dtype=torch.float32)
+                            for _ in range(self.max_time_step)]
+        return None
+
+    def _scatter_units_obs (self, units_obs, rows, block, pos, coords_src):
+        """
+        Helper method writing units of tokens at coords_src as available units in block of units_obs at rows[pos].
+        Parameters
+        ----------
+        units_obs : torch.tensor of shape (batch_size, 4, UNITS_VECTOR_SIZE + 1) of float32
+            Units part of observation buffer.
+        rows : numpy.array of shape (n_rows,) of int
+            Rows of batch being observed.
+        block : int
+            Units block (0 : current, 1 : sibling, 2 : parent, 3 : previous).
+        pos : numpy.array of shape (n_available,) of int
+            Position in rows of tokens having available units.
+        coords_src : numpy.array of shape (2, n_available) of int
+            Coords of tokens which's units should be used.
+        """
+        res_rows  = torch.from_numpy(rows[pos])                                                         # (n_available,)
+        phy_units = self.programs.tokens.phy_units[tuple(coords_src)].astype(np.float32)                # (n_available, UNITS_VECTOR_SIZE)
+        units_obs[res_rows, block, :-1] = torch.from_numpy(phy_units)                                   # (n_available, UNITS_VECTOR_SIZE)
+        units_obs[res_rows, block,  -1] = INTERFACE_UNITS_AVAILABLE                                     # (n_available,)
+        return None
+
+    def get_obs_tensor (self, rows = None):
+        """
+        Computes observation of current step for symbolic regression task directly in a preallocated torch buffer.
+        Same content as get_obs (up to units filler noise which is taken from a pre-drawn noise bank) but one-hots are
+        written by index scatter and no intermediate numpy arrays are concatenated.
+        Parameters
+        ----------
+        rows : numpy.array of shape (n_rows,) of int or None
+            Rows of batch for which observations should be computed (eg. rows of incomplete programs given by
+            get_active_rows), observations of other rows are zeros. By default, all rows.
+        Returns
+        -------
+        obs : torch.tensor of shape (batch_size, obs_size,) of float32
+            Buffer of current step (overwritten when observations of the same step are computed again, eg. after a
+            reset of the batch).
+        """
+        if self.obs_buffers is None:
+            self.allocate_obs_buffers()
+        step      = self.programs.curr_step
+        n_choices = self.n_choices
+        tokens    = self.programs.tokens
+        if rows is None:
+            rows = np.arange(self.batch_size)
+        rows   = rows.astype(np.int64)
+        n_rows = len(rows)
+        rows_t = torch.from_numpy(rows)                                                                  # (n_rows,)
+
+        obs = self.obs_buffers[step]                                                                     # (batch_size, obs_size,)
+        obs.zero_()
+        n_relatives = self.obs_size - 1 - 4*(token.UNITS_VECTOR_SIZE + 1)
+
+        # Coords
+        coords = self.get_rows_coords_of_step(step = step, rows = rows)                                  # (2, n_rows)
+
+        # ------------ Relatives one-hots (or idx) ------------
+        relatives_idx = self.get_relatives_idx(rows = rows)                                              # (n_rows, 3)
+        if self.obs_tokens_as_idx:
+            obs[rows_t, :3] = torch.from_numpy(relatives_idx.astype(np.float32))
+        else:
+            for i in range(3):
+                is_valid = relatives_idx[:, i] < n_choices                                               # (n_rows,)
+                obs[torch.from_numpy(rows[is_valid]),
+                    torch.from_numpy(relatives_idx[is_valid, i] + i*n_choices)] = 1.
+
+        # ------------ Dangling ------------
+        obs[rows_t, n_relatives] = torch.from_numpy(self.programs.n_dangling[rows].astype(np.float32))
+
+        # ------------ Units obs ------------
+        # Zeroed out if units are not observed
+        if self.observe_units:
+            units_obs = obs[:, n_relatives+1:].view(self.batch_size, 4, token.UNITS_VECTOR_SIZE + 1)     # (batch_size, 4, UNITS_VECTOR_SIZE + 1)
+            # Filler (unavailable units everywhere) from a random window of the noise bank
+            start = np.random.randint(0, self.obs_noise_bank.shape[0] - n_rows + 1)
+            noise = self.obs_noise_bank[start:start+n_rows].view(n_rows, 4, token.UNITS_VECTOR_SIZE)     # (n_rows, 4, UNITS_VECTOR_SIZE)
+            units_obs[rows_t, :, :-1] = noise
+            units_obs[rows_t, :,  -1] = INTERFACE_UNITS_UNAVAILABLE
+            # Current tokens
+            is_available = tokens.is_constraining_phy_units[tuple(coords)]                               # (n_rows,)
+            self._scatter_units_obs(units_obs, rows, 0, np.flatnonzero(is_available), coords[:, is_available])
+            # Sibling
+            coords_sibling = self.programs.get_siblings(coords)[:, tokens.has_siblings_mask[tuple(coords)]]  # (2, n_has_sibling)
+            is_available   = tokens.is_constraining_phy_units[tuple(coords_sibling)]                     # (n_has_sibling,)
+            pos            = np.flatnonzero(tokens.has_siblings_mask[tuple(coords)])[is_available]       # (n_is_available,)
+            self._scatter_units_obs(units_obs, rows, 1, pos, coords_sibling[:, is_available])
+            # Parent (units of superparent at 0-th step)
+            if step == 0:
+                units_obs[rows_t, 2, :-1] = torch.from_numpy(self.library.superparent.phy_units.astype(np.float32))
+                units_obs[rows_t, 2,  -1] = INTERFACE_UNITS_AVAILABLE
+            has_parent    = tokens.has_parent_mask[tuple(coords)]                                        # (n_rows,)
+            coords_parent = self.programs.get_parent(coords)[:, has_parent]                              # (2, n_has_parent)
+            is_available  = tokens.is_constraining_phy_units[tuple(coords_parent)]                       # (n_has_parent,)
+            pos           = np.flatnonzero(has_parent)[is_available]                                     # (n_is_available,)
+            self._scatter_units_obs(units_obs, rows, 2, pos, coords_parent[:, is_available])
+            # Previous token
+            if step > 0:
+                coords_previous = self.get_rows_coords_of_step(step = step - 1, rows = rows)             # (2, n_rows)
+                is_available    = tokens.is_constraining_phy_units[tuple(coords_previous)]               # (n_rows,)
+                self._scatter_units_obs(units_obs, rows, 3, np.flatnonzero(is_available), coords_previous[:, is_available])
+
         return obs
 
     @property
@@ -411,28 +667,62 @@ class Batch:
         -------
         obs_size : int
         """
-        return (3*self.n_choices) + 1 + 4*(token.UNITS_VECTOR_SIZE+1)
+        n_relatives = 3 if self.obs_tokens_as_idx else 3*self.n_choices
+        return n_relatives + 1 + 4*(token.UNITS_VECTOR_SIZE+1)
 
     @property
     def n_choices (self):
         return self.library.n_choices
 
-    def get_rewards (self):
+    def get_rewards (self, mask = None):
         """
         Computes rewards of programs contained in batch.
+        Parameters
+        ----------
+        mask : numpy.array of shape (batch_size,) of bool or None, optional
+            Programs to evaluate, other programs are given a zero reward without being evaluated (rewards_computer must
+            then accept a mask argument, see reward.make_RewardsComputer). By default, None, all programs are evaluated.
         Returns
         -------
         rewards : numpy.array of shape (batch_size,) of float
             Rewards of programs.
         """
+        # (Only passing mask if needed so custom rewards computers not supporting it can still be used)
+        kwargs = {} if mask is None else {"mask" : mask}
         rewards = self.rewards_computer(programs             = self.programs,
                                         X                    = self.dataset.X,
                                         y_target             = self.dataset.y_target,
                                         free_const_opti_args = self.free_const_opti_args,
+                                        **kwargs
                                         )
         return rewards
 
 
+    def get_memory_usage (self):
+        """
+        Computes memory used by the batch's programs.
+        Returns
+        -------
+        memory_usage : dict of {str : int}
+            Number of bytes used by each array of programs (see program.VectPrograms.get_memory_usage).
+        """
+        return self.programs.get_memory_usage()
+
+    def memory_report (self):
+        """
+        Human-readable report of memory used by the batch's programs.
+        Returns
+        -------
+        report : str
+        """
+        memory_usage = self.get_memory_usage()
+        total = sum(memory_usage.values())
+        s = "Batch memory usage (batch_size = %i, max_time_step = %i, compact_dtypes = %s): %.3f MB\n"\
+            % (self.batch_size, self.max_time_step, self.programs.compact_dtypes, total/1e6)
+        for attr, nbytes in sorted(memory_usage.items(), key = lambda item: item[1], reverse = True):
+            s += "- %-20s : %10.3f MB (%5.1f %%)\n" % (attr, nbytes/1e6, 100*nbytes/max(total, 1))
+        return s
+
     def __repr__(self):
         s = ""
         s += "-------------------------- Library -------------------------\n%s\n"%(self.library )
@@ -14,6 +14,155 @@ UNITS_ANALYSIS_NOT_PERFORMED_CASE_CODE = 0
 class PhyUnitsError(Exception):
     pass
 
+# ----------------------------------------------------------------------------------------------------------------------
+# -------------------------------------------- INTEGER LATTICE UNITS KEYS ----------------------------------------------
+# ----------------------------------------------------------------------------------------------------------------------
+# Units exponents are rationals (fractional powers such as sqrt make them non-integers), they can be represented
+# exactly as integer numerators over a fixed denominator. Each numerator is stored on UNITS_LATTICE_N_BITS bits and
+# a whole units vector is packed into a single int64 key so units checks can be done via integer equality / hashing.
+
+# Common denominator of units exponents (handles halves, thirds, quarters and sixths)
+UNITS_LATTICE_DENOMINATOR = 12
+# Number of bits used to store each numerator in a key
+UNITS_LATTICE_N_BITS = 9
+# Max absolute value of numerators that can be stored in a key
+UNITS_LATTICE_MAX_NUMERATOR = 2**(UNITS_LATTICE_N_BITS - 1) - 1
+# Tolerance used to decide if a float exponent lies on the lattice (eg. 0.333333334 -> 4/12)
+UNITS_LATTICE_TOL = 1e2*np.finfo(np.float32).eps
+# Key of tokens that are not constraining units-wise (NaN units)
+UNITS_KEY_NON_CONSTRAINING = -1
+# Key of units that can not be represented on the lattice (float comparison must be used for those)
+UNITS_KEY_UNREPRESENTABLE  = -2
+
+assert Tok.UNITS_VECTOR_SIZE * UNITS_LATTICE_N_BITS < 64, "Units vectors of size %i can not be packed in int64 keys " \
+    "using %i bits per exponent." % (Tok.UNITS_VECTOR_SIZE, UNITS_LATTICE_N_BITS)
+
+
+def units_to_lattice (phy_units):
+    """
+    Converts float units vectors into integer numerators on the units lattice (exponent = numerator /
+    UNITS_LATTICE_DENOMINATOR).
+    Parameters
+    ----------
+    phy_units : numpy.array of shape (..., UNITS_VECTOR_SIZE) of float
+        Units vectors.
+    Returns
+    -------
+    numerators, is_representable : numpy.array of shape (..., UNITS_VECTOR_SIZE) of int, numpy.array of shape (...,)
+    of bool
+        Numerators of exponents (0 where units are not representable) and mask telling if units vectors can be
+        represented exactly on the lattice (False for NaN units).
+    """
+    scaled     = np.asarray(phy_units, dtype=float) * UNITS_LATTICE_DENOMINATOR                # (..., UNITS_VECTOR_SIZE)
+    rounded    = np.rint(scaled)                                                                # (..., UNITS_VECTOR_SIZE)
+    with np.errstate(invalid="ignore"):
+        is_representable = np.logical_and(                                                      # (...,)
+            np.abs(scaled - rounded) < UNITS_LATTICE_TOL * UNITS_LATTICE_DENOMINATOR,
+            np.abs(rounded) <= UNITS_LATTICE_MAX_NUMERATOR).all(axis=-1)
+    numerators = np.where(is_representable[..., np.newaxis], rounded, 0).astype(np.int64)       # (..., UNITS_VECTOR_SIZE)
+    return numerators, is_representable
+
+
+def lattice_to_units (numerators):
+    """
+    Converts integer numerators on the units lattice back into float units vectors.
+    Parameters
+    ----------
+    numerators : numpy.array of shape (..., UNITS_VECTOR_SIZE) of int
+    Returns
+    -------
+    phy_units : numpy.array of shape (..., UNITS_VECTOR_SIZE) of float
+    """
+    return np.asarray(numerators, dtype=float) / UNITS_LATTICE_DENOMINATOR
+
+
+def snap_units_to_lattice (phy_units):
+    """
+    Replaces units vectors that lie on the lattice (within tolerance) by their exact lattice value, this removes float
+    drift accumulated through successive operations (eg. (x**(1/3))**3). Other units vectors are left unchanged.
+    Parameters
+    ----------
+    phy_units : numpy.array of shape (..., UNITS_VECTOR_SIZE) of float
+    Returns
+    -------
+    phy_units : numpy.array of shape (..., UNITS_VECTOR_SIZE) of float
+    """
+    numerators, is_representable = units_to_lattice(phy_units)
+    return np.where(is_representable[..., np.newaxis], lattice_to_units(numerators), phy_units)
+
+
+def units_to_key (phy_units, is_constraining = None):
+    """
+    Packs units vectors into int64 keys (one per units vector) on the integer lattice. Two units vectors represented
+    on the lattice are equal if and only if their keys are equal.
+    Parameters
+    ----------
+    phy_units : numpy.array of shape (..., UNITS_VECTOR_SIZE) of float
+        Units vectors.
+    is_constraining : numpy.array of shape (...,) of bool or None (optional)
+        Are units constraining, if None, units containing NaNs are considered non-constraining.
+    Returns
+    -------
+    keys : numpy.array of shape (...,) of int64
+        Keys, UNITS_KEY_NON_CONSTRAINING for non-constraining units and UNITS_KEY_UNREPRESENTABLE for units that can
+        not be represented on the lattice (other keys are >= 0).
+    """
+    phy_units = np.asarray(phy_units)
+    numerators, is_representable = units_to_lattice(phy_units)                                  # (..., UNITS_VECTOR_SIZE)
+    if is_constraining is None:
+        is_constraining = ~np.isnan(phy_units).any(axis=-1)                                     # (...,)
+    # Shifting numerators so they are positive and packing them
+    offset = UNITS_LATTICE_MAX_NUMERATOR + 1
+    shifts = (UNITS_LATTICE_N_BITS * np.arange(Tok.UNITS_VECTOR_SIZE)).astype(np.int64)        # (UNITS_VECTOR_SIZE,)
+    keys = ((numerators + offset) << shifts).sum(axis=-1)                                       # (...,)
+    keys = np.where(is_representable, keys, UNITS_KEY_UNREPRESENTABLE)                          # (...,)
+    keys = np.where(is_constraining,  keys, UNITS_KEY_NON_CONSTRAINING)                         # (...,)
+    return keys.astype(np.int64)
+
+
+def key_to_units (keys):
+    """
+    Unpacks int64 keys into units vectors (NaN units for non-constraining or unrepresentable keys).
+    Parameters
+    ----------
+    keys : numpy.array of shape (...,) of int64
+    Returns
+    -------
+    phy_units : numpy.array of shape (..., UNITS_VECTOR_SIZE) of float
+    """
+    keys   = np.asarray(keys, dtype=np.int64)
+    offset = UNITS_LATTICE_MAX_NUMERATOR + 1
+    mask   = (1 << UNITS_LATTICE_N_BITS) - 1
+    shifts = (UNITS_LATTICE_N_BITS * np.arange(Tok.UNITS_VECTOR_SIZE)).astype(np.int64)        # (UNITS_VECTOR_SIZE,)
+    numerators = ((keys[..., np.newaxis] >> shifts) & mask) - offset                            # (..., UNITS_VECTOR_SIZE)
+    phy_units  = lattice_to_units(numerators)                                                   # (..., UNITS_VECTOR_SIZE)
+    phy_units[keys < 0] = np.nan
+    return phy_units
+
+
+def units_keys_equal (keys_a, keys_b, phy_units_a, phy_units_b, tol = 0.):
+    """
+    Compares units via their lattice keys, falling back to a float comparison for units that are not representable on
+    the lattice. Non-constraining units are not handled here and must be masked by the caller.
+    Parameters
+    ----------
+    keys_a, keys_b : numpy.array of shape (...,) of int64
+        Keys of units to compare (broadcastable).
+    phy_units_a, phy_units_b : numpy.array of shape (..., UNITS_VECTOR_SIZE) of float
+        Units to compare (broadcastable, only used for unrepresentable units).
+    tol : float (optional)
+        Tolerance for the float fallback comparison.
+    Returns
+    -------
+    is_equal : numpy.array of shape (...,) of bool
+    """
+    is_equal = (keys_a == keys_b)
+    is_unrepresentable = (keys_a == UNITS_KEY_UNREPRESENTABLE) | (keys_b == UNITS_KEY_UNREPRESENTABLE)
+    if is_unrepresentable.any():
+        is_equal_float = (np.abs(phy_units_a - phy_units_b) <= tol).all(axis=-1)
+        is_equal = np.where(is_unrepresentable, is_equal_float, is_equal)
+    return is_equal
+
 
 def assign_required_units_at_step (programs, step = None, from_scratch = False):
     """
@@ -547,6 +696,8 @@ def assign_units_bottom_up (programs, coords_start, coords_end):
     """
     Performs a bottom up (in the tree representation of programs) dimensional analysis and assigns units along the way
     for multiple subtrees.
+    All subtrees are processed together (vectorized over subtrees), tokens being parsed in reverse polish notation
+    order (ie. from the end of subtrees to their start) so children are always handled before their parents.
     Parameters
     ----------
     programs : program.VectPrograms
@@ -569,105 +720,118 @@ def assign_units_bottom_up (programs, coords_start, coords_end):
     start_pos = coords_start[1]
     end_pos   = coords_end  [1]
 
-    # Iterating through subtrees
-    # todo: vectorize bottom-up units assignment process
-    #t0 = time.perf_counter()
-    for k in range (n_subtrees):
-        # Starting at the end of subtree and parsing in reverse polish notation
-        start  = end_pos   [k]
-        # End of parsing is start of subtree
-        end    = start_pos [k]
-        prog_i = batch_pos [k]
-        # Error messages
-        error_msg_unknown_dim          = "Unknown physical units token encountered in bottom up units assignment " \
-                                         "process."
-        error_msg_dimensionless_child  = "Non-dimensionless token encountered as child of dimensionless op (eg cos, " \
-                                         "exp, log etc) in bottom up units assignment process."
-        error_msg_dimensionless_token  = "Dimensionless token having non-zero physical units encountered in bottom " \
-                                         "up units assignment process."
-        error_msg_additive_discrepancy = "Two children of binary_additive_op (eg: addition, subtraction) having " \
-                                         "different physical units encountered in bottom up units assignment process."
-        error_msg_incomplete_tree      = "Regular bottom up dimensional analysis can not be performed on incomplete " \
-                                         "tree (containing terminal tokens with unknown physical units: eg. dummies)"
-
-        # Utils function to assign units
-        def assign_units(pos, phy_units, is_constraining):
-            programs.tokens.phy_units                 [prog_i, pos] = phy_units
-            programs.tokens.is_constraining_phy_units [prog_i, pos] = is_constraining
-            return None
-
-        # Parser
-        def parser(i):
-            # Stop condition (getting outside of subtree)
-            if i == end-1:
-                return True
-            # Current parsing
-            idx             = programs.tokens.idx                       [prog_i, i]
-            arity           = programs.tokens.arity                     [prog_i, i]
-            behavior_id     = programs.tokens.behavior_id               [prog_i, i]
-            phy_units       = programs.tokens.phy_units                 [prog_i, i]
-            is_constraining = programs.tokens.is_constraining_phy_units [prog_i, i]
-            # Check that subtree is complete (no dummies should be encountered during parsing)
-            assert idx != programs.dummy_idx, error_msg_incomplete_tree
-            # Arity = 0 ---
-            if arity == 0:
-                pass
-            # Arity = 1 ---
-            elif arity == 1:
-                # Position of the lonely child of the token (arity = 1)
-                child_pos             = programs.tokens.children_pos              [prog_i, i][0]
-                child_phy_units       = programs.tokens.phy_units                 [prog_i, child_pos]
-                child_is_constraining = programs.tokens.is_constraining_phy_units [prog_i, child_pos]
-                # Making sure that the child of unary tokens are not free
-                assert child_is_constraining == True, error_msg_unknown_dim
-                # If token is an unary power op -> apply power to units
-                if  Func.UNIT_BEHAVIORS_DICT["UNARY_POWER_OP"].is_id(behavior_id):
-                    n_power = programs.tokens.power    [prog_i, i]
-                    assign_units (pos = i, phy_units = n_power * child_phy_units, is_constraining = True)
-                # Elif token is an unary additive op -> copy-paste units from child
-                elif Func.UNIT_BEHAVIORS_DICT["UNARY_ADDITIVE_OP"].is_id(behavior_id):
-                    assign_units (pos = i, phy_units = child_phy_units, is_constraining = True)
-                # Elif token is an unary dimensionless op -> nothing to do but making sure that child token is
-                # dimensionless (as it should be) just in case and that current token is dimensionless
-                elif Func.UNIT_BEHAVIORS_DICT["UNARY_DIMENSIONLESS_OP"].is_id(behavior_id):
-                    assert np.array_equal(child_phy_units, np.zeros(Tok.UNITS_VECTOR_SIZE)) and \
-                           child_is_constraining == True, error_msg_dimensionless_child
-                    assert np.array_equal(phy_units, np.zeros(Tok.UNITS_VECTOR_SIZE)) and \
-                           is_constraining == True, error_msg_dimensionless_token
-            # Arity = 2 ---
-            elif arity == 2:
-                # Children positions
-                child0_pos             = programs.tokens.children_pos              [prog_i, i][0]
-                child1_pos             = programs.tokens.children_pos              [prog_i, i][1]
-                # Child 0 units
-                child0_phy_units       = programs.tokens.phy_units                 [prog_i, child0_pos]
-                child0_is_constraining = programs.tokens.is_constraining_phy_units [prog_i, child0_pos]
-                # Child 1 units
-                child1_phy_units       = programs.tokens.phy_units                 [prog_i, child1_pos]
-                child1_is_constraining = programs.tokens.is_constraining_phy_units [prog_i, child1_pos]
-                # Assertion: making sure that children of binary tokens are not free
-                assert (child0_is_constraining == True) and (child1_is_constraining == True), error_msg_unknown_dim
-                # If token is an additive token -> units are those of any children (as they should be the same
-                # among them) but making sure that children of additive binary tokens have the same units for safety.
-                if Func.UNIT_BEHAVIORS_DICT["BINARY_ADDITIVE_OP"].is_id(behavior_id):
-                    assert np.array_equal(child1_phy_units, child0_phy_units), error_msg_additive_discrepancy
-                    assign_units (pos = i, phy_units = child0_phy_units, is_constraining = True)
-                # Elif token is a multiplicative token
-                elif Func.UNIT_BEHAVIORS_DICT["BINARY_MULTIPLICATIVE_OP"].is_id(behavior_id):
-                    # token = child0 * child1 => units(token) = child0_phy_units + child1_phy_units
-                    if Func.UNIT_BEHAVIORS_DICT["MULTIPLICATION_OP"].is_id(behavior_id):
-                        assign_units (pos = i, phy_units = child0_phy_units + child1_phy_units, is_constraining = True)
-                    # token = child0 / child1 => units(token) = child0_phy_units - child1_phy_units
-                    elif Func.UNIT_BEHAVIORS_DICT["DIVISION_OP"].is_id(behavior_id):
-                        assign_units (pos = i, phy_units = child0_phy_units - child1_phy_units, is_constraining = True)
-            # print("------")
-            # print("Parsing i = ",i)
-            # print("name      = ", programs.lib_names[programs.tokens.idx[prog_i, i]])
-            # print("units     = ", programs.tokens.phy_units[prog_i, i])
-            # Parsing previous token afterwards
-            parser(i - 1)
-        parser(start)
-    #t1 = time.perf_counter()
-    #print("assign_units_bottom_up %f ms"%((t1-t0)*1e3))
+    # Error messages
+    error_msg_unknown_dim          = "Unknown physical units token encountered in bottom up units assignment " \
+                                     "process."
+    error_msg_dimensionless_child  = "Non-dimensionless token encountered as child of dimensionless op (eg cos, " \
+                                     "exp, log etc) in bottom up units assignment process."
+    error_msg_dimensionless_token  = "Dimensionless token having non-zero physical units encountered in bottom " \
+                                     "up units assignment process."
+    error_msg_additive_discrepancy = "Two children of binary_additive_op (eg: addition, subtraction) having " \
+                                     "different physical units encountered in bottom up units assignment process."
+    error_msg_incomplete_tree      = "Regular bottom up dimensional analysis can not be performed on incomplete " \
+                                     "tree (containing terminal tokens with unknown physical units: eg. dummies)"
+
+    # Behaviors
+    bh_unary_power          = Func.UNIT_BEHAVIORS_DICT["UNARY_POWER_OP"]
+    bh_unary_additive       = Func.UNIT_BEHAVIORS_DICT["UNARY_ADDITIVE_OP"]
+    bh_unary_dimensionless  = Func.UNIT_BEHAVIORS_DICT["UNARY_DIMENSIONLESS_OP"]
+    bh_binary_additive      = Func.UNIT_BEHAVIORS_DICT["BINARY_ADDITIVE_OP"]
+    bh_binary_mul           = Func.UNIT_BEHAVIORS_DICT["MULTIPLICATION_OP"]
+    bh_binary_div           = Func.UNIT_BEHAVIORS_DICT["DIVISION_OP"]
+
+    # Utils function to assign units
+    # (units are snapped to the integer lattice so float drift does not accumulate along subtrees)
+    def assign_units(prog_i, pos, phy_units):
+        programs.tokens.phy_units                 [prog_i, pos] = snap_units_to_lattice(phy_units)
+        programs.tokens.is_constraining_phy_units [prog_i, pos] = True
+        return None
+
+    # Parsing all subtrees at once in reverse polish notation ie. starting at the end of each subtree and going
+    # backward (children are always located after their parents so they are processed first) until the start of each
+    # subtree is reached. At offset j, tokens at pos = end_pos - j of subtrees which are still being parsed are
+    # processed together.
+    n_offsets = (end_pos - start_pos + 1).max() if n_subtrees > 0 else 0
+    for j in range (n_offsets):
+        # Subtrees that are still being parsed
+        is_parsing = (end_pos - j) >= start_pos                                                            # (n_subtrees,)
+        prog_i     = batch_pos [is_parsing]                                                                # (n_parsing,)
+        i          = end_pos   [is_parsing] - j                                                            # (n_parsing,)
+
+        # Current parsing
+        idx             = programs.tokens.idx                       [prog_i, i]                            # (n_parsing,)
+        arity           = programs.tokens.arity                     [prog_i, i]                            # (n_parsing,)
+        behavior_id     = programs.tokens.behavior_id               [prog_i, i]                            # (n_parsing,)
+        phy_units       = programs.tokens.phy_units                 [prog_i, i]                            # (n_parsing, UNITS_VECTOR_SIZE)
+        is_constraining = programs.tokens.is_constraining_phy_units [prog_i, i]                            # (n_parsing,)
+        children_pos    = programs.tokens.children_pos              [prog_i, i]                            # (n_parsing, MAX_NB_CHILDREN)
+        # Check that subtree is complete (no dummies should be encountered during parsing)
+        assert (idx != programs.dummy_idx).all(), error_msg_incomplete_tree
+
+        # Arity = 0 ---
+        # Nothing to do
+
+        # Arity = 1 ---
+        is_unary = (arity == 1)                                                                            # (n_parsing,)
+        if is_unary.any():
+            # Position of the lonely child of the token (arity = 1)
+            u_prog_i              = prog_i[is_unary]                                                       # (n_unary,)
+            u_pos                 = i     [is_unary]                                                       # (n_unary,)
+            u_behavior_id         = behavior_id[is_unary]                                                  # (n_unary,)
+            child_pos             = children_pos[is_unary, 0]                                              # (n_unary,)
+            child_phy_units       = programs.tokens.phy_units                 [u_prog_i, child_pos]        # (n_unary, UNITS_VECTOR_SIZE)
+            child_is_constraining = programs.tokens.is_constraining_phy_units [u_prog_i, child_pos]        # (n_unary,)
+            # Making sure that the child of unary tokens are not free
+            assert child_is_constraining.all(), error_msg_unknown_dim
+            # If token is an unary power op -> apply power to units
+            mask = bh_unary_power.is_id(u_behavior_id)                                                     # (n_unary,)
+            n_power = programs.tokens.power[u_prog_i[mask], u_pos[mask]]                                   # (n_power,)
+            assign_units (prog_i = u_prog_i[mask], pos = u_pos[mask],
+                          phy_units = n_power[:, np.newaxis] * child_phy_units[mask])
+            # Elif token is an unary additive op -> copy-paste units from child
+            mask = bh_unary_additive.is_id(u_behavior_id)                                                  # (n_unary,)
+            assign_units (prog_i = u_prog_i[mask], pos = u_pos[mask], phy_units = child_phy_units[mask])
+            # Elif token is an unary dimensionless op -> nothing to do but making sure that child token is
+            # dimensionless (as it should be) just in case and that current token is dimensionless
+            mask = bh_unary_dimensionless.is_id(u_behavior_id)                                             # (n_unary,)
+            assert (child_phy_units[mask] == 0).all() and child_is_constraining[mask].all(), \
+                error_msg_dimensionless_child
+            assert (phy_units[is_unary][mask] == 0).all() and is_constraining[is_unary][mask].all(), \
+                error_msg_dimensionless_token
+
+        # Arity = 2 ---
+        is_binary = (arity == 2)                                                                           # (n_parsing,)
+        if is_binary.any():
+            b_prog_i               = prog_i[is_binary]                                                     # (n_binary,)
+            b_pos                  = i     [is_binary]                                                     # (n_binary,)
+            b_behavior_id          = behavior_id[is_binary]                                                # (n_binary,)
+            # Children positions
+            child0_pos             = children_pos[is_binary, 0]                                            # (n_binary,)
+            child1_pos             = children_pos[is_binary, 1]                                            # (n_binary,)
+            # Child 0 units
+            child0_phy_units       = programs.tokens.phy_units                 [b_prog_i, child0_pos]      # (n_binary, UNITS_VECTOR_SIZE)
+            child0_is_constraining = programs.tokens.is_constraining_phy_units [b_prog_i, child0_pos]      # (n_binary,)
+            # Child 1 units
+            child1_phy_units       = programs.tokens.phy_units                 [b_prog_i, child1_pos]      # (n_binary, UNITS_VECTOR_SIZE)
+            child1_is_constraining = programs.tokens.is_constraining_phy_units [b_prog_i, child1_pos]      # (n_binary,)
+            # Assertion: making sure that children of binary tokens are not free
+            assert child0_is_constraining.all() and child1_is_constraining.all(), error_msg_unknown_dim
+            # If token is an additive token -> units are those of any children (as they should be the same
+            # among them) but making sure that children of additive binary tokens have the same units for safety.
+            mask = bh_binary_additive.is_id(b_behavior_id)                                                 # (n_binary,)
+            assert units_keys_equal(keys_a      = units_to_key(child0_phy_units[mask]),
+                                    keys_b      = units_to_key(child1_phy_units[mask]),
+                                    phy_units_a = child0_phy_units[mask],
+                                    phy_units_b = child1_phy_units[mask]).all(), error_msg_additive_discrepancy
+            assign_units (prog_i = b_prog_i[mask], pos = b_pos[mask], phy_units = child0_phy_units[mask])
+            # Elif token is a multiplicative token
+            # token = child0 * child1 => units(token) = child0_phy_units + child1_phy_units
+            mask = bh_binary_mul.is_id(b_behavior_id)                                                      # (n_binary,)
+            assign_units (prog_i = b_prog_i[mask], pos = b_pos[mask],
+                          phy_units = child0_phy_units[mask] + child1_phy_units[mask])
+            # token = child0 / child1 => units(token) = child0_phy_units - child1_phy_units
+            mask = bh_binary_div.is_id(b_behavior_id)                                                      # (n_binary,)
+            assign_units (prog_i = b_prog_i[mask], pos = b_pos[mask],
+                          phy_units = child0_phy_units[mask] - child1_phy_units[mask])
     return None
 
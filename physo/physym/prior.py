@@ -1,10 +1,12 @@
 import warnings
 import numpy as np
+import torch
 from abc import ABC, abstractmethod
 
 # Internal imports
 from physo.physym import token as Tok
 from physo.physym import functions as Func
+from physo.physym import dimensional_analysis as phy
 
 # ----------------------------------------------------------------------------------------------------------------------
 # ----------------------------------------------------- PRIOR CLASS ----------------------------------------------------
@@ -14,7 +16,12 @@ from physo.physym import functions as Func
 class Prior (ABC):
     """
     Abstract prior.
+    Priors whose mask does not depend on the content of programs should set is_static = True so their mask can be
+    computed once and re-used at every step by PriorCollection.
     """
+    # Does mask depend on programs' content
+    is_static = False
+
     def __init__(self, library, programs):
         """
         Parameters
@@ -35,6 +42,14 @@ class Prior (ABC):
         """
         self.mask_prob = self.get_default_mask_prob()
 
+    def reset (self):
+        """
+        Resets the part of the prior's state that depends on the content of programs (called when programs are reset
+        to be re-used for a new epoch). Tables depending only on the library are kept.
+        Stateless priors have nothing to reset.
+        """
+        pass
+
     def __call__(self):
         """
         Returns probabilities of priors for each choosable token in the library.
@@ -44,6 +59,21 @@ class Prior (ABC):
         """
         raise NotImplementedError
 
+    def get_mask_prob_of_rows (self, rows):
+        """
+        Returns probabilities of priors for each choosable token in the library for some rows (ie. programs) of the
+        batch only (eg. rows of incomplete programs). By default, probabilities are computed for the whole batch, priors
+        for which this is costly should override this method.
+        Parameters
+        ----------
+        rows : numpy.array of shape (n_rows,) of int
+            Rows of batch.
+        Returns
+        -------
+        mask_probabilities : numpy.array of shape (n_rows, self.lib.n_choices) of float
+        """
+        return self()[rows]
+
 # ----------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------ INDIVIDUAL PRIORS IMPLEMENTATION ------------------------------------------
 # ----------------------------------------------------------------------------------------------------------------------
@@ -55,6 +85,7 @@ class UniformArityPrior (Prior):
     This prior encourages tokens with an arity that is under-represented and discourages tokens with an arity that
     is over-represented by normalising token probabilities by the number of tokens having its arity.
     """
+    is_static = True
 
     def __init__(self, library, programs):
         """
@@ -201,6 +232,45 @@ class SoftLengthPrior (Prior):
         return "SoftLengthPrior (length_loc = %i, scale = %i)"%(self.length_loc, self.scale)
 
 
+# Number of bits in bitset words
+BITSET_WORD_SIZE = 64
+
+def pack_bitset (mask):
+    """
+    Packs boolean masks into bitsets of uint64 words.
+    Parameters
+    ----------
+    mask : numpy.array of shape (?, n_bits) of bool
+    Returns
+    -------
+    bitset : numpy.array of shape (?, n_words) of numpy.uint64
+        With n_words = ceil(n_bits/BITSET_WORD_SIZE), bit i of word w representing element w*BITSET_WORD_SIZE+i.
+    """
+    n, n_bits = mask.shape
+    n_words   = int(np.ceil(n_bits / BITSET_WORD_SIZE))
+    padded    = np.zeros(shape=(n, n_words * BITSET_WORD_SIZE), dtype=np.uint64)                     # (?, n_words*BITSET_WORD_SIZE)
+    padded[:, :n_bits] = mask
+    shifts    = np.arange(BITSET_WORD_SIZE, dtype=np.uint64)                                          # (BITSET_WORD_SIZE,)
+    bitset    = (padded.reshape(n, n_words, BITSET_WORD_SIZE) << shifts).sum(axis=-1, dtype=np.uint64) # (?, n_words)
+    return bitset
+
+def unpack_bitset (bitset, n_bits):
+    """
+    Unpacks bitsets of uint64 words into boolean masks (inverse of pack_bitset).
+    Parameters
+    ----------
+    bitset : numpy.array of shape (?, n_words) of numpy.uint64
+    n_bits : int
+        Number of elements represented by bitsets.
+    Returns
+    -------
+    mask : numpy.array of shape (?, n_bits) of bool
+    """
+    n      = bitset.shape[0]
+    shifts = np.arange(BITSET_WORD_SIZE, dtype=np.uint64)                                             # (BITSET_WORD_SIZE,)
+    mask   = ((bitset[:, :, np.newaxis] >> shifts) & np.uint64(1)).astype(bool)                       # (?, n_words, BITSET_WORD_SIZE)
+    return mask.reshape(n, -1)[:, :n_bits]
+
 class RelationshipConstraintPrior (Prior):
     """
     Forces programs to comply with relationships constraints. Enforcing that [targets] cannot be the [relationship] of
@@ -305,62 +375,52 @@ class RelationshipConstraintPrior (Prior):
                               }
         self.get_relatives_idx = get_relatives_idx_dict[self.effectors_role]                            # Returns (batch_size, max_n_relatives)
 
-        # -------- CONSTRAINTS MASK  --------
-
-        # Is relationship allowed between effectors and targets : mask
-        # Shape = ( number of possible effectors (including : superparent, dummy and invalid token)
-        # vs number of possible targets (ie choosable tokens only) )
-        self.mask_constraints = np.ones(shape = (self.lib.n_library, self.lib.n_choices), dtype = float) # (lib.n_library, lib.n_choices)
-
-        # Put 0 weights on forbidden relationships
-        self.mask_constraints[(self.effectors, self.targets)] = 0                                        # (n_constraints,)
-
-        # -------- MAX VIOLATIONS COUNT  --------
-
-        # Used for multiple relatives cases (eg. ancestors) but not single relatives cases (eg. parent, sibling)
-        # Matrix of relationships (similar shape as mask_constraints) containing max number of violations tolerated
-        # for each relationship.
-        self.count_max_violations = np.full(shape = (self.lib.n_library, self.lib.n_choices),              # (lib.n_library, lib.n_choices)
-                                            fill_value = self.max_n_relatives,
-                                            dtype = float)
-        self.count_max_violations[(self.effectors, self.targets)] = self.max_nb_violations                 # (n_constraints,)
+        # -------- CONSTRAINTS BITSETS  --------
+
+        # Forbidden relationships are stored as packed bitsets over choosable tokens (one bit per target, uint64 words)
+        # for each possible effector (including : superparent, dummy and invalid token), so memory grows linearly with
+        # the library size. Constraints are grouped by their max number of tolerated violations: a target is forbidden
+        # if for any group, the number of relatives being an effector of this group exceeds the group's max number of
+        # violations.
+        self.n_words = int(np.ceil(self.lib.n_choices / BITSET_WORD_SIZE))                                 # int
+        # Unique max numbers of violations
+        self.violations_groups = np.unique(self.max_nb_violations)                                         # (n_groups,)
+        # Effectors of each group
+        self.groups_effectors  = []                                                                        # list of (n_effectors_in_group,) of int
+        # Packed forbidden targets bitsets of each effector of each group
+        self.groups_bitsets    = []                                                                        # list of (n_effectors_in_group, n_words) of uint64
+        for max_violations in self.violations_groups:
+            is_in_group = (self.max_nb_violations == max_violations)                                       # (n_constraints,)
+            group_effectors, inverse = np.unique(self.effectors[is_in_group], return_inverse=True)         # (n_effectors_in_group,)
+            group_mask = np.zeros(shape=(len(group_effectors), self.lib.n_choices), dtype=bool)            # (n_effectors_in_group, lib.n_choices)
+            group_mask[(inverse, self.targets[is_in_group])] = True
+            self.groups_effectors .append(group_effectors)
+            self.groups_bitsets   .append(pack_bitset(group_mask))                                         # (n_effectors_in_group, n_words)
 
     def __call__(self):
+        return self.get_mask_prob_of_rows(rows = None)
 
-        # --- Faster code that works only for self.max_n_relatives == 1 cases ---
-        # -> If using this code, delete sentence "Remark: using max_nb_violations with values > 0 on single relative
-        # relationship cases (eg. parent) would mean applying no constraint whatsoever." in max_nb_violations arg
-        # description.
-
-        # if self.max_n_relatives == 1:
-        #     # Getting idx in the lib of relatives
-        #     relatives_idx = self.get_relatives_idx(step=self.progs.curr_step)  # (batch_size, max_n_relatives)
-        #     # Batch of prior mask corresponding to each relative
-        #     # For parents / sibling relationships: this is simply the batch of prior mask (as max_n_relatives = 1 for those)
-        #     # For ancestor relationships: this is the batch of prior for each ancestor
-        #     # (i.e. constraints arising from each ancestor with vectors of ones for non-existing "-" ancestors)
-        #     mask_prob_relatives = self.mask_constraints[relatives_idx,
-        #                           :]  # (batch_size, max_n_relatives, lib.n_choices)
-        #     # Multiplying along the relatives' axis to get the whole constraint for each program
-        #     # For parents / sibling relationships: this simply deletes an unnecessary dimension as each prog only has 1
-        #     # vector of constraints arising from only one relationship (the parent or the sibling) (max_n_relatives = 1)
-        #     # For ancestor relationships: this reduces dimensionality by multiplying the constraints masks
-        #     mask_prob = mask_prob_relatives.prod(axis=1)  # (batch_size, lib.n_choices)
-        # else: # self.max_n_relatives > 1:
+    def get_mask_prob_of_rows (self, rows):
 
         # Getting idx in the lib of relatives
-        relatives_idx = self.get_relatives_idx(step=self.progs.curr_step)  # (batch_size, max_n_relatives)
-
-        # Counts of relatives in a complete lib (including dummy, invalid etc.) size vector for each prog of batch
-        counts_relatives = self.progs.count_tokens_idx(relatives_idx)                                                # (batch_size, lib.n_library)
-        # Tile of this count along a new n_choices size dimension for each prog in batch
-        tile_counts = np.moveaxis(np.tile(counts_relatives,                                                          # (batch_size, lib.n_library, lib.n_choices,)
-                                  reps=(self.lib.n_choices, 1, 1)), source=(1,2), destination=(0,1))
-        # Tile of general relationship counts constraints along a new batch_size dim
-        tile_count_max_violations = np.tile(self.count_max_violations, reps=(self.progs.batch_size, 1, 1))           # (batch_size, lib.n_library, lib.n_choices,)
-        # Would max number of violations be respected if choosing token in lib.n_choices dim
-        mask_max_violations_respected = (tile_counts <= tile_count_max_violations)                                   # (batch_size, lib.n_library, lib.n_choices,)
-        mask_prob = mask_max_violations_respected.prod(axis=1)
+        relatives_idx = self.get_relatives_idx(step=self.progs.curr_step)                                  # (batch_size, max_n_relatives)
+        if rows is not None:
+            relatives_idx = relatives_idx[rows]                                                            # (n_rows, max_n_relatives)
+        n_rows = relatives_idx.shape[0]
+
+        # Forbidden targets bitsets of each program
+        forbidden = np.zeros(shape=(n_rows, self.n_words), dtype=np.uint64)                                # (n_rows, n_words)
+        for max_violations, effectors, bitsets in zip(self.violations_groups, self.groups_effectors, self.groups_bitsets):
+            # Number of relatives of each program being each effector of the group
+            counts = (relatives_idx[:, :, np.newaxis] == effectors).sum(axis=1)                            # (n_rows, n_effectors_in_group)
+            # Are max number of violations exceeded
+            is_exceeded = counts > max_violations                                                          # (n_rows, n_effectors_in_group)
+            # Combining constraints arising from all effectors with exceeded violations via bitwise OR
+            group_forbidden = np.where(is_exceeded[:, :, np.newaxis], bitsets, np.uint64(0))               # (n_rows, n_effectors_in_group, n_words)
+            forbidden |= np.bitwise_or.reduce(group_forbidden, axis=1)                                     # (n_rows, n_words)
+
+        # Unpacking bitsets
+        mask_prob = (~unpack_bitset(forbidden, n_bits=self.lib.n_choices)).astype(float)                   # (n_rows, lib.n_choices)
 
         return mask_prob
 
@@ -415,6 +475,10 @@ class NoUselessInversePrior(Prior):
                                           relationship = self.relationship,
                                           effectors    = self.effectors,)
 
+    def reset(self):
+        if self.active:
+            self.prior.reset()
+
     def __call__(self):
         if self.active:
             mask_prob = self.prior()              # (batch_size, lib.n_choices)
@@ -422,6 +486,13 @@ class NoUselessInversePrior(Prior):
             mask_prob = self.get_default_mask_prob()  # (batch_size, lib.n_choices)
         return mask_prob
 
+    def get_mask_prob_of_rows (self, rows):
+        if self.active:
+            mask_prob = self.prior.get_mask_prob_of_rows(rows)          # (n_rows, lib.n_choices)
+        else:
+            mask_prob = np.ones((len(rows), self.lib.n_choices), dtype = float)  # (n_rows, lib.n_choices)
+        return mask_prob
+
     def __repr__(self):
         repr = "NoUselessInversePrior (%s can not be %s of %s)" \
                % (self.targets, self.relationship, self.effectors)
@@ -473,13 +544,9 @@ class NestedFunctions (Prior):
 
         # ---- ANCESTOR RELATIONSHIP PARAMETERS ----
 
-        # Max number of ancestors
-        self.max_n_ancestors = self.progs.max_time_step
-
-        # Method of programs returning ancestors of token at step (and filling non-existing relatives with
-        # self.lib.invalid_idx).
-        self.get_ancestors_idx = lambda step: self.progs.get_ancestors_idx_of_step (
-            step, no_ancestor_idx_filler = self.lib.invalid_idx)               # Returns (batch_size, max_n_ancestors)
+        # Running counter of number of ancestors belonging to [functions] maintained by programs (avoids going
+        # through family lines at each step).
+        self.ancestors_counter_key = self.progs.register_ancestors_counter(self.functions)
 
         # ---- PRIOR TEMPLATES ----
 
@@ -495,14 +562,9 @@ class NestedFunctions (Prior):
 
     def __call__(self):
 
-        # Getting idx in the lib of ancestors
-        ancestors_idx = self.get_ancestors_idx(step=self.progs.curr_step)                                            # (batch_size, max_n_ancestors)
-
-        # Counts of ancestors in a complete lib (including dummy, invalid etc.) size vector for each prog of batch
-        counts_ancestors = self.progs.count_tokens_idx(ancestors_idx)                                                # (batch_size, lib.n_library)
-
         # Number of ancestors that are part of [functions] for each prog in batch
-        nesting_level = counts_ancestors[:, self.functions].sum(axis=1)                                              # (batch_size,)
+        nesting_level = self.progs.get_n_ancestors_in_set_of_step(key  = self.ancestors_counter_key,                # (batch_size,)
+                                                                  step = self.progs.curr_step)
 
         # mask : is prog allowed to continue with tokens of type [functions]
         mask_allow = nesting_level < self.max_nesting                                                                # (batch_size,)
@@ -562,6 +624,10 @@ class NestedTrigonometryPrior(Prior):
                                           functions   = self.trigonometric_functions,
                                           max_nesting = max_nesting)
 
+    def reset(self):
+        if self.active:
+            self.prior.reset()
+
     def __call__(self):
         if self.active:
             mask_prob = self.prior()              # (batch_size, lib.n_choices)
@@ -569,6 +635,13 @@ class NestedTrigonometryPrior(Prior):
             mask_prob = self.get_default_mask_prob()  # (batch_size, lib.n_choices)
         return mask_prob
 
+    def get_mask_prob_of_rows (self, rows):
+        if self.active:
+            mask_prob = self.prior.get_mask_prob_of_rows(rows)          # (n_rows, lib.n_choices)
+        else:
+            mask_prob = np.ones((len(rows), self.lib.n_choices), dtype = float)  # (n_rows, lib.n_choices)
+        return mask_prob
+
     def __repr__(self):
         if self.max_nesting == 1:
             repr = "NestedTrigonometryPrior (tokens = %s, nesting forbidden)" \
@@ -622,10 +695,47 @@ class OccurrencesPrior (Prior):
         # Max number of occurrences allowed for each target
         self.max = max                                                                                           # (n_constraints,)
 
+        # -------- RUNNING COUNTS --------
+        # For each prog in batch, number of occurrences of each target, updated with newly appended tokens only via
+        # an append hook.
+        self.counts = np.zeros(shape=(self.progs.batch_size, self.n_constraints), dtype=int)                     # (batch_size, n_constraints,)
+        # Number of steps accounted for in counts (None = counts are not up-to-date)
+        self.counts_step = None
+        self.progs.register_append_hook(self.update_counts)
+
+    def recount (self):
+        """
+        Recounts occurrences of targets from scratch (allows for the use of this prior even if it was not used before
+        or if programs were modified through other means than append).
+        """
+        self.counts[:] = np.equal.outer(self.progs.tokens.idx[:, :self.progs.curr_step], self.targets,).sum(axis=1) # (batch_size, n_constraints,)
+        self.counts_step = self.progs.curr_step
+        return None
+
+    def update_counts (self, step):
+        """
+        Append hook: updates counts with tokens appended at step.
+        Parameters
+        ----------
+        step : int
+            Step at which new tokens were appended.
+        """
+        if self.counts_step == step:
+            self.counts += np.equal.outer(self.progs.tokens.idx[:, step], self.targets,)                        # (batch_size, n_constraints,)
+            self.counts_step = step + 1
+        else:
+            self.recount()
+        return None
+
+    def reset (self):
+        self.counts_step = None
+        return None
+
     def __call__(self):
-        # Recounting at each step allows for the use of this prior even if it was not used before
-        # For each prog in batch, number of occurrences of each target
-        counts = np.equal.outer(self.progs.tokens.idx, self.targets,).sum(axis=1)                               # (batch_size, n_constraints,)
+        # Recounting if counts are not up-to-date
+        if self.counts_step != self.progs.curr_step:
+            self.recount()
+        counts = self.counts                                                                                    # (batch_size, n_constraints,)
         # For each prog in batch, for each target : is target allowed at next step ?
         is_target_allowed = np.less(counts, self.max)                                                           # (batch_size, n_constraints,)
         # mask : for each prog in batch, for each token in choosable tokens, is token allowed
@@ -633,6 +743,18 @@ class OccurrencesPrior (Prior):
         self.mask_prob[:, self.targets] = is_target_allowed.astype(float)                                       # (batch_size, n_choices,)
         return self.mask_prob
 
+    def get_mask_prob_of_rows (self, rows):
+        # Recounting if counts are not up-to-date
+        if self.counts_step != self.progs.curr_step:
+            self.recount()
+        counts = self.counts[rows]                                                                              # (n_rows, n_constraints,)
+        # For each prog, for each target : is target allowed at next step ?
+        is_target_allowed = np.less(counts, self.max)                                                           # (n_rows, n_constraints,)
+        # mask : for each prog, for each token in choosable tokens, is token allowed
+        mask_prob = np.ones((len(rows), self.lib.n_choices), dtype = float)                                     # (n_rows, n_choices,)
+        mask_prob[:, self.targets] = is_target_allowed.astype(float)                                            # (n_rows, n_choices,)
+        return mask_prob
+
     def __repr__(self):
         return "OccurrencesPrior (tokens %s can be used %s times max)"%(self.targets_str, self.max)
 
@@ -640,6 +762,9 @@ class PhysicalUnitsPrior(Prior):
     """
     Enforces that next token should be physically consistent units-wise with current program based on current units
     constraints computed live (during program generation). If there is no way get a constraint all tokens are allowed.
+    The legality mask over the library of each distinct units requirement is memoized (keyed on the units requirement
+    integer lattice key) and kept across steps and epochs (as long as the batch is reused), masks are then simply
+    gathered for each program.
     """
     def __init__(self, library, programs, prob_eps = 0.):
         """
@@ -660,65 +785,130 @@ class PhysicalUnitsPrior(Prior):
         # ------- LIB_IS_CONSTRAINING -------
         # mask : are tokens in the library constraining units-wise
         self.lib_is_constraining = self.lib.is_constraining_phy_units[:self.lib.n_choices]                              # (n_choices,)
-        # mask : are tokens in the library constraining units-wise (expanding in a new batch_size axis)
-        self.lib_is_constraining_padded = np.tile(self.lib_is_constraining, reps=(self.progs.batch_size, 1))            # (batch_size, n_choices,)
 
         # ------- LIB_UNITS -------
         # Units of choosable tokens in the library
         self.lib_units = self.lib.phy_units[:self.lib.n_choices]                                                        # (n_choices, UNITS_VECTOR_SIZE,)
-        # Padded units of choosable tokens in the library (expanding in a new batch_size axis)
-        self.lib_units_padded = np.tile(self.lib_units, reps=(self.progs.batch_size, 1, 1))                             # (batch_size, n_choices, UNITS_VECTOR_SIZE,)
+        # Units keys of choosable tokens in the library on the integer lattice
+        self.lib_units_keys = phy.units_to_key(phy_units       = self.lib_units,                                        # (n_choices,) of int64
+                                               is_constraining = self.lib_is_constraining)
+
+        # ------- LEGALITY MASKS CACHE -------
+        # Units requirement key -> mask : is choosing token in library legal units-wise
+        # (a non-constraining requirement allows all tokens)
+        self.units_legality_cache = {phy.UNITS_KEY_NON_CONSTRAINING: np.full(self.lib.n_choices, True)}                 # dict of (n_choices,) of bool
+
+    def compute_units_legality (self, units_requirement, units_requirement_keys):
+        """
+        Computes units legality masks over the library (without using the cache).
+        Parameters
+        ----------
+        units_requirement : numpy.array of shape (n, UNITS_VECTOR_SIZE) of float
+            Constraining units requirements.
+        units_requirement_keys : numpy.array of shape (n,) of int64
+            Keys of units requirements on the integer lattice.
+        Returns
+        -------
+        mask : numpy.array of shape (n, n_choices) of bool
+            Is choosing token in library legal units-wise.
+        """
+        # Token in library should be allowed if it has no units constraints OR if the units are consistent (integer
+        # keys equality, tolerance based float comparison for units that are not representable on the lattice).
+        mask_units_equal = phy.units_keys_equal(                                                                        # (n, n_choices)
+            keys_a      = units_requirement_keys[:, np.newaxis],
+            keys_b      = self.lib_units_keys[np.newaxis, :],
+            phy_units_a = units_requirement[:, np.newaxis, :],
+            phy_units_b = self.lib_units[np.newaxis, :, :],
+            tol         = self.tol,
+                                                )
+        mask = mask_units_equal | (~self.lib_is_constraining)[np.newaxis, :]                                            # (n, n_choices)
+        return mask
+
+    def get_units_legality (self, units_requirement, units_requirement_keys):
+        """
+        Gets units legality masks over the library using memoized masks of units requirement keys (masks of keys not
+        yet encountered are computed and stored, units that are not representable on the lattice are not cached).
+        Parameters
+        ----------
+        units_requirement : numpy.array of shape (n_rows, UNITS_VECTOR_SIZE) of float
+            Units requirements.
+        units_requirement_keys : numpy.array of shape (n_rows,) of int64
+            Keys of units requirements on the integer lattice.
+        Returns
+        -------
+        mask : numpy.array of shape (n_rows, n_choices) of bool
+            Is choosing token in library legal units-wise.
+        """
+        # Distinct keys in batch
+        unique_keys, inverse = np.unique(units_requirement_keys, return_inverse=True)                                   # (n_unique,), (batch_size,)
+        # Legality mask of each distinct key
+        unique_masks = np.empty(shape=(len(unique_keys), self.lib.n_choices), dtype=bool)                               # (n_unique, n_choices)
+        for i, key in enumerate(unique_keys):
+            key = int(key)
+            if key == phy.UNITS_KEY_UNREPRESENTABLE:
+                continue
+            if key not in self.units_legality_cache:
+                self.units_legality_cache[key] = self.compute_units_legality(
+                    units_requirement      = phy.key_to_units(np.array([key])),
+                    units_requirement_keys = np.array([key], dtype=np.int64))[0]
+            unique_masks[i] = self.units_legality_cache[key]
+        # Gathering masks for each program
+        mask = unique_masks[inverse]                                                                                    # (batch_size, n_choices)
+        # Units which are not representable on the lattice are handled row-wise
+        is_unrepresentable = (units_requirement_keys == phy.UNITS_KEY_UNREPRESENTABLE)                                  # (batch_size,)
+        if is_unrepresentable.any():
+            mask[is_unrepresentable] = self.compute_units_legality(                                                     # (n_unrepresentable, n_choices)
+                units_requirement      = units_requirement      [is_unrepresentable],
+                units_requirement_keys = units_requirement_keys [is_unrepresentable],)
+        return mask
 
     def __call__(self):
+        return self.get_mask_prob_of_rows(rows = None)
+
+    def get_mask_prob_of_rows (self, rows):
 
         # Current step
         curr_step = self.progs.curr_step
 
         # ------- COMPUTE REQUIRED UNITS -------
         # Updating programs with newest most constraining units constraints
+        # (this is only done for incomplete programs)
         self.progs.assign_required_units(step=curr_step)
 
+        # Rows
+        if rows is None:
+            rows = slice(None)
+
         # ------- IS_PHYSICAL -------
         # mask : is dummy at current step part of a physical program units-wise
-        is_physical = self.progs.is_physical                                                                            # (batch_size,)
-        # mask : is dummy at current step part of a physical program units-wise (expanding in a new n_choices axis)
-        is_physical_padded = np.moveaxis( np.tile(is_physical, reps=(self.lib.n_choices, 1))                            # (batch_size, n_choices,)
-                                              , source=0, destination=1)
+        is_physical = self.progs.is_physical[rows]                                                                      # (n_rows,)
 
         # ------- IS_CONSTRAINING -------
         # mask : does dummy at current step contain constraints units-wise
-        is_constraining = self.progs.tokens.is_constraining_phy_units[:, curr_step]                                     # (batch_size,)
-        # mask : does dummy at current step contain constraints units-wise (expanding in a new n_choices axis)
-        is_constraining_padded = np.moveaxis( np.tile(is_constraining, reps=(self.lib.n_choices, 1))                    # (batch_size, n_choices,)
-                                              , source=0, destination=1)
-        # Number of programs in batch that constraining at this step
-        n_constraining  = is_constraining.sum()
-        # mask : for each token in batch, for each token in library are both tokens constraining
-        mask_prob_is_constraining_info = self.lib_is_constraining_padded & is_constraining_padded                       # (batch_size, n_choices,)
-
-        # Useful as to forbid a choice, the choosable token must be constraining and the current dummy must also be
+        is_constraining = self.progs.tokens.is_constraining_phy_units[rows, curr_step]                                  # (n_rows,)
+
+        # To forbid a choice, the choosable token must be constraining and the current dummy must also be
         # constraining, otherwise the choice should be legal regardless of the units of any of these tokens
         # (non-constraining tokens should contain NaNs units).
 
         # ------- UNITS -------
         # Units requirements at current step dummies
-        units_requirement       = self.progs.tokens.phy_units[:, curr_step, :]                                          # (batch_size, UNITS_VECTOR_SIZE)
-        # Padded units requirements of dummies at current step (expanding in a new n_choices axis)
-        units_requirement_padded = np.moveaxis(np.tile(units_requirement, reps=(self.lib.n_choices, 1, 1))              # (batch_size, n_choices, UNITS_VECTOR_SIZE)
-                                               , source=0, destination=1)
-        # mask : for each token in batch, is choosing token in library legal units-wise
-        mask_prob_units_legality = (np.abs(units_requirement_padded - self.lib_units_padded) < self.tol).prod(axis=-1)  # (batch_size, n_choices)
+        units_requirement      = self.progs.tokens.phy_units[rows, curr_step, :]                                        # (n_rows, UNITS_VECTOR_SIZE)
+        # Units keys of requirements on the integer lattice (non-constraining dummies get UNITS_KEY_NON_CONSTRAINING)
+        units_requirement_keys = phy.units_to_key(phy_units = units_requirement, is_constraining = is_constraining)     # (n_rows,) of int64
+        # mask : for each token in batch, is choosing token in library legal units-wise (memoized)
+        mask_prob_units_legality = self.get_units_legality(units_requirement      = units_requirement,                  # (n_rows, n_choices)
+                                                           units_requirement_keys = units_requirement_keys,)
 
         # ------- RESULT -------
         # Token in library should be allowed if there are no units constraints on any side (library, current dummies)
         # OR if the units are consistent OR if the program is unphysical.
         # Ie. all tokens in the library are allowed if there are no constraints on any sides or if the program is
         # unphysical anyway.
-        mask_prob = np.logical_or.reduce((                                                                              # (batch_size, n_choices)
-            (~ mask_prob_is_constraining_info),
-            (~ is_physical_padded),
+        mask_prob = np.logical_or(                                                                                      # (n_rows, n_choices)
             mask_prob_units_legality,
-                                          )).astype(float)
+            (~ is_physical)[:, np.newaxis],
+                                  ).astype(float)
         mask_prob[mask_prob == 0] = self.prob_eps
         return mask_prob
 
@@ -811,6 +1001,7 @@ def make_PriorCollection (library, programs, priors_config,):
 class PriorCollection:
     """
     Collection of prior.Prior, returns value of element-wise multiplication of constituent priors.
+    Static priors (is_static = True) are multiplied once and for all, only dynamic priors are evaluated at each step.
     """
     def __init__(self, library, programs,):
         """
@@ -825,6 +1016,15 @@ class PriorCollection:
         self.lib       = library
         self.progs     = programs
         self.init_prob = np.ones( (self.progs.batch_size, self.lib.n_choices), dtype = float)
+        # Static and dynamic priors
+        self.static_priors  = []
+        self.dynamic_priors = []
+        # Product of static priors
+        self.static_prob    = self.init_prob.copy()                                                     # (batch_size, n_choices) of float
+        # Preallocated buffers for log-space priors (the float32 buffer is shared with a torch tensor)
+        self.prob_buffer        = np.ones((self.progs.batch_size, self.lib.n_choices), dtype = float)  # (batch_size, n_choices) of float
+        self.log_prob_buffer    = np.zeros((self.progs.batch_size, self.lib.n_choices), dtype = np.float32)  # (batch_size, n_choices) of float32
+        self.log_prob_tensor    = torch.from_numpy(self.log_prob_buffer)                                # (batch_size, n_choices) of float32
 
     def set_priors (self, priors):
         """
@@ -835,6 +1035,18 @@ class PriorCollection:
         """
         for prior in priors:
             self.priors.append(prior)
+            if prior.is_static:
+                self.static_priors.append(prior)
+                self.static_prob = np.multiply(self.static_prob, prior())
+            else:
+                self.dynamic_priors.append(prior)
+
+    def reset (self):
+        """
+        Resets constituent priors (called when programs are reset to be re-used for a new epoch).
+        """
+        for prior in self.priors:
+            prior.reset()
 
     def __call__(self):
         """
@@ -843,11 +1055,49 @@ class PriorCollection:
         -------
         mask_probabilities : numpy.array of shape (self.progs.batch_size, self.lib.n_choices) of float
         """
-        res = self.init_prob
-        for prior in self.priors:
-            res = np.multiply(res, prior())
+        res = self.static_prob.copy()
+        for prior in self.dynamic_priors:
+            np.multiply(res, prior(), out = res)
         return res
 
+    def get_log_prior (self):
+        """
+        Returns log of probabilities of priors for each choosable token in the library (zero probabilities giving
+        -inf) as a torch tensor.
+        Dynamic priors are multiplied in place into a preallocated buffer on top of precomputed static priors and the
+        log is written into a preallocated torch buffer. Priors are only computed for rows of incomplete programs (see
+        Prior.get_mask_prob_of_rows), rows of complete programs are not updated (they keep the last distribution
+        computed when they were incomplete, tokens appended to complete programs being ignored anyway).
+        Note that the returned tensor is re-used (overwritten) at each call.
+        Returns
+        -------
+        log_prior : torch.tensor of shape (self.progs.batch_size, self.lib.n_choices) of float32
+        """
+        # Rows of incomplete programs
+        rows   = np.flatnonzero(~self.progs.is_complete)                                                # (n_rows,) of int
+        n_rows = len(rows)
+        if n_rows == self.progs.batch_size:
+            # Product of priors
+            prob = self.prob_buffer                                                                     # (batch_size, n_choices) of float
+            np.copyto(prob, self.static_prob)
+            for prior in self.dynamic_priors:
+                np.multiply(prob, prior(), out = prob)
+            # Log (in place)
+            with np.errstate(divide = "ignore"):
+                np.log(prob, out = prob)
+            self.log_prob_buffer[:] = prob
+        elif n_rows > 0:
+            # Product of priors (computed on rows of incomplete programs only)
+            prob = self.prob_buffer[:n_rows]                                                            # (n_rows, n_choices) of float
+            np.take(self.static_prob, rows, axis = 0, out = prob)
+            for prior in self.dynamic_priors:
+                np.multiply(prob, prior.get_mask_prob_of_rows(rows), out = prob)
+            # Log (in place)
+            with np.errstate(divide = "ignore"):
+                np.log(prob, out = prob)
+            self.log_prob_buffer[rows] = prob
+        return self.log_prob_tensor
+
     def __repr__(self):
         #repr = np.array([str(prior) for prior in self.priors])
         repr = "PriorCollection:"
@@ -583,7 +583,8 @@ class VectPrograms:
         Wrapper to apply to candidate program's output, candidate_wrapper taking func, X as arguments where func is
         a candidate program callable (taking X as arg). By default = None, no wrapper is applied (identity).
     """
-    def __init__(self, batch_size, max_time_step, library, candidate_wrapper=None):
+    def __init__(self, batch_size, max_time_step, library, candidate_wrapper=None, compact_dtypes=False,
+                 store_ancestors_pos=True):
         """
         Parameters
         ----------
@@ -596,6 +597,15 @@ class VectPrograms:
         candidate_wrapper : callable or None, optional
             Wrapper to apply to candidate program's output, candidate_wrapper taking func, X as arguments where func is
             a candidate program callable (taking X as arg). By default = None, no wrapper is applied (identity).
+        compact_dtypes : bool, optional
+            If True, (batch_size, max_time_step,)-shaped arrays (including tokens) are stored using compact dtypes
+            (see token.VectTokens) to reduce memory usage (False by default).
+        store_ancestors_pos : bool, optional
+            If True (default), the dense (batch_size, max_time_step, max_time_step) ancestors record of tokens is
+            stored. If False, ancestors are recovered by walking up the parent chain when needed (see get_ancestors),
+            avoiding a memory footprint growing quadratically with max_time_step. Priors only needing to know how many
+            ancestors belong to a given set of tokens should use running counters (see register_ancestors_counter)
+            which do not depend on this.
         """
         # Assertions
         assert isinstance(batch_size,    int) and batch_size    > 0, "batch_size    must be a >0 int."
@@ -604,6 +614,10 @@ class VectPrograms:
         # Number of candidate programs
         self.batch_size = batch_size                                        # int
         self.shape      = (batch_size, max_time_step)                       # (int, int)
+        # Use compact dtypes for time dim arrays
+        self.compact_dtypes = compact_dtypes                                # bool
+        # Store dense ancestors record
+        self.store_ancestors_pos = store_ancestors_pos                      # bool
 
         # ---------------------------- LIBRARY ----------------------------
         self.library         = library
@@ -647,9 +661,20 @@ class VectPrograms:
 
         # ---------------------------- TOKEN MANAGEMENT ---------------------------- -> time dim
         # Number of dummy at any point
-        self.n_dummies_history = np.zeros(shape = self.shape, dtype=int)                      # (batch_size, max_time_step,) of int
+        self.n_dummies_history = np.zeros(shape = self.shape,                                 # (batch_size, max_time_step,) of int
+                                          dtype = Tok.COMPACT_INT_DTYPE if self.compact_dtypes else int)
         # Token main properties
-        self.tokens = Tok.VectTokens(shape =self.shape, invalid_token_idx = self.invalid_idx) # (batch_size, max_time_step,)
+        self.tokens = Tok.VectTokens(shape               = self.shape,                        # (batch_size, max_time_step,)
+                                     invalid_token_idx   = self.invalid_idx,
+                                     compact_dtypes      = self.compact_dtypes,
+                                     store_ancestors_pos = self.store_ancestors_pos)
+        # Running counters of number of ancestors belonging to sets of tokens (see register_ancestors_counter)
+        # Sets of tokens: is token in set mask
+        self.ancestors_counters_sets = []                                                     # list of (n_library,) of bool
+        # Number of strict ancestors (ie. not counting the token itself) of tokens belonging to set
+        self.ancestors_counters      = []                                                     # list of (batch_size, max_time_step,) of int
+        # Functions called at the end of each append (see register_append_hook)
+        self.append_hooks = []                                                                # list of callable
 
         # ---------------------------- UNITS RELATED MANAGEMENT ----------------------------
 
@@ -657,7 +682,49 @@ class VectPrograms:
         self.is_physical = np.full(shape = self.batch_size, fill_value = True, dtype = bool)  # (batch_size,) of bool
 
         # mask : dimensional analysis assignment case code (Token management) -> time dim
-        self.units_analysis_cases = np.full(shape = self.shape, fill_value = phy.UNITS_ANALYSIS_NOT_PERFORMED_CASE_CODE, dtype = int)  # (batch_size, max_time_step,) of bool
+        self.units_analysis_cases = np.full(shape = self.shape, fill_value = phy.UNITS_ANALYSIS_NOT_PERFORMED_CASE_CODE,  # (batch_size, max_time_step,) of int
+                                            dtype = Tok.COMPACT_SMALL_INT_DTYPE if self.compact_dtypes else int)
+
+        # Units keys of tokens in the library on the integer lattice (see dimensional_analysis.units_to_key)
+        self.lib_phy_units_keys = phy.units_to_key(phy_units       = library.phy_units,                 # (n_library,) of int64
+                                                   is_constraining = library.is_constraining_phy_units)
+
+        # ---------------------------- EXECUTION RELATED ----------------------------
+        # Wrapper to apply to candidate programs when executing
+        if candidate_wrapper is None:
+            candidate_wrapper = DEFAULT_WRAPPER
+        self.candidate_wrapper = candidate_wrapper
+
+        # ---------------------------- INIT 0TH DUMMY + FREE CONSTANTS REGISTER ----------------------------
+        self.reset()
+
+        return None
+
+    def reset (self):
+        """
+        Resets batch to its initial state (ie. empty programs containing a single dummy) in place, re-using already
+        allocated arrays so the same VectPrograms can be re-used from one epoch to the next.
+        A new free constants table is created (and should be sent to the relevant device) as Program objects exported
+        via get_prog keep references to the values of the previous one.
+        """
+        # ---------------------------- STEP COUNTER ----------------------------
+        self.curr_step = 0                                                  # int
+
+        # ---------------------------- PROGRAM MANAGEMENT ---------------------------- -> batch dim
+        self.n_lengths     .fill(0)                                         # (batch_size,) of int
+        self.n_dummies     .fill(0)                                         # (batch_size,) of int
+        self.total_arities .fill(0)                                         # (batch_size,) of int
+        self.is_complete   .fill(False)                                     # (batch_size,) of bool
+
+        # ---------------------------- TOKEN MANAGEMENT ---------------------------- -> time dim
+        self.n_dummies_history .fill(0)                                     # (batch_size, max_time_step,) of int
+        self.tokens.reset()                                                 # (batch_size, max_time_step,)
+        for counter in self.ancestors_counters:
+            counter.fill(0)                                                 # (batch_size, max_time_step,) of int
+
+        # ---------------------------- UNITS RELATED MANAGEMENT ----------------------------
+        self.is_physical          .fill(True)                                                 # (batch_size,) of bool
+        self.units_analysis_cases .fill(phy.UNITS_ANALYSIS_NOT_PERFORMED_CASE_CODE)           # (batch_size, max_time_step,) of int
 
         # ---------------------------- INIT 0TH DUMMY ----------------------------
 
@@ -686,14 +753,28 @@ class VectPrograms:
         # ---------------------------- FREE CONSTANTS REGISTER ----------------------------
         self.free_consts = free_const.FreeConstantsTable(batch_size = self.batch_size, library =self.library)
 
-        # ---------------------------- EXECUTION RELATED ----------------------------
-        # Wrapper to apply to candidate programs when executing
-        if candidate_wrapper is None:
-            candidate_wrapper = DEFAULT_WRAPPER
-        self.candidate_wrapper = candidate_wrapper
-
         return None
 
+    def get_memory_usage (self):
+        """
+        Computes memory used by the arrays of the batch of programs (not counting the library which can be shared
+        between batches).
+        Returns
+        -------
+        memory_usage : dict of {str : int}
+            Number of bytes used by each array, tokens properties arrays are summed under "tokens" key and free
+            constants related arrays under "free_consts" key.
+        """
+        memory_usage = {}
+        for attr in ["n_lengths", "n_dummies", "total_arities", "is_complete", "n_dummies_history", "is_physical",
+                     "units_analysis_cases"]:
+            memory_usage[attr] = getattr(self, attr).nbytes
+        memory_usage["tokens"]      = sum(self.tokens.get_memory_usage().values())
+        memory_usage["ancestors_counters"] = sum([counter.nbytes for counter in self.ancestors_counters])
+        memory_usage["free_consts"] = (self.free_consts.values.element_size() * self.free_consts.values.nelement()
+                                       + self.free_consts.is_opti.nbytes + self.free_consts.opti_steps.nbytes)
+        return memory_usage
+
     def lib (self, attr):
         """
         Gives access to vectorized properties of tokens in library without having to use [0, :] (as batch_size = 1 in
@@ -790,8 +871,9 @@ class VectPrograms:
 
         # Legacy units (from dummies)
         units_from_dummies = self.tokens.phy_units [:, self.curr_step]                                  # (batch_size, UNITS_VECTOR_SIZE,) of float
-        # Units from new tokens
-        units_from_new_tokens = self.lib("phy_units") [new_tokens_idx]                                  # (batch_size, UNITS_VECTOR_SIZE,) of float
+        # Units from new tokens (in the same precision as units of tokens in programs for comparison)
+        units_from_new_tokens = self.lib("phy_units") [new_tokens_idx].astype(                          # (batch_size, UNITS_VECTOR_SIZE,) of float
+            self.tokens.phy_units.dtype, copy = False)
 
         # Do new tokens contain constraining units: mask
         mask_is_constraining_new_tokens = self.lib("is_constraining_phy_units") [new_tokens_idx]        # (batch_size,) of bool
@@ -799,7 +881,13 @@ class VectPrograms:
         mask_is_constraining_dummies    = self.tokens.is_constraining_phy_units[:, self.curr_step]      # (batch_size,) of bool
 
         # Are new tokens units equal to legacy units ie dummy units they are replacing: mask
-        mask_units_unequal = np.logical_not((units_from_dummies == units_from_new_tokens).all(axis=1))  # (batch_size,) of bool
+        # (compared on the integer units lattice, exact float comparison for units that are not representable on it)
+        mask_units_unequal = np.logical_not(phy.units_keys_equal(                                       # (batch_size,) of bool
+            keys_a      = phy.units_to_key(units_from_dummies, is_constraining = mask_is_constraining_dummies),
+            keys_b      = self.lib_phy_units_keys[new_tokens_idx],
+            phy_units_a = units_from_dummies,
+            phy_units_b = units_from_new_tokens,
+                                                                  ))
 
         # Are new token inconsistent with current units constraints: mask
         # (ie. new token has different units AND has constraints AND legacy dummy has constraints) (avoids NAN != NAN)
@@ -1036,6 +1124,10 @@ class VectPrograms:
         # Copy ancestor register from parents
         self.tokens.ancestors_pos[tuple(coords_new_dummies)] = self.tokens.ancestors_pos[tuple(coords_new_dummies_parents)]
         self.register_ancestor(coords_new_dummies)
+        # Ancestors counters of new dummies = counters of parents + is parent in set
+        parents_idx = self.tokens.idx[tuple(coords_new_dummies_parents)]                      # (n_new_dummies_total,) of int
+        for is_in_set, counter in zip(self.ancestors_counters_sets, self.ancestors_counters):
+            counter[tuple(coords_new_dummies)] = counter[tuple(coords_new_dummies_parents)] + is_in_set[parents_idx]
 
         # --------------------------------------------------------------------------------------------------------------
         # --------------------------------- COMPLETING WITH DUMMIES : INFORMING PARENT ---------------------------------
@@ -1094,6 +1186,28 @@ class VectPrograms:
         # Update units requirements of all free dummies in case there is new information available and update units
         # requirement of dummy representing next token to guess.
         # This responsibility is transferred to the user of append who can use the assign_required_units method.
+
+        # --------------------------------------------------------------------------------------------------------------
+        # ----------------------------------------------- APPEND HOOKS -------------------------------------------------
+        # --------------------------------------------------------------------------------------------------------------
+        # Informing registered hooks (eg. priors maintaining running statistics) that new tokens were appended.
+        for hook in self.append_hooks:
+            hook(self.curr_step - 1)
+        return None
+
+    def register_append_hook (self, hook):
+        """
+        Registers a function to call at the end of each append. This allows users of programs (eg. priors) to maintain
+        running statistics updated only with newly appended tokens instead of recomputing them from the whole programs
+        at each step.
+        Parameters
+        ----------
+        hook : callable
+            Called as hook(step) at the end of append, step being the time step at which new tokens were appended
+            (new tokens idx are in self.tokens.idx[:, step], new tokens of complete programs being void tokens).
+        """
+        assert callable(hook), "Argument hook should be callable."
+        self.append_hooks.append(hook)
         return None
 
     def set_programs (self, tokens_idx, forbid_inconsistent_units = False):
@@ -1308,7 +1422,10 @@ class VectPrograms:
             2th array in time dim (2nd ancestor)...
             Use max_time_step[:,[0,1]] to access 1st ancestor, max_time_step[:,[0,2]] for 2nd ancestor etc.
         """
-        ancestors_pos = self.tokens.ancestors_pos[tuple(coords)]  # (?, max_time_step,) of int
+        if self.store_ancestors_pos:
+            ancestors_pos = self.tokens.ancestors_pos[tuple(coords)]  # (?, max_time_step,) of int
+        else:
+            ancestors_pos = self.compute_ancestors_pos(coords)        # (?, max_time_step,) of int
 
         ancestors_coords = np.concatenate((                                      # (1 + max_time_step, ?) of int
             coords[0][:, np.newaxis],   # same batch coords   # batch dim coord  # (?, 1) of int
@@ -1316,6 +1433,114 @@ class VectPrograms:
             ), axis=1).transpose()
         return ancestors_coords
 
+    def compute_ancestors_pos (self, coords):
+        """
+        Computes ancestors positions (in the same format as tokens.ancestors_pos) of tokens at coords by walking up
+        their parent chain. Used when dense ancestors records are not stored (store_ancestors_pos = False).
+        Parameters
+        ----------
+        coords : numpy.array of shape (2, ?) of int
+            Coords of tokens, 0th array in batch dim and 1th array in time dim.
+        Returns
+        -------
+        ancestors_pos : numpy.array of shape (?, max_time_step) of int
+            Ancestors positions of tokens counting the token itself as its own ancestor, each ancestor being located
+            at its own depth in the family line and padded with Tok.INVALID_POS.
+        """
+        n_tokens = coords.shape[1]
+        # Result
+        ancestors_pos = np.full((n_tokens, self.max_time_step), Tok.INVALID_POS, dtype=self.tokens.int_dtype)  # (?, max_time_step) of int
+        # Only tokens having ancestors (ie. valid tokens)
+        has_ancestors = self.tokens.has_ancestors_mask[tuple(coords)]                                          # (?,) of bool
+        line      = np.arange(n_tokens)[has_ancestors]                                                         # (?0,) of int
+        batch_pos = coords[0][has_ancestors]                                                                   # (?0,) of int
+        curr_pos  = coords[1][has_ancestors]                                                                   # (?0,) of int
+        depth     = self.tokens.depth[batch_pos, curr_pos]                                                     # (?0,) of int
+        # Walking up family lines, registering each ancestor at its own depth
+        while line.size > 0:
+            ancestors_pos[line, depth] = curr_pos
+            # Continuing only for tokens that are not at the root of the tree
+            not_root  = depth > 0
+            line      = line      [not_root]
+            batch_pos = batch_pos [not_root]
+            curr_pos  = self.tokens.parent_pos[batch_pos, curr_pos[not_root]]
+            depth     = depth     [not_root] - 1
+        return ancestors_pos
+
+    # -------- ANCESTORS COUNTERS --------
+    # Used for priors regulating nesting
+
+    def register_ancestors_counter (self, tokens_idx):
+        """
+        Registers a running counter of the number of ancestors of each token belonging to the set of tokens
+        tokens_idx. The counter is maintained as tokens are appended (a new dummy inherits the count of its parent),
+        so the number of ancestors belonging to the set can then be accessed in O(1) per token without going through
+        family lines (see get_n_ancestors_in_set). If the same set was already registered, its counter is re-used.
+        Parameters
+        ----------
+        tokens_idx : numpy.array of shape (?,) of int
+            Idx in the library of tokens making up the set.
+        Returns
+        -------
+        key : int
+            Key of the counter to use with get_n_ancestors_in_set.
+        """
+        # Is token in set : mask
+        is_in_set = np.full(self.n_library, False)                                                  # (n_library,) of bool
+        is_in_set[np.array(tokens_idx, dtype=int)] = True
+        # Re-using counter if this set was already registered
+        for key, registered_is_in_set in enumerate(self.ancestors_counters_sets):
+            if np.array_equal(registered_is_in_set, is_in_set):
+                return key
+        # Initializing counter from current state of programs (counting only strict ancestors)
+        counter = np.zeros(self.shape, dtype=self.tokens.int_dtype)                                 # (batch_size, max_time_step,) of int
+        n_tokens, coords = self.mask_to_coords(self.tokens.has_ancestors_mask)                      # int, (2, n_tokens) of int
+        if n_tokens > 0:
+            ancestors_idx = self.get_ancestors_idx(coords, no_ancestor_idx_filler = self.invalid_idx)  # (n_tokens, max_time_step) of int
+            counter[tuple(coords)] = is_in_set[ancestors_idx].sum(axis=1) - is_in_set[self.tokens.idx[tuple(coords)]]
+        self.ancestors_counters_sets .append(is_in_set)
+        self.ancestors_counters      .append(counter)
+        key = len(self.ancestors_counters) - 1
+        return key
+
+    def get_n_ancestors_in_set (self, key, coords):
+        """
+        Get number of ancestors (counting the token itself as its own ancestor) of tokens at coords belonging to the
+        set of tokens registered under key (see register_ancestors_counter).
+        Parameters
+        ----------
+        key : int
+            Key of the set of tokens returned by register_ancestors_counter.
+        coords : numpy.array of shape (2, ?) of int
+            Coords of tokens, 0th array in batch dim and 1th array in time dim.
+        Returns
+        -------
+        n_ancestors_in_set : numpy.array of shape (?,) of int
+        """
+        is_in_set = self.ancestors_counters_sets [key]                                              # (n_library,) of bool
+        counter   = self.ancestors_counters      [key]                                              # (batch_size, max_time_step,) of int
+        n_ancestors_in_set = counter[tuple(coords)] + is_in_set[self.tokens.idx[tuple(coords)]]     # (?,) of int
+        return n_ancestors_in_set
+
+    def get_n_ancestors_in_set_of_step (self, key, step = None):
+        """
+        Get number of ancestors of tokens at step belonging to the set of tokens registered under key (see
+        get_n_ancestors_in_set).
+        Parameters
+        ----------
+        key : int
+            Key of the set of tokens returned by register_ancestors_counter.
+        step : int
+            Step of tokens. By default, step = current step
+        Returns
+        -------
+        n_ancestors_in_set : numpy.array of shape (batch_size,) of int
+        """
+        if step is None:
+            step = self.curr_step
+        coords = self.coords_of_step(step)                                                          # (2, batch_size) of int
+        return self.get_n_ancestors_in_set(key = key, coords = coords)
+
     # -------- GET POSITIONAL INFO : FAMILY RELATIVES IDX --------
     # Used for symbolic Regression RNN state update
 
@@ -1692,20 +1917,22 @@ class VectPrograms:
         # ? = number of tokens which need their ancestor to be updated
         n_tokens = coords_dest.shape[1]
 
-        # Records of ancestors positions for token at coords_dest (ie vectors of size ? of family lines)
-        records_ancestors_pos = self.tokens.ancestors_pos[tuple(coords_dest)]  # (?, max_time_step) of int
-
-        # Coords of locations in records_ancestors_pos where the new ancestors should be placed. Since we are
-        # registering token as their own ancestors, this is performed at their own depth in the family line.
-        coords_new_ancestors = np.stack((  # (2, ?,) of int
-            np.arange(n_tokens),
-            # token dim coord (always = [1,2,3..] because records_ancestors_pos is already the subset of interest)
-            self.tokens.depth[tuple(coords_dest)],  # ancestor line dim coord ie own depth of tokens to affect
-        ), axis=0)
+        # Dense ancestors records (if stored)
+        if self.store_ancestors_pos:
+            # Records of ancestors positions for token at coords_dest (ie vectors of size ? of family lines)
+            records_ancestors_pos = self.tokens.ancestors_pos[tuple(coords_dest)]  # (?, max_time_step) of int
+
+            # Coords of locations in records_ancestors_pos where the new ancestors should be placed. Since we are
+            # registering token as their own ancestors, this is performed at their own depth in the family line.
+            coords_new_ancestors = np.stack((  # (2, ?,) of int
+                np.arange(n_tokens),
+                # token dim coord (always = [1,2,3..] because records_ancestors_pos is already the subset of interest)
+                self.tokens.depth[tuple(coords_dest)],  # ancestor line dim coord ie own depth of tokens to affect
+            ), axis=0)
 
-        # Registering tokens as their own ancestors ie. adding own token positions (time dim) in their records
-        records_ancestors_pos[tuple(coords_new_ancestors)] = coords_dest[1]
-        self.tokens.ancestors_pos[tuple(coords_dest)] = records_ancestors_pos
+            # Registering tokens as their own ancestors ie. adding own token positions (time dim) in their records
+            records_ancestors_pos[tuple(coords_new_ancestors)] = coords_dest[1]
+            self.tokens.ancestors_pos[tuple(coords_dest)] = records_ancestors_pos
 
         # Update number of ancestors
         self.tokens.n_ancestors[tuple(coords_dest)] = self.tokens.depth[tuple(coords_dest)] + 1
@@ -1844,6 +2071,9 @@ class VectPrograms:
         self.tokens.n_siblings                [tuple(coords_dest)] = self.tokens.n_siblings                [tuple(coords_src)]
         self.tokens.n_children                [tuple(coords_dest)] = self.tokens.n_children                [tuple(coords_src)]
         self.tokens.n_ancestors               [tuple(coords_dest)] = self.tokens.n_ancestors               [tuple(coords_src)]
+        # Ancestors counters
+        for counter in self.ancestors_counters:
+            counter                           [tuple(coords_dest)] = counter                           [tuple(coords_src)]
 
         # ----------------------------------------------------------------
         # -------------------- UPDATING RELATIONSHIPS --------------------
@@ -1993,6 +2223,9 @@ class VectPrograms:
         self.tokens.n_siblings                [tuple(coords_dest)] = 0                  # (?,) of int
         self.tokens.n_children                [tuple(coords_dest)] = 0                  # (?,) of int
         self.tokens.n_ancestors               [tuple(coords_dest)] = 0                  # (?,) of int
+        # Ancestors counters
+        for counter in self.ancestors_counters:
+            counter                           [tuple(coords_dest)] = 0                  # (?,) of int
 
         return None
 
@@ -54,6 +54,7 @@ def RewardsComputer(programs,
                     parallel_mode = False,
                     n_cpus = None,
                     progress_bar = False,
+                    mask = None,
                     ):
     """
     Computes rewards of programs on X data accordingly with target y_target and reward reward_function using torch
@@ -80,6 +81,9 @@ def RewardsComputer(programs,
     keep_lowest_complexity_duplicate : bool
         If True, when eliminating duplicates (via zero_out_duplicates = True), the least complex duplicate is kept, else
         a random duplicate is kept.
+    mask : numpy.array of shape (?,) of bool or None
+        Programs to evaluate, other programs are given a zero reward without being executed (or having their free
+        constants optimized). By default, None, all programs are evaluated.
     Returns
     -------
     rewards : numpy.array of shape (?,) of float
@@ -91,6 +95,9 @@ def RewardsComputer(programs,
     # mask : should program reward NOT be zeroed out ie. is program invalid ?
     # By default all programs are considered valid
     mask_valid = np.full(shape=programs.batch_size, fill_value=True, dtype=bool)                         # (batch_size,)
+    # Only evaluating programs of mask
+    if mask is not None:
+        mask_valid = (mask_valid & mask)                                                                 # (batch_size,)
 
     # ----- PHYSICALITY -----
     if zero_out_unphysical:
@@ -217,8 +224,9 @@ def make_RewardsComputer(reward_function     = SquashedNRMSE,
     -------
     rewards_computer : callable
          Custom reward computing function taking programs (program.VectPrograms), X (torch.tensor of shape (n_dim,?,)
-         of float), y_target (torch.tensor of shape (?,) of float), free_const_opti_args as key arguments and returning reward for each
-         program (array_like of float).
+         of float), y_target (torch.tensor of shape (?,) of float), free_const_opti_args and optionally mask (programs
+         to evaluate, see RewardsComputer) as key arguments and returning reward for each program (array_like of
+         float).
     """
     # Check that parallel execution is available on this system
     recommended_config = exec.ParallelExeAvailability()
@@ -230,11 +238,12 @@ def make_RewardsComputer(reward_function     = SquashedNRMSE,
         parallel_mode = False
 
     # rewards_computer
-    def rewards_computer(programs, X, y_target, free_const_opti_args):
+    def rewards_computer(programs, X, y_target, free_const_opti_args, mask = None):
         R = RewardsComputer(programs = programs,
                             X        = X,
                             y_target = y_target,
                             free_const_opti_args = free_const_opti_args,
+                            mask     = mask,
                             # Frozen args
                             reward_function     = reward_function,
                             zero_out_unphysical = zero_out_unphysical,
@@ -10,6 +10,8 @@ from physo.physym.functions import data_conversion
 from physo.physym import library
 from physo.physym import reward
 from physo.physym import prior
+from physo.physym import token
+from physo.learn import rnn
 
 class BatchTest(unittest.TestCase):
 
@@ -537,5 +539,408 @@ class BatchTest(unittest.TestCase):
               "%i/%i candidates with R > 0 and %i/%i with R = 1 +/- %f)"%(
                 (t1-t0)*1e3, n_kept, batch_size, n_solutions, batch_size, eps))
 
+    def test_reset(self):
+
+        # ------- TEST CASE -------
+        DEVICE = 'cpu'
+        if torch.cuda.is_available():
+            DEVICE = 'cuda'
+
+        # --- DATA ---
+        N = int(1e3)
+        x_array = np.linspace(0.04, 4, N)
+        x = data_conversion (x_array).to(DEVICE)
+        X = torch.stack((x,), axis=0)
+        pi = data_conversion (np.pi).to(DEVICE)
+        const1 = data_conversion (1.).to(DEVICE)
+        T = 1.028
+        v0 = 0.995
+        y_target = data_conversion(x_array/T + v0).to(DEVICE)
+
+        # --- LIBRARY CONFIG ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "div"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                        # constants
+                        "constants"            : {"pi" : pi        , "const1" : const1    },
+                        "constants_units"      : {"pi" : [0, 0, 0] , "const1" : [0, 0, 0] },
+                        "constants_complexity" : {"pi" : 0.        , "const1" : 1.        },
+                        # free constants
+                        "free_constants"            : {"T"              , "v0"              ,},
+                        "free_constants_init_val"   : {"T" : 1.         , "v0" : 1.         ,},
+                        "free_constants_units"      : {"T" : [0, 1, 0] , "v0" : [1, -1, 0] ,},
+                        "free_constants_complexity" : {"T" : 0.         , "v0" : 0.         ,},
+                            }
+        library_args = {"args_make_tokens"  : args_make_tokens,
+                        "superparent_units" : [1, -1, 0],
+                        "superparent_name"  : "v",
+                        }
+
+        # --- PRIORS ---
+        priors_config  = [ ("UniformArityPrior", None),
+                           ("HardLengthPrior", {"min_length": 1,
+                                               "max_length": 5, }),
+                           ("PhysicalUnitsPrior", {"prob_eps": np.finfo(np.float32).eps})]
+
+        # --- BATCH ---
+        batch_size    = 1000
+        max_time_step = 10
+
+        def make_batch():
+            return batch.Batch(library_args     = library_args,
+                               priors_config    = priors_config,
+                               batch_size       = batch_size,
+                               max_time_step    = max_time_step,
+                               rewards_computer = reward.make_RewardsComputer (reward_function     = reward.SquashedNRMSE,
+                                                                               zero_out_unphysical = True),
+                               X        = X,
+                               y_target = y_target,
+                               )
+        my_batch  = make_batch()
+        ref_batch = make_batch()
+
+        def run_epoch (batches):
+            for step in range(max_time_step):
+                priors = [b.prior() for b in batches]
+                obs    = [b.get_obs()[:, :3*b.n_choices+1] for b in batches]
+                # Same priors and deterministic part of observations for all batches
+                for i in range (1, len(batches)):
+                    np.testing.assert_array_equal(priors[i], priors[0])
+                    np.testing.assert_array_equal(obs   [i], obs   [0])
+                probs   = torch.tensor(np.random.rand(batch_size, batches[0].n_choices).astype(np.float32))
+                actions = torch.multinomial(probs * torch.tensor(priors[0].astype(np.float32)), num_samples=1)[:, 0]
+                actions = actions.numpy()
+                for b in batches:
+                    b.programs.append(actions)
+            return None
+
+        # --- FIRST EPOCH ON RE-USED BATCH ---
+        run_epoch(batches = [my_batch,])
+        my_batch.get_rewards()
+        # Exported program (eg. for hall of fame)
+        prog = my_batch.programs.get_prog(0)
+        prog_const_values = prog.free_const_values.clone()
+
+        # --- RESET ---
+        t0 = time.perf_counter()
+        my_batch.reset()
+        t1 = time.perf_counter()
+        print("Batch reset time = %f ms"%((t1-t0)*1e3))
+
+        # Exported program must not be affected by reset
+        self.assertTrue(torch.equal(prog.free_const_values, prog_const_values))
+        # Same state as a brand new batch
+        for attr in ["n_lengths", "n_dummies", "total_arities", "is_complete", "n_dummies_history", "is_physical",
+                     "units_analysis_cases"]:
+            np.testing.assert_array_equal(getattr(my_batch.programs, attr), getattr(ref_batch.programs, attr))
+        for attr in ["idx", "arity", "complexity", "var_type", "var_id", "behavior_id", "is_power", "power",
+                     "is_constraining_phy_units", "phy_units", "pos", "pos_batch", "depth", "has_parent_mask",
+                     "has_siblings_mask", "has_children_mask", "has_ancestors_mask", "parent_pos", "siblings_pos",
+                     "children_pos", "ancestors_pos", "n_siblings", "n_children", "n_ancestors"]:
+            np.testing.assert_array_equal(getattr(my_batch.programs.tokens, attr),
+                                          getattr(ref_batch.programs.tokens, attr))
+        self.assertEqual(my_batch.programs.curr_step, 0)
+        self.assertTrue(torch.equal(my_batch.programs.free_consts.values, ref_batch.programs.free_consts.values))
+
+        # --- SECOND EPOCH : RE-USED BATCH VS NEW BATCH ---
+        run_epoch(batches = [my_batch, ref_batch])
+        np.testing.assert_array_equal(my_batch.programs.tokens.idx,          ref_batch.programs.tokens.idx)
+        np.testing.assert_array_equal(my_batch.programs.tokens.phy_units,    ref_batch.programs.tokens.phy_units)
+        np.testing.assert_array_equal(my_batch.programs.is_physical,         ref_batch.programs.is_physical)
+        return None
+
+    def test_compact_dtypes(self):
+
+        # ------- TEST CASE -------
+        DEVICE = 'cpu'
+        if torch.cuda.is_available():
+            DEVICE = 'cuda'
+
+        # --- DATA ---
+        N = int(1e3)
+        x_array = np.linspace(0.04, 4, N)
+        x = data_conversion (x_array).to(DEVICE)
+        X = torch.stack((x,), axis=0)
+        pi = data_conversion (np.pi).to(DEVICE)
+        const1 = data_conversion (1.).to(DEVICE)
+        T = 1.028
+        v0 = 0.995
+        y_target = data_conversion(x_array/T + v0).to(DEVICE)
+
+        # --- LIBRARY CONFIG ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                        # constants
+                        "constants"            : {"pi" : pi        , "const1" : const1    },
+                        "constants_units"      : {"pi" : [0, 0, 0] , "const1" : [0, 0, 0] },
+                        "constants_complexity" : {"pi" : 0.        , "const1" : 1.        },
+                        # free constants
+                        "free_constants"            : {"T"              , "v0"              ,},
+                        "free_constants_init_val"   : {"T" : 1.         , "v0" : 1.         ,},
+                        "free_constants_units"      : {"T" : [0, 1, 0] , "v0" : [1, -1, 0] ,},
+                        "free_constants_complexity" : {"T" : 0.         , "v0" : 0.         ,},
+                            }
+        library_args = {"args_make_tokens"  : args_make_tokens,
+                        "superparent_units" : [1, -1, 0],
+                        "superparent_name"  : "v",
+                        }
+
+        # --- PRIORS ---
+        priors_config  = [ ("UniformArityPrior", None),
+                           ("HardLengthPrior", {"min_length": 1,
+                                               "max_length": 15, }),
+                           ("PhysicalUnitsPrior", {"prob_eps": np.finfo(np.float32).eps}),
+                           ("NestedTrigonometryPrior", {"max_nesting" : 1}),]
+
+        # --- BATCH ---
+        batch_size    = 1000
+        max_time_step = 20
+
+        def make_batch(compact_dtypes):
+            return batch.Batch(library_args     = library_args,
+                               priors_config    = priors_config,
+                               batch_size       = batch_size,
+                               max_time_step    = max_time_step,
+                               rewards_computer = reward.make_RewardsComputer (reward_function     = reward.SquashedNRMSE,
+                                                                               zero_out_unphysical = True),
+                               X        = X,
+                               y_target = y_target,
+                               compact_dtypes = compact_dtypes,
+                               )
+        compact_batch = make_batch(compact_dtypes = True)
+        ref_batch     = make_batch(compact_dtypes = False)
+
+        # --- DTYPES ---
+        self.assertEqual(compact_batch.programs.tokens.ancestors_pos.dtype , np.int32  )
+        self.assertEqual(compact_batch.programs.tokens.arity.dtype         , np.int8   )
+        self.assertEqual(compact_batch.programs.tokens.phy_units.dtype     , np.float32)
+        self.assertEqual(ref_batch    .programs.tokens.ancestors_pos.dtype , np.int64  )
+
+        # --- MEMORY ---
+        compact_memory = sum(compact_batch.get_memory_usage().values())
+        ref_memory     = sum(ref_batch    .get_memory_usage().values())
+        print(compact_batch.memory_report())
+        print(ref_batch    .memory_report())
+        self.assertTrue(compact_memory < 0.6*ref_memory)
+
+        # --- EPOCH : COMPACT BATCH VS REFERENCE BATCH ---
+        for step in range(max_time_step):
+            compact_prior = compact_batch.prior()
+            ref_prior     = ref_batch    .prior()
+            np.testing.assert_array_equal(compact_prior, ref_prior)
+            np.testing.assert_array_equal(compact_batch.get_obs()[:, :3*ref_batch.n_choices+1],
+                                          ref_batch    .get_obs()[:, :3*ref_batch.n_choices+1])
+            probs   = torch.tensor(np.random.rand(batch_size, ref_batch.n_choices).astype(np.float32))
+            actions = torch.multinomial(probs * torch.tensor(ref_prior.astype(np.float32)), num_samples=1)[:, 0]
+            actions = actions.numpy()
+            compact_batch.programs.append(actions)
+            ref_batch    .programs.append(actions)
+        np.testing.assert_array_equal(compact_batch.programs.tokens.idx     , ref_batch.programs.tokens.idx     )
+        np.testing.assert_array_equal(compact_batch.programs.n_lengths      , ref_batch.programs.n_lengths      )
+        np.testing.assert_array_equal(compact_batch.programs.is_physical    , ref_batch.programs.is_physical    )
+        np.testing.assert_array_equal(compact_batch.programs.tokens.ancestors_pos, ref_batch.programs.tokens.ancestors_pos)
+        np.testing.assert_allclose   (compact_batch.get_rewards()           , ref_batch.get_rewards(), rtol=1e-5)
+        return None
+
+    def test_active_rows(self):
+
+        # ------- TEST CASE -------
+        DEVICE = 'cpu'
+        if torch.cuda.is_available():
+            DEVICE = 'cuda'
+
+        # --- DATA ---
+        N = int(1e3)
+        x_array = np.linspace(0.04, 4, N)
+        x = data_conversion (x_array).to(DEVICE)
+        X = torch.stack((x,), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995).to(DEVICE)
+
+        # --- LIBRARY CONFIG ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                        # free constants
+                        "free_constants"            : {"T"              , "v0"              ,},
+                        "free_constants_init_val"   : {"T" : 1.         , "v0" : 1.         ,},
+                        "free_constants_units"      : {"T" : [0, 1, 0] , "v0" : [1, -1, 0] ,},
+                        "free_constants_complexity" : {"T" : 0.         , "v0" : 0.         ,},
+                            }
+        library_args = {"args_make_tokens"  : args_make_tokens,
+                        "superparent_units" : [1, -1, 0],
+                        "superparent_name"  : "v",
+                        }
+
+        # --- PRIORS ---
+        priors_config  = [ ("UniformArityPrior", None),
+                           ("HardLengthPrior", {"min_length": 1,
+                                               "max_length": 12, }),
+                           ("NoUselessInversePrior", None),
+                           ("PhysicalUnitsPrior", {"prob_eps": np.finfo(np.float32).eps}),
+                           ("NestedTrigonometryPrior", {"max_nesting" : 1}),
+                           ("OccurrencesPrior", {"targets" : ["x",], "max" : [3,]}),]
+
+        # --- BATCH ---
+        batch_size    = 500
+        max_time_step = 15
+        my_batch = batch.Batch(library_args     = library_args,
+                               priors_config    = priors_config,
+                               batch_size       = batch_size,
+                               max_time_step    = max_time_step,
+                               rewards_computer = reward.make_RewardsComputer (reward_function     = reward.SquashedNRMSE,
+                                                                               zero_out_unphysical = True),
+                               X        = X,
+                               y_target = y_target,
+                               )
+        n_choices = my_batch.n_choices
+
+        # --- EPOCH : PER STEP WORK ON ACTIVE ROWS VS WHOLE BATCH ---
+        for step in range(max_time_step):
+            rows = my_batch.get_active_rows()
+            self.assertTrue(np.array_equal(rows, np.flatnonzero(~my_batch.programs.is_complete)))
+            # Priors
+            prior     = my_batch.prior()
+            log_prior = my_batch.prior.get_log_prior().numpy()
+            with np.errstate(divide="ignore"):
+                expected_log_prior = np.log(prior[rows].astype(np.float32))
+            np.testing.assert_allclose(log_prior[rows], expected_log_prior, rtol=1e-6)
+            # Observations (ignoring random units filler)
+            obs_all  = my_batch.get_obs()
+            obs_rows = my_batch.get_obs(rows = rows)
+            np.testing.assert_array_equal(obs_rows[rows, :3*n_choices+1], obs_all[rows, :3*n_choices+1])
+            is_complete = my_batch.programs.is_complete
+            self.assertTrue((obs_rows[is_complete] == 0).all())
+            # Observations in preallocated torch buffer (same as numpy observations except for filler noise)
+            obs_tensor = my_batch.get_obs_tensor(rows = rows).numpy()
+            self.assertEqual(obs_tensor.shape, (batch_size, my_batch.obs_size))
+            self.assertTrue((obs_tensor[is_complete] == 0).all())
+            np.testing.assert_array_equal(obs_tensor[rows, :3*n_choices+1], obs_all[rows, :3*n_choices+1])
+            units_tensor = obs_tensor[rows, 3*n_choices+1:].reshape(len(rows), 4, token.UNITS_VECTOR_SIZE + 1)
+            units_all    = obs_all   [rows, 3*n_choices+1:].reshape(len(rows), 4, token.UNITS_VECTOR_SIZE + 1)
+            is_available = units_all[:, :, -1] == batch.INTERFACE_UNITS_AVAILABLE
+            np.testing.assert_array_equal(units_tensor[:, :, -1], units_all[:, :, -1])
+            np.testing.assert_array_equal(units_tensor[is_available], units_all[is_available])
+            self.assertTrue((np.abs(units_tensor[~is_available][:, :-1]) <= 4.).all())
+            # Actions
+            probs   = torch.tensor(np.random.rand(batch_size, n_choices).astype(np.float32))
+            actions = torch.multinomial(probs * torch.tensor(prior.astype(np.float32)), num_samples=1)[:, 0]
+            my_batch.programs.append(actions.numpy())
+        self.assertTrue(my_batch.programs.is_complete.all())
+        return None
+
+    def test_obs_tokens_as_idx(self):
+
+        # ------- TEST CASE -------
+        DEVICE = 'cpu'
+        if torch.cuda.is_available():
+            DEVICE = 'cuda'
+
+        # --- DATA ---
+        N = int(1e3)
+        x_array = np.linspace(0.04, 4, N)
+        x = data_conversion (x_array).to(DEVICE)
+        X = torch.stack((x,), axis=0)
+        y_target = data_conversion(x_array/1.028 + 0.995).to(DEVICE)
+
+        # --- LIBRARY CONFIG ---
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                        # free constants
+                        "free_constants"            : {"T"              , "v0"              ,},
+                        "free_constants_init_val"   : {"T" : 1.         , "v0" : 1.         ,},
+                        "free_constants_units"      : {"T" : [0, 1, 0] , "v0" : [1, -1, 0] ,},
+                        "free_constants_complexity" : {"T" : 0.         , "v0" : 0.         ,},
+                            }
+        library_args = {"args_make_tokens"  : args_make_tokens,
+                        "superparent_units" : [1, -1, 0],
+                        "superparent_name"  : "v",
+                        }
+
+        # --- PRIORS ---
+        priors_config  = [ ("UniformArityPrior", None),
+                           ("HardLengthPrior", {"min_length": 1,
+                                               "max_length": 12, }),
+                           ("PhysicalUnitsPrior", {"prob_eps": np.finfo(np.float32).eps}),]
+
+        # --- BATCHES : ONE-HOTS VS IDX ---
+        batch_size    = 500
+        max_time_step = 15
+        batches = [batch.Batch(library_args      = library_args,
+                               priors_config     = priors_config,
+                               batch_size        = batch_size,
+                               max_time_step     = max_time_step,
+                               rewards_computer  = reward.make_RewardsComputer (reward_function     = reward.SquashedNRMSE,
+                                                                                zero_out_unphysical = True),
+                               X        = X,
+                               y_target = y_target,
+                               obs_tokens_as_idx = obs_tokens_as_idx,
+                               ) for obs_tokens_as_idx in (False, True)]
+        batch_one_hot, batch_idx = batches
+        n_choices = batch_idx.n_choices
+        n_units_obs = 1 + 4*(token.UNITS_VECTOR_SIZE+1)
+        self.assertEqual(batch_one_hot.obs_size, 3*n_choices + n_units_obs)
+        self.assertEqual(batch_idx    .obs_size, 3           + n_units_obs)
+
+        # --- CELL EMBEDDING TOKENS ---
+        cell = rnn.Cell(input_size            = batch_idx.obs_size,
+                        output_size           = n_choices,
+                        hidden_size           = 16,
+                        tokens_embedding_size = 8,)
+        states = cell.get_zeros_initial_state(batch_size)
+
+        # --- EPOCH ---
+        for step in range(max_time_step):
+            rows = batch_idx.get_active_rows()
+            obs_one_hot = batch_one_hot.get_obs()
+            obs_idx     = batch_idx.get_obs()
+            # Idx are consistent with one-hots (n_choices where one-hot is a zero vector)
+            one_hots = obs_one_hot[:, :3*n_choices].reshape(batch_size, 3, n_choices)
+            expected_idx = np.where(one_hots.sum(axis=2) == 1, one_hots.argmax(axis=2), n_choices)
+            np.testing.assert_array_equal(obs_idx[:, :3], expected_idx)
+            # Same dangling and available units as in one-hot mode
+            is_available = obs_idx[:, 4+token.UNITS_VECTOR_SIZE::token.UNITS_VECTOR_SIZE+1] == batch.INTERFACE_UNITS_AVAILABLE
+            np.testing.assert_array_equal(obs_idx[:, 3], obs_one_hot[:, 3*n_choices])
+            np.testing.assert_array_equal(is_available, obs_one_hot[:, 3*n_choices+1+token.UNITS_VECTOR_SIZE::token.UNITS_VECTOR_SIZE+1]
+                                                        == batch.INTERFACE_UNITS_AVAILABLE)
+            # Preallocated torch buffer
+            obs_tensor = batch_idx.get_obs_tensor(rows = rows)
+            np.testing.assert_array_equal(obs_tensor.numpy()[rows, :4], obs_idx[rows, :4])
+            # Cell
+            output, states = cell(input_tensor = obs_tensor, states = states)
+            self.assertEqual(tuple(output.shape), (batch_size, n_choices))
+            # Actions (priors of both batches are computed as units requirements are assigned by the units prior)
+            prior   = [b.prior() for b in batches][-1]
+            actions = torch.multinomial(torch.tensor(prior.astype(np.float32)), num_samples=1)[:, 0].numpy()
+            for b in batches:
+                b.programs.append(actions)
+            if batch_idx.programs.is_complete.all():
+                break
+        # Padding idx is embedded as zeros
+        for embedding in cell.tokens_embeddings:
+            self.assertTrue((embedding.weight[n_choices] == 0).all())
+        return None
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -110,6 +110,42 @@ def hard_test_case():
 
 class DimensionalAnalysisTest(unittest.TestCase):
 
+    def test_units_keys(self):
+        units = np.array([
+            [1. , -2. , 0., 0., 0., 0., 0.],
+            [0.5, -1. , 0., 0., 0., 0., 0.],
+            [1/3,  0. , 0., 0., 0., 0., 0.],
+            [(1/3)*(1/3)*9 - 1 + 1, -2 + 1e-9, 0., 0., 0., 0., 0.],   # float drift
+            [0.2,  0. , 0., 0., 0., 0., 0.],                            # not on lattice (1/5)
+            [50.,  0. , 0., 0., 0., 0., 0.],                            # out of lattice range
+            [np.nan]*7,                                                 # non-constraining
+        ])
+        keys = phy.units_to_key(units)
+        # Exact equality despite float drift
+        self.assertEqual(keys[0], keys[3])
+        self.assertTrue((keys[:4] >= 0).all())
+        self.assertEqual(len(np.unique(keys[:3])), 3)
+        # Special keys
+        self.assertEqual(keys[4], phy.UNITS_KEY_UNREPRESENTABLE)
+        self.assertEqual(keys[5], phy.UNITS_KEY_UNREPRESENTABLE)
+        self.assertEqual(keys[6], phy.UNITS_KEY_NON_CONSTRAINING)
+        # Explicit is_constraining
+        keys = phy.units_to_key(units[:2], is_constraining=np.array([True, False]))
+        self.assertEqual(keys[1], phy.UNITS_KEY_NON_CONSTRAINING)
+        # Round trip
+        units_lattice = np.array([[a/12, -b/12, 3., -4., 0., 21., -21.] for a in range(-20, 20) for b in range(5)])
+        keys = phy.units_to_key(units_lattice)
+        self.assertTrue(np.array_equal(phy.key_to_units(keys), units_lattice))
+        self.assertEqual(len(np.unique(keys)), len(units_lattice))
+        # Snapping
+        self.assertTrue(np.array_equal(phy.snap_units_to_lattice(units[3]), units[0]))
+        self.assertTrue(np.array_equal(phy.snap_units_to_lattice(units[4]), units[4]))
+        # Comparison with float fallback
+        keys = phy.units_to_key(units)
+        is_equal = phy.units_keys_equal(keys_a = keys[[0, 4, 4]], keys_b = keys[[3, 4, 1]],
+                                        phy_units_a = units[[0, 4, 4]], phy_units_b = units[[3, 4, 1]])
+        self.assertTrue(np.array_equal(is_equal, [True, True, False]))
+
     def test_assign_units_bottom_up(self):
         test_program_idx, my_lib, expected_tokens_cases_record, expected_phy_units, expected_is_constraining, \
             expected_phy_units_final, expected_is_constraining_final = hard_test_case()
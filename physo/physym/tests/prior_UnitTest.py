@@ -266,6 +266,16 @@ class PriorTest(unittest.TestCase):
             display = my_lib.lib_name[my_programs.tokens.idx]
             prior = my_prior()
 
+    def test_bitset(self):
+        rng = np.random.default_rng(42)
+        for n_bits in [1, 63, 64, 65, 200]:
+            mask = rng.random((7, n_bits)) > 0.5
+            bitset = Prior.pack_bitset(mask)
+            self.assertEqual(bitset.shape, (7, int(np.ceil(n_bits/64))))
+            self.assertEqual(bitset.dtype, np.uint64)
+            self.assertTrue(np.array_equal(Prior.unpack_bitset(bitset, n_bits=n_bits), mask))
+        return None
+
     def test_RelationshipConstraintPrior(self):
 
         # -------------------- LIB TEST CASE --------------------
@@ -1011,6 +1021,23 @@ class PriorTest(unittest.TestCase):
             bool_works = np.array_equal(found_forbidden_tokens, expected)
             self.assertEqual(bool_works, True)
 
+        # -------------------- TEST RUNNING COUNTS (APPEND HOOK) --------------------
+        # Counts maintained step by step should be the same as counts from scratch (including after a reset).
+        for _ in range(2):
+            my_programs.reset()
+            my_prior.reset()
+            for i in range(test_progs.shape[1]):
+                mask_prob = my_prior()
+                self.assertEqual(my_prior.counts_step, my_programs.curr_step)
+                expected_counts = np.equal.outer(my_programs.tokens.idx, my_prior.targets).sum(axis=1)
+                self.assertTrue(np.array_equal(my_prior.counts, expected_counts))
+                my_programs.append(test_progs[:, i])
+                self.assertEqual(my_prior.counts_step, my_programs.curr_step)
+        mask_prob = my_prior()
+        for i, mask_prob_i in enumerate(mask_prob):
+            found_forbidden_tokens = np.sort(my_lib.lib_name[:my_lib.n_choices][np.logical_not(mask_prob_i)]).astype(str)
+            self.assertTrue(np.array_equal(found_forbidden_tokens, np.sort(expected_forbidden_tokens[i]).astype(str)))
+
 
     def test_PhysicalUnitsPrior(self):
         # LIBRARY CONFIG
@@ -1110,6 +1137,20 @@ class PriorTest(unittest.TestCase):
              # my_programs.get_tree_image(prog_i, fpath="%i.png"%(i))
              my_programs.append(test_programs_idx[:,i])
 
+        # ------------------------- TEST MEMOIZED MASKS -------------------------
+        # Legality masks of distinct units requirements should be cached and re-used after reset (ie. new epoch)
+        n_cached = len(my_prior.units_legality_cache)
+        self.assertTrue(n_cached > 1)
+        my_programs.reset()
+        for i in range (test_programs_idx.shape[1]):
+            mask_prob = my_prior()
+            for prog_i in range(len(expected_allowed)):
+                prog_step_obs_allowed = my_lib.lib_name[:my_lib.n_choices][mask_prob.astype(bool)[prog_i]]
+                prog_step_exp_allowed = np.array(expected_allowed[prog_i][i])
+                self.assertTrue(np.array_equal(sorted(prog_step_exp_allowed), sorted(prog_step_obs_allowed)))
+            my_programs.append(test_programs_idx[:,i])
+        self.assertEqual(len(my_prior.units_legality_cache), n_cached)
+
         return None
 
     # Test prior collection using (UniformArityPrior, HardLengthPrior)
@@ -1215,9 +1256,24 @@ class PriorTest(unittest.TestCase):
         # ------- TEST PRIOR -------
         expected_prior_val = np.multiply(my_prior_HardLength(), my_prior_UniformArity())
 
+        # Static priors should be precomputed
+        self.assertEqual([prior.__class__.__name__ for prior in my_collection.static_priors], ["UniformArityPrior"])
+        self.assertEqual([prior.__class__.__name__ for prior in my_collection.dynamic_priors], ["HardLengthPrior"])
+
+        previous_log_prior = None
         for step in range (n_steps):
             works_bool = np.array_equal(expected_prior_val, my_collection())
             self.assertTrue(works_bool)
+            # Log prior (rows of complete programs keep their last distribution)
+            log_prior = my_collection.get_log_prior().numpy().copy()
+            is_active = ~my_programs.is_complete
+            with np.errstate(divide="ignore"):
+                expected_log_prior = np.log(expected_prior_val.astype(np.float32))
+            self.assertTrue(np.allclose(log_prior[is_active], expected_log_prior[is_active]))
+            self.assertTrue(np.array_equal(np.isinf(log_prior[is_active]), expected_prior_val[is_active] == 0))
+            if previous_log_prior is not None:
+                self.assertTrue(np.array_equal(log_prior[~is_active], previous_log_prior[~is_active]))
+            previous_log_prior = log_prior
             # NEXT STEP
             my_programs.append(test_case[:, step])
             expected_prior_val = np.multiply(my_prior_HardLength(), my_prior_UniformArity())
@@ -271,6 +271,52 @@ class VectProgramsTest(unittest.TestCase):
             self.assertTrue(works_bool)
         return None
 
+    def test_ancestors_counters_and_implicit_records(self):
+        # LIBRARY CONFIG
+        my_lib = make_lib()
+        # BATCH CONFIG
+        batch_size    = 1000
+        max_time_step = 64
+        # Random programs (only choosing terminal tokens when there is no room left for more dummies)
+        arities   = my_lib.get_choosable_prop("arity")
+        terminals = np.arange(my_lib.n_choices)[arities == 0]
+        progs_dense    = Prog.VectPrograms(batch_size=batch_size, max_time_step=max_time_step, library=my_lib)
+        progs_implicit = Prog.VectPrograms(batch_size=batch_size, max_time_step=max_time_step, library=my_lib,
+                                           store_ancestors_pos=False)
+        self.assertEqual(progs_implicit.tokens.ancestors_pos.size, 0)
+        # Sets of tokens (trigonometric functions registered twice to test re-use of counters)
+        set_trigo = np.array([my_lib.lib_name_to_idx[name] for name in ["cos", "sin", "tan"]])
+        set_exp   = np.array([my_lib.lib_name_to_idx[name] for name in ["exp", "log"]])
+        key_trigo   = progs_implicit.register_ancestors_counter(set_trigo)
+        key_trigo_2 = progs_implicit.register_ancestors_counter(set_trigo)
+        self.assertEqual(key_trigo, key_trigo_2)
+        for step in range(max_time_step - 1):
+            # Registering a counter mid-way (it must be initialized from the current state of programs)
+            if step == max_time_step // 4:
+                key_exp = progs_implicit.register_ancestors_counter(set_exp)
+            new_tokens = np.random.randint(0, my_lib.n_choices, batch_size)
+            no_room = (arities[new_tokens] + progs_dense.n_dummies + progs_dense.n_lengths) > max_time_step
+            new_tokens[no_room] = np.random.choice(terminals, no_room.sum())
+            progs_dense    .append(new_tokens)
+            progs_implicit .append(new_tokens)
+            # Ancestors of next token to guess (the one priors rely on)
+            ancestors_idx_dense    = progs_dense   .get_ancestors_idx_of_step(no_ancestor_idx_filler=my_lib.invalid_idx)
+            ancestors_idx_implicit = progs_implicit.get_ancestors_idx_of_step(no_ancestor_idx_filler=my_lib.invalid_idx)
+            self.assertTrue(np.array_equal(ancestors_idx_dense, ancestors_idx_implicit))
+            # Counters
+            expected_n_trigo = np.isin(ancestors_idx_dense, set_trigo).sum(axis=1)
+            self.assertTrue(np.array_equal(progs_implicit.get_n_ancestors_in_set_of_step(key_trigo), expected_n_trigo))
+            if step >= max_time_step // 4:
+                expected_n_exp = np.isin(ancestors_idx_dense, set_exp).sum(axis=1)
+                self.assertTrue(np.array_equal(progs_implicit.get_n_ancestors_in_set_of_step(key_exp), expected_n_exp))
+        # Implicit ancestors records of all tokens
+        coords = np.stack(np.meshgrid(np.arange(batch_size), np.arange(max_time_step), indexing="ij")).reshape(2, -1)
+        self.assertTrue(np.array_equal(progs_dense.get_ancestors(coords), progs_implicit.get_ancestors(coords)))
+        # Counters after reset
+        progs_implicit.reset()
+        self.assertTrue((progs_implicit.get_n_ancestors_in_set_of_step(key_trigo) == 0).all())
+        return None
+
     # Test program management regarding units (units tests are in dimensional_analysis_UnitTest.py)
     def test_units_related(self):
         # LIBRARY CONFIG
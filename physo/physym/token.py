@@ -30,6 +30,16 @@ INVALID_DEPTH = 9999999
 # Dummy tokens, n_lengths <= pos < (n_lengths + n_dangling)
 DUMMY_TOKEN_NAME = "dummy"
 
+# --------------------- COMPACT DTYPES OF VECTORIZED TOKENS ---------------------
+# Dtypes used by VectTokens when compact_dtypes = True.
+# Indices, positions and depths (must be able to hold INVALID_POS, INVALID_DEPTH, INVALID_VAR_ID and
+# DEFAULT_BEHAVIOR_ID)
+COMPACT_INT_DTYPE       = np.int32
+# Small bounded integers (arities, var types, numbers of siblings or children <= MAX_NB_CHILDREN)
+COMPACT_SMALL_INT_DTYPE = np.int8
+# Floats (complexities, powers, units)
+COMPACT_FLOAT_DTYPE     = np.float32
+
 class Token:
     """
         An object representing a unique mathematical symbol (non_positional & semi_positional), except idx (which
@@ -334,6 +344,7 @@ class VectTokens:
     ancestors_pos              : numpy.array of shape (shape[1],) of int`
         Ancestors positions in the program ie in time dim counting the token itself as itw own ancestor.
         (eg. [0, 1, 4, 5, INVALID_POS, INVALID_POS] for x1 in program = [mul, add, sin, x0, log, x1]).
+        Empty (shape (0,)) if store_ancestors_pos is False.
     n_siblings                : int
         Number of siblings.
     n_children                : int
@@ -342,7 +353,7 @@ class VectTokens:
         Number of ancestors. This is equal to depth+1 as the token itself counts as its own ancestor.
     """
 
-    def __init__(self, shape, invalid_token_idx):
+    def __init__(self, shape, invalid_token_idx, compact_dtypes = False, store_ancestors_pos = True):
         """
         Parameters
         ----------
@@ -350,9 +361,28 @@ class VectTokens:
             Shape of the matrix.
         invalid_token_idx : int
             Index of the invalid token in the library of tokens.
-
+        compact_dtypes : bool, optional
+            If True, properties are stored using compact dtypes (COMPACT_INT_DTYPE for indices, positions and depths,
+            COMPACT_SMALL_INT_DTYPE for small bounded integers and COMPACT_FLOAT_DTYPE for floats) instead of int64 and
+            float64 to reduce memory usage (False by default).
+        store_ancestors_pos : bool, optional
+            If True (default), stores the dense ancestors_pos record of shape (shape[0], shape[1], shape[1]). If False,
+            ancestors_pos is left empty (shape (shape[0], shape[1], 0)) as ancestors can be recovered from the parent
+            chain (see program.VectPrograms.get_ancestors), which avoids a memory footprint growing quadratically with
+            shape[1].
         """
 
+        # ---- Dtypes ----
+        self.compact_dtypes = compact_dtypes
+        if self.compact_dtypes:
+            self.int_dtype       = COMPACT_INT_DTYPE
+            self.small_int_dtype = COMPACT_SMALL_INT_DTYPE
+            self.float_dtype     = COMPACT_FLOAT_DTYPE
+        else:
+            self.int_dtype       = int
+            self.small_int_dtype = int
+            self.float_dtype     = float
+
         # -------------------------------------------------------------------------------------------------------
         # -------------------------------------- non_positional properties --------------------------------------
         # -------------------------------------------------------------------------------------------------------
@@ -366,7 +396,7 @@ class VectTokens:
         # Default value
         self.default_idx = self.invalid_token_idx
         # Property
-        self.idx = np.full(shape=self.shape, fill_value=self.default_idx, dtype=int )
+        self.idx = np.full(shape=self.shape, fill_value=self.default_idx, dtype=self.int_dtype )
 
         # -------------------------------------------------------------------------------------------------------
         # -------------------------------------- non_positional properties --------------------------------------
@@ -385,19 +415,19 @@ class VectTokens:
         self.default_var_type     = 0
         self.default_var_id       = INVALID_VAR_ID
         # Properties
-        self.arity        = np.full(shape=self.shape, fill_value=self.default_arity        , dtype=int)
-        self.complexity   = np.full(shape=self.shape, fill_value=self.default_complexity   , dtype=float)
-        self.var_type     = np.full(shape=self.shape, fill_value=self.default_var_type     , dtype=int)
+        self.arity        = np.full(shape=self.shape, fill_value=self.default_arity        , dtype=self.small_int_dtype)
+        self.complexity   = np.full(shape=self.shape, fill_value=self.default_complexity   , dtype=self.float_dtype)
+        self.var_type     = np.full(shape=self.shape, fill_value=self.default_var_type     , dtype=self.small_int_dtype)
         # ( function                :  callable or None )
         # ( init_val                :  float            )
-        self.var_id       = np.full(shape=self.shape, fill_value=self.default_var_id       , dtype=int)
+        self.var_id       = np.full(shape=self.shape, fill_value=self.default_var_id       , dtype=self.int_dtype)
         # ( fixed_const                :  float         )
 
         # ---- Physical units : behavior id ----
         # Default value
         self.default_behavior_id = DEFAULT_BEHAVIOR_ID
         # Property
-        self.behavior_id = np.full(shape=self.shape, fill_value=self.default_behavior_id, dtype=int)
+        self.behavior_id = np.full(shape=self.shape, fill_value=self.default_behavior_id, dtype=self.int_dtype)
 
         # ---- Physical units : power ----
         # Default values
@@ -405,7 +435,7 @@ class VectTokens:
         self.default_power    = np.NAN
         # Properties
         self.is_power = np.full(shape=self.shape, fill_value=self.default_is_power ,  dtype=bool)
-        self.power    = np.full(shape=self.shape, fill_value=self.default_power    ,  dtype=float)
+        self.power    = np.full(shape=self.shape, fill_value=self.default_power    ,  dtype=self.float_dtype)
 
         # -------------------------------------------------------------------------------------------------------
         # -------------------------------------- semi_positional properties --------------------------------------
@@ -417,7 +447,7 @@ class VectTokens:
         self.default_phy_units                 = np.NAN
         # Properties
         self.is_constraining_phy_units = np.full(shape=self.shape,                        fill_value=self.default_is_constraining_phy_units  ,  dtype=bool)
-        self.phy_units                 = np.full(shape=self.shape + (UNITS_VECTOR_SIZE,), fill_value=self.default_phy_units                  ,  dtype=float)
+        self.phy_units                 = np.full(shape=self.shape + (UNITS_VECTOR_SIZE,), fill_value=self.default_phy_units                  ,  dtype=self.float_dtype)
 
         # -------------------------------------------------------------------------------------------------------
         # ---------------------------------------- Positional properties ----------------------------------------
@@ -428,14 +458,14 @@ class VectTokens:
         self.default_pos       = INVALID_POS
         self.default_pos_batch = INVALID_POS
         # Properties : position is the same in all elements of batch
-        self.pos               = np.tile(np.arange(0, self.shape[1]), (self.shape[0], 1)).astype(int)
-        self.pos_batch         = np.tile(np.arange(0, self.shape[0]), (self.shape[1], 1)).transpose().astype(int)
+        self.pos               = np.tile(np.arange(0, self.shape[1]), (self.shape[0], 1)).astype(self.int_dtype)
+        self.pos_batch         = np.tile(np.arange(0, self.shape[0]), (self.shape[1], 1)).transpose().astype(self.int_dtype)
 
         # ---- Depth ----
         # Default value
         self.default_depth = INVALID_DEPTH
         # Property
-        self.depth = np.full(shape=self.shape, fill_value=self.default_depth, dtype=int )
+        self.depth = np.full(shape=self.shape, fill_value=self.default_depth, dtype=self.int_dtype )
 
         # ---- Family relationships ----
 
@@ -458,10 +488,12 @@ class VectTokens:
         self.default_children_pos  = INVALID_POS
         self.default_ancestors_pos = INVALID_POS
         # Properties
-        self.parent_pos         = np.full(shape=self.shape,                      fill_value=self.default_parent_pos   , dtype=int)
-        self.siblings_pos       = np.full(shape=self.shape + (MAX_NB_SIBLINGS,), fill_value=self.default_siblings_pos , dtype=int)
-        self.children_pos       = np.full(shape=self.shape + (MAX_NB_CHILDREN,), fill_value=self.default_children_pos , dtype=int)
-        self.ancestors_pos      = np.full(shape=self.shape + (self.shape[1], ),  fill_value=self.default_ancestors_pos, dtype=int)
+        self.parent_pos         = np.full(shape=self.shape,                      fill_value=self.default_parent_pos   , dtype=self.int_dtype)
+        self.siblings_pos       = np.full(shape=self.shape + (MAX_NB_SIBLINGS,), fill_value=self.default_siblings_pos , dtype=self.int_dtype)
+        self.children_pos       = np.full(shape=self.shape + (MAX_NB_CHILDREN,), fill_value=self.default_children_pos , dtype=self.int_dtype)
+        self.store_ancestors_pos = store_ancestors_pos
+        n_ancestors_record       = self.shape[1] if self.store_ancestors_pos else 0
+        self.ancestors_pos      = np.full(shape=self.shape + (n_ancestors_record, ), fill_value=self.default_ancestors_pos, dtype=self.int_dtype)
 
         # Token family relationships: numbers
         # Default values
@@ -469,6 +501,51 @@ class VectTokens:
         self.default_n_children  = 0
         self.default_n_ancestors = 0
         # Properties
-        self.n_siblings         = np.full(shape=self.shape,  fill_value=self.default_n_siblings , dtype=int)
-        self.n_children         = np.full(shape=self.shape,  fill_value=self.default_n_children , dtype=int)
-        self.n_ancestors        = np.full(shape=self.shape,  fill_value=self.default_n_ancestors, dtype=int)
+        self.n_siblings         = np.full(shape=self.shape,  fill_value=self.default_n_siblings , dtype=self.small_int_dtype)
+        self.n_children         = np.full(shape=self.shape,  fill_value=self.default_n_children , dtype=self.small_int_dtype)
+        self.n_ancestors        = np.full(shape=self.shape,  fill_value=self.default_n_ancestors, dtype=self.int_dtype)
+
+    def reset(self):
+        """
+        Resets all properties to their default values in place (re-using already allocated arrays).
+        Positions (pos, pos_batch) are static and are left untouched.
+        """
+        # ---- Index in library ----
+        self.idx                      .fill(self.default_idx)
+        # ---- Token main properties ----
+        self.arity                    .fill(self.default_arity)
+        self.complexity               .fill(self.default_complexity)
+        self.var_type                 .fill(self.default_var_type)
+        self.var_id                   .fill(self.default_var_id)
+        # ---- Physical units ----
+        self.behavior_id              .fill(self.default_behavior_id)
+        self.is_power                 .fill(self.default_is_power)
+        self.power                    .fill(self.default_power)
+        self.is_constraining_phy_units.fill(self.default_is_constraining_phy_units)
+        self.phy_units                .fill(self.default_phy_units)
+        # ---- Depth ----
+        self.depth                    .fill(self.default_depth)
+        # ---- Family relationships ----
+        self.has_parent_mask          .fill(self.default_has_parent_mask)
+        self.has_siblings_mask        .fill(self.default_has_siblings_mask)
+        self.has_children_mask        .fill(self.default_has_children_mask)
+        self.has_ancestors_mask       .fill(self.default_has_ancestors_mask)
+        self.parent_pos               .fill(self.default_parent_pos)
+        self.siblings_pos             .fill(self.default_siblings_pos)
+        self.children_pos             .fill(self.default_children_pos)
+        self.ancestors_pos            .fill(self.default_ancestors_pos)
+        self.n_siblings               .fill(self.default_n_siblings)
+        self.n_children               .fill(self.default_n_children)
+        self.n_ancestors              .fill(self.default_n_ancestors)
+        return None
+
+    def get_memory_usage(self):
+        """
+        Computes memory used by properties arrays.
+        Returns
+        -------
+        memory_usage : dict of {str : int}
+            Number of bytes used by each property array.
+        """
+        memory_usage = {attr : value.nbytes for attr, value in vars(self).items() if isinstance(value, np.ndarray)}
+        return memory_usage
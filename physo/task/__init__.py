@@ -2,4 +2,5 @@ from . import fit
 from . import sr
 from . import benchmark
 from . import optimize
+from . import islands
 
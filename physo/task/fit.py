@@ -1,11 +1,37 @@
 
+import torch
+
 # Internal imports
 from physo.physym import batch as Batch
+from physo.learn import surrogate as Surrogate
 from physo.learn import rnn
 from physo.learn import learn
 
 
-def fit(X, y, run_config, candidate_wrapper = None, stop_reward = 1., stop_after_n_epochs = 1, max_n_evaluations = None):
+def get_priors_config(priors_config, max_time_step):
+    """
+    Returns priors config adapted to batches having a max_time_step smaller than the configured one (max_length of
+    HardLengthPrior being clipped to max_time_step).
+    Parameters
+    ----------
+    priors_config : list of (str, dict or None)
+        Priors config.
+    max_time_step : int
+        Max time step of batch.
+    Returns
+    -------
+    priors_config : list of (str, dict or None)
+        Adapted priors config.
+    """
+    adapted_priors_config = []
+    for name, args in priors_config:
+        if name == "HardLengthPrior" and args["max_length"] > max_time_step:
+            args = dict(args, max_length = max_time_step)
+        adapted_priors_config.append((name, args))
+    return adapted_priors_config
+
+def fit(X, y, run_config, candidate_wrapper = None, stop_reward = 1., stop_after_n_epochs = 1, max_n_evaluations = None,
+        checkpoint_path = None, checkpoint_every = 10, resume_path = None, migrator = None):
     """
     Run a symbolic regression task on (X,y) data.
     Parameters
@@ -29,6 +55,16 @@ def fit(X, y, run_config, candidate_wrapper = None, stop_reward = 1., stop_after
         the symbolic regression task if the limit is about to be reached. The parameter max_n_evaluations is distinct
         from batch_size * n_epochs because batch_size * n_epochs sets the number of expressions generated but a lot of
         these are not evaluated because they have inconsistent units.
+    checkpoint_path : str or None, optional
+        If not None, state of the run is periodically and atomically saved to this path (see learn.learner).
+    checkpoint_every : int, optional
+        Number of epochs between checkpoints.
+    resume_path : str or None, optional
+        If not None, resumes run from checkpoint saved at this path (run_config must be the same as the checkpointed
+        run's).
+    migrator : learn.migration.FileMigrator or None, optional
+        If not None, this run is an island exchanging its best programs with other islands through migrator (see
+        learn.learner and task.islands).
     Returns
     -------
     hall_of_fame_R, hall_of_fame : list of float, list of physym.program.Program
@@ -42,20 +78,85 @@ def fit(X, y, run_config, candidate_wrapper = None, stop_reward = 1., stop_after
      #todo: no plot visualiser by default, text only
      #todo: check risk_factor, gamma_decay, entropy_weight
 
-    def batch_reseter():
+    # In data-parallel mode, each rank of the (initialized) process group samples its own shard of the batch
+    data_parallel = run_config["learning_config"].get("data_parallel", False)
+    batch_size    = run_config["learning_config"]["batch_size"]
+    if data_parallel:
+        world_size = torch.distributed.get_world_size()
+        assert batch_size % world_size == 0, "In data-parallel mode, batch_size must be divisible by the nb. of ranks."
+        batch_size = batch_size // world_size
+
+    # Adaptive max_time_step : batches are first built with a smaller max_time_step which is increased during the run
+    max_time_step         = run_config["learning_config"]["max_time_step"]
+    initial_max_time_step = run_config["learning_config"].get("initial_max_time_step", None)
+
+    def batch_maker(batch_size = batch_size, max_time_step = max_time_step):
         return  Batch.Batch (library_args          = run_config["library_config"],
-                             priors_config         = run_config["priors_config"],
-                             batch_size            = run_config["learning_config"]["batch_size"],
-                             max_time_step         = run_config["learning_config"]["max_time_step"],
+                             priors_config         = get_priors_config(run_config["priors_config"], max_time_step),
+                             batch_size            = batch_size,
+                             max_time_step         = max_time_step,
                              rewards_computer      = run_config["learning_config"]["rewards_computer"],
                              free_const_opti_args  = run_config["free_const_opti_args"],
                              X        = X,
                              y_target = y,
                              candidate_wrapper = candidate_wrapper,
                              observe_units     = run_config["learning_config"]["observe_units"],
+                             compact_dtypes    = run_config["learning_config"].get("compact_dtypes", False),
+                             store_ancestors_pos = run_config["learning_config"].get("store_ancestors_pos", True),
+                             # Tokens are observed as idx if the cell embeds them
+                             obs_tokens_as_idx   = run_config["cell_config"].get("tokens_embedding_size") is not None,
                              )
 
-    batch = batch_reseter()
+    # Batch is only built once and then reset in place at each epoch (re-using allocated arrays, library, priors'
+    # static tables and dataset), it is only re-built when max_time_step is increased in adaptive mode
+    curr_max_time_step = max_time_step if initial_max_time_step is None else initial_max_time_step
+    batch = batch_maker(max_time_step = curr_max_time_step)
+
+    # In pipelined mode, rewards of a batch are computed while the next one is sampled : alternating between two
+    # batches
+    pipelined = run_config["learning_config"].get("pipelined", False)
+    batches   = [batch, batch_maker(max_time_step = curr_max_time_step)] if pipelined else [batch]
+
+    # Re-allocating batches with a new max_time_step (adaptive max_time_step)
+    max_time_step_resizer = None
+    if initial_max_time_step is not None:
+        def max_time_step_resizer(new_max_time_step):
+            for i in range(len(batches)):
+                batches[i] = batch_maker(max_time_step = new_max_time_step)
+
+    def batch_reseter():
+        batches[0].reset()
+        return batches[0]
+
+    pipelined_batch_reseter = None
+    if pipelined:
+        def pipelined_batch_reseter():
+            batches[1].reset()
+            return batches[1]
+
+    # Island model : batch in which programs received from other islands are replayed
+    migrants_batch_reseter = None
+    if migrator is not None:
+        migrants_batch = batch_maker(batch_size = migrator.n_immigrants)
+        def migrants_batch_reseter():
+            migrants_batch.reset()
+            return migrants_batch
+
+    # Replay : batch in which best programs of previous epochs are replayed
+    replay_size          = run_config["learning_config"].get("replay_size", 0)
+    replay_batch_reseter = None
+    if replay_size > 0:
+        replay_batch = batch_maker(batch_size = replay_size)
+        def replay_batch_reseter():
+            replay_batch.reset()
+            return replay_batch
+
+    # Surrogate pre-ranking : only programs predicted to be promising are evaluated
+    surrogate = None
+    if run_config["learning_config"].get("surrogate_fraction", None) is not None:
+        surrogate = Surrogate.RewardSurrogate(fraction    = run_config["learning_config"]["surrogate_fraction"],
+                                              exploration = run_config["learning_config"].get("surrogate_exploration", 0.1),
+                                              min_samples = batch_size,)
 
     def cell_reseter ():
         input_size  = batch.obs_size
@@ -85,6 +186,24 @@ def fit(X, y, run_config, candidate_wrapper = None, stop_reward = 1., stop_after
                                                     max_n_evaluations   = max_n_evaluations,
                                                     run_logger          = run_config["run_logger"],
                                                     run_visualiser      = run_config["run_visualiser"],
+                                                    compile_sampling_step = run_config["learning_config"].get("compile_sampling_step", None),
+                                                    recompute_elite     = run_config["learning_config"].get("recompute_elite", False),
+                                                    n_micro_batches     = run_config["learning_config"].get("n_micro_batches", 1),
+                                                    pipelined           = pipelined,
+                                                    pipelined_batch_reseter = pipelined_batch_reseter,
+                                                    checkpoint_path     = checkpoint_path,
+                                                    checkpoint_every    = checkpoint_every,
+                                                    resume_path         = resume_path,
+                                                    data_parallel       = data_parallel,
+                                                    migrator            = migrator,
+                                                    migrants_batch_reseter = migrants_batch_reseter,
+                                                    replay_size         = replay_size,
+                                                    replay_batch_reseter = replay_batch_reseter,
+                                                    max_time_step_resizer = max_time_step_resizer,
+                                                    max_time_step_limit   = max_time_step,
+                                                    max_time_step_growth  = run_config["learning_config"].get("max_time_step_growth", 5),
+                                                    max_time_step_trigger = run_config["learning_config"].get("max_time_step_trigger", 0.1),
+                                                    surrogate             = surrogate,
                                                    )
 
     return hall_of_fame_R, hall_of_fame
\ No newline at end of file
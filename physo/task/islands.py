@@ -0,0 +1,95 @@
+import os
+import multiprocessing
+
+import torch
+import numpy as np
+
+# Internal imports
+from physo.physym import library as Lib
+from physo.learn import checkpoint
+from physo.learn import migration
+from physo.task.fit import fit
+
+
+def island_worker (island_id, X, y, run_config, seed, migration_dir, n_migrants, migration_period, fit_kwargs):
+    """
+    Runs one island of an island model (see fit_islands) and saves its results in migration_dir.
+    """
+    # Seed of this island
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    migrator = migration.FileMigrator(directory  = migration_dir,
+                                      island_id  = island_id,
+                                      n_migrants = n_migrants,
+                                      period     = migration_period)
+    hall_of_fame_R, hall_of_fame = fit(X, y, run_config, migrator = migrator, **fit_kwargs)
+    # Results
+    results = {"hall_of_fame_R" : hall_of_fame_R,
+               "hall_of_fame"   : [checkpoint.program_to_state(prog) for prog in hall_of_fame]}
+    checkpoint.save_checkpoint(results, os.path.join(migration_dir, "island_%s.results"%(island_id)))
+    return None
+
+
+def fit_islands (X, y, run_configs, seeds, migration_dir, n_migrants = 10, migration_period = 10, candidate_wrapper = None,
+                 stop_reward = 1., stop_after_n_epochs = 1, max_n_evaluations = None):
+    """
+    Runs an island model symbolic regression task on (X,y) data : independent fit runs (islands) are launched as
+    separate processes each with its own seed (and possibly its own config) and periodically exchange their best
+    programs through files in migration_dir (see learn.migration.FileMigrator). Programs received from other islands
+    are added to elite candidates of the receiving island if they are good enough (see learn.learner). Islands running
+    on other nodes can join by running fit with a FileMigrator using the same (shared) directory.
+    Parameters
+    ----------
+    X : torch.tensor of shape (n_dim, ?,) of float
+        Values of the input variables of the problem with n_dim = nb of input variables.
+    y : torch.tensor of shape (?,) of float
+        Values of the target symbolic function on input variables contained in X.
+    run_configs : dict or list of dict
+        Run configuration of each island (or a single one used by all islands), see fit.
+    seeds : list of int
+        Seed of each island (the nb. of islands being the length of this list).
+    migration_dir : str
+        Directory through which islands exchange their best programs.
+    n_migrants : int, optional
+        Number of best programs published by each island.
+    migration_period : int, optional
+        Number of epochs between migrations.
+    candidate_wrapper, stop_reward, stop_after_n_epochs, max_n_evaluations
+        See fit (applying to each island).
+    Returns
+    -------
+    islands_results : list of (list of float, list of physym.program.Program)
+        hall_of_fame_R and hall_of_fame of each island (see fit).
+    """
+    n_islands = len(seeds)
+    if isinstance(run_configs, dict):
+        run_configs = [run_configs]*n_islands
+    assert len(run_configs) == n_islands, "There should be one run config per island (ie. per seed)."
+
+    fit_kwargs = {"candidate_wrapper"   : candidate_wrapper,
+                  "stop_reward"         : stop_reward,
+                  "stop_after_n_epochs" : stop_after_n_epochs,
+                  "max_n_evaluations"   : max_n_evaluations,}
+
+    # Islands are forked so run configs (containing functions, loggers etc.) do not need to be pickled
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target = island_worker,
+                             args   = (i, X, y, run_configs[i], seeds[i], migration_dir, n_migrants, migration_period,
+                                       fit_kwargs))
+                 for i in range(n_islands)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    for i, process in enumerate(processes):
+        assert process.exitcode == 0, "Island %i failed (exit code = %i)."%(i, process.exitcode)
+
+    # Collecting results
+    islands_results = []
+    for i in range(n_islands):
+        results = checkpoint.load_checkpoint(os.path.join(migration_dir, "island_%s.results"%(i)))
+        library = Lib.Library(**run_configs[i]["library_config"])
+        hall_of_fame = [checkpoint.program_from_state(prog_state, library, candidate_wrapper)
+                        for prog_state in results["hall_of_fame"]]
+        islands_results.append((results["hall_of_fame_R"], hall_of_fame))
+    return islands_results
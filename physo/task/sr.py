@@ -55,6 +55,10 @@ def SR(X, y,
        # Parallel mode
        parallel_mode = True,
        n_cpus        = None,
+       # Checkpointing
+       checkpoint_path  = None,
+       checkpoint_every = 10,
+       resume_path      = None,
        ):
     """
     Runs a symbolic regression task with default hyperparameters config.
@@ -119,6 +123,15 @@ def SR(X, y,
         Number of CPUs to use when running in parallel mode. Uses max nb. of CPUs by default.
         Overides parameter in run_config.
 
+    checkpoint_path : str or None (optional)
+        If not None, state of the run is periodically and atomically saved to this path so it can be resumed if
+        interrupted (see resume_path). No checkpointing by default.
+    checkpoint_every : int (optional)
+        Number of epochs between checkpoints (10 by default).
+    resume_path : str or None (optional)
+        If not None, resumes run from checkpoint saved at this path, continuing exactly where the run stopped (other
+        arguments must be the same as the checkpointed run's).
+
     Returns
     -------
     best_expression, run_logger : physo.physym.program.Program, physo.learn.monitoring.RunLogger
@@ -280,6 +293,9 @@ def SR(X, y,
                                 stop_reward         = stop_reward,
                                 stop_after_n_epochs = default_stop_after_n_epochs,
                                 max_n_evaluations   = max_n_evaluations,
+                                checkpoint_path     = checkpoint_path,
+                                checkpoint_every    = checkpoint_every,
+                                resume_path         = resume_path,
                                )
 
     # ------------------------------- RESULTS -------------------------------
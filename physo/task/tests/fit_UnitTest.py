@@ -0,0 +1,85 @@
+import numpy as np
+import torch
+# Internal code import
+import physo
+import physo.learn.monitoring as monitoring
+from physo.physym import reward
+from physo.physym.functions import data_conversion
+
+import unittest
+
+class Test_Fit(unittest.TestCase):
+
+    def test_get_priors_config(self):
+        priors_config = [("UniformArityPrior", None),
+                         ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),]
+        # Clipped
+        self.assertEqual(physo.task.fit.get_priors_config(priors_config, max_time_step = 6),
+                         [("UniformArityPrior", None),
+                          ("HardLengthPrior", {"min_length": 1, "max_length": 6, }),])
+        # Unchanged
+        self.assertEqual(physo.task.fit.get_priors_config(priors_config, max_time_step = 10), priors_config)
+        self.assertEqual(priors_config[1][1]["max_length"], 10)
+        return None
+
+    def test_fit_adaptive_max_time_step(self):
+
+        # Seed
+        torch.manual_seed(0)
+        np.random.seed(0)
+
+        # Dataset
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y = data_conversion(x_array**2 + x_array)
+
+        # Run config (small and fast)
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        run_logger = monitoring.RunLogger()
+        run_config = {
+            "library_config"  : {"args_make_tokens"  : args_make_tokens,
+                                 "superparent_units" : [1, 0, 0],
+                                 "superparent_name"  : "y",},
+            "priors_config"   : [("UniformArityPrior", None),
+                                 ("HardLengthPrior", {"min_length": 1, "max_length": 12, }),],
+            "learning_config" : {'batch_size'       : 50,
+                                 'max_time_step'    : 12,
+                                 'n_epochs'         : 4,
+                                 'gamma_decay'      : 0.7,
+                                 'entropy_weight'   : 0.005,
+                                 'risk_factor'      : 0.5,
+                                 'rewards_computer' : reward.make_RewardsComputer(reward_function = reward.SquashedNRMSE),
+                                 'get_optimizer'    : lambda model : torch.optim.Adam(model.parameters(), lr=0.0025),
+                                 'observe_units'    : True,
+                                 # Adaptive max_time_step
+                                 'initial_max_time_step' : 4,
+                                 'max_time_step_growth'  : 4,
+                                 'max_time_step_trigger' : 0.1,},
+            "free_const_opti_args" : None,
+            "cell_config"     : {"hidden_size" : 16},
+            "run_logger"      : run_logger,
+            "run_visualiser"  : None,
+        }
+        hall_of_fame_R, hall_of_fame = physo.fit(X, y, run_config)
+
+        # max_time_step of batch of each epoch
+        max_time_steps = np.array(run_logger.n_sampling_steps_history) + np.array(run_logger.saved_steps_history)
+        self.assertEqual(max_time_steps[0], 4)
+        # Increasing up to configured max_time_step
+        self.assertTrue((np.diff(max_time_steps) >= 0).all())
+        self.assertTrue(max_time_steps[-1] > 4)
+        self.assertTrue(max_time_steps.max() <= 12)
+        self.assertTrue(set(max_time_steps).issubset({4, 8, 12}))
+        self.assertTrue(np.isfinite(hall_of_fame_R).all())
+        return None
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import numpy as np
+import torch
+# Internal code import
+import physo
+from physo.physym import reward
+from physo.physym.functions import data_conversion
+
+import unittest
+
+class Test_Islands(unittest.TestCase):
+    def test_fit_islands(self):
+
+        # Dataset
+        x_array = np.linspace(0.04, 4, 100)
+        X = torch.stack((data_conversion(x_array),), axis=0)
+        y = data_conversion(x_array**2 + x_array)
+
+        # Run config (small and fast)
+        args_make_tokens = {
+                        # operations
+                        "op_names"             : ["add", "mul", "div", "sqrt", "n2", "cos", "exp", "log"],
+                        "use_protected_ops"    : True,
+                        # input variables
+                        "input_var_ids"        : {"x" : 0         },
+                        "input_var_units"      : {"x" : [1, 0, 0] },
+                        "input_var_complexity" : {"x" : 0.        },
+                            }
+        def make_run_config(batch_size):
+            config = {
+                "library_config"  : {"args_make_tokens"  : args_make_tokens,
+                                     "superparent_units" : [1, 0, 0],
+                                     "superparent_name"  : "y",},
+                "priors_config"   : [("UniformArityPrior", None),
+                                     ("HardLengthPrior", {"min_length": 1, "max_length": 10, }),],
+                "learning_config" : {'batch_size'       : batch_size,
+                                     'max_time_step'    : 10,
+                                     'n_epochs'         : 4,
+                                     'gamma_decay'      : 0.7,
+                                     'entropy_weight'   : 0.005,
+                                     'risk_factor'      : 0.1,
+                                     'rewards_computer' : reward.make_RewardsComputer(reward_function = reward.SquashedNRMSE),
+                                     'get_optimizer'    : lambda model : torch.optim.Adam(model.parameters(), lr=0.0025),
+                                     'observe_units'    : True,},
+                "free_const_opti_args" : None,
+                "cell_config"     : {"hidden_size" : 16},
+                "run_logger"      : None,
+                "run_visualiser"  : None,
+            }
+            return config
+
+        with tempfile.TemporaryDirectory() as migration_dir:
+            # Two islands having different configs
+            islands_results = physo.task.islands.fit_islands(X, y,
+                                                             run_configs      = [make_run_config(50), make_run_config(40)],
+                                                             seeds            = [0, 1],
+                                                             migration_dir    = migration_dir,
+                                                             n_migrants       = 5,
+                                                             migration_period = 2,)
+            # Both islands published their best programs
+            for island_id in range(2):
+                self.assertTrue(os.path.exists(os.path.join(migration_dir, "island_%i.migrants"%(island_id))))
+
+        # Results of each island
+        self.assertEqual(len(islands_results), 2)
+        for hall_of_fame_R, hall_of_fame in islands_results:
+            self.assertEqual(len(hall_of_fame_R), 4)
+            self.assertEqual(len(hall_of_fame), len(np.unique(hall_of_fame_R)))
+            self.assertTrue(np.isfinite(hall_of_fame_R).all())
+            # Programs can be executed
+            y_pred = hall_of_fame[-1].execute(X)
+            self.assertEqual(y_pred.shape, y.shape)
+        return None
+
+if __name__ == '__main__':
+    unittest.main()
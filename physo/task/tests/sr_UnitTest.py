@@ -63,6 +63,13 @@ class Test_SR(unittest.TestCase):
         # Assert that solution expression was found
         assert pareto_front_r.max() > 0.9999, "Solution expression was not found."
 
+        # Sampling stops once all programs are complete
+        self.assertEqual(len(logs.saved_steps_history), len(logs.epochs_history))
+        max_time_step = physo.config.config0.config0["learning_config"]["max_time_step"]
+        for n_steps, saved_steps in zip(logs.n_sampling_steps_history, logs.saved_steps_history):
+            self.assertEqual(n_steps + saved_steps, max_time_step)
+            self.assertTrue(0 < n_steps <= max_time_step)
+
 
         return None
 